@@ -1,7 +1,7 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from reversion.admin import VersionAdmin
 from .models import *
-from .utils import obter_feriados
+from .utils import calendario_dias
 from django.utils import timezone
 from django.template.defaulttags import register
 from .forms import MilitarForm, ServicoForm, EscalaForm
@@ -11,14 +11,21 @@ from django.urls import reverse, path
 from django.utils.html import format_html_join
 from django.utils.safestring import mark_safe
 from .services.pdf_exports import gerar_pdf_escala
-from django.http import FileResponse, Http404, HttpResponse
+from .services.cache_pdf import chave_pdf, resposta_pdf, resposta_pdf_em_cache
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse
+from django.core.serializers.json import DjangoJSONEncoder
 from collections import defaultdict
 from django.contrib import admin, messages
 from datetime import date, datetime, timedelta
 from django import forms
 # Permite alterar os seguintes modelos na admin view
-from .models import Militar, Dispensa, Escala, Servico, Log, Feriado, EscalaMilitar, ConfiguracaoUnidade
+from .models import Militar, Dispensa, Escala, Servico, Log, Feriado, EscalaMilitar, ConfiguracaoUnidade, TarefaGeracao
 from .services.escala_service import EscalaService
+from .signals import criar_log
+from django.db import transaction
+from .services.tarefas_geracao import enfileirar_geracao, estado_tarefa
+from .services.matriz_disponibilidade import mapa_calor_servicos
+from .services.indice_dispensas import IndiceDispensas
 from django.contrib.admin.models import LogEntry
 from django.contrib.admin.views.decorators import staff_member_required
 from .views import ERRO_PREVISAO_DIA_ATUAL
@@ -62,7 +69,8 @@ class ServicoAdmin(VersionAdmin):
             'fields': ('nome',)
         }),
         ('Configurações do Serviço', {
-            'fields': ('hora_inicio', 'hora_fim', 'n_elementos', 'n_reservas', 'tipo_escalas', 'armamento'),
+            'fields': ('hora_inicio', 'hora_fim', 'n_elementos', 'n_reservas', 'tipo_escalas', 'armamento',
+                       'motor_geracao'),
             'classes': ('wide',)
         }),
         ('Militares', {
@@ -73,6 +81,47 @@ class ServicoAdmin(VersionAdmin):
     filter_horizontal = ('militares',)
     readonly_fields = ['ver_escalas']
 
+    def get_urls(self):
+        urls = super().get_urls()
+        custom_urls = [
+            path('mapa-escassez/', self.admin_site.admin_view(self.mapa_escassez_view), name='mapa-escassez'),
+        ]
+        return custom_urls + urls
+
+    def mapa_escassez_view(self, request):
+        """Mapa de calor da escassez de militares de todos os serviços para os próximos 365 dias."""
+        hoje = timezone.now().date()
+        data_fim = hoje + timedelta(days=364)
+        try:
+            minimo = max(1, int(request.GET.get('minimo', 4)))
+        except ValueError:
+            minimo = 4
+
+        servicos = list(Servico.objects.order_by('nome'))
+        mapa = mapa_calor_servicos(servicos, hoje, data_fim, minimo)
+        dias = [hoje + timedelta(days=d) for d in range(365)]
+
+        linhas = []
+        for servico in servicos:
+            dados = mapa[servico.pk]
+            linhas.append({
+                'servico': servico,
+                'total': dados['total'],
+                'periodos': dados['periodos'],
+                'celulas': list(zip(dias, dados['disponiveis'].tolist(), dados['niveis'].tolist())),
+            })
+
+        context = {
+            **self.admin_site.each_context(request),
+            'title': 'Mapa de Escassez',
+            'linhas': linhas,
+            'dias': dias,
+            'minimo': minimo,
+            'hoje': hoje,
+            'data_fim': data_fim,
+        }
+        return render(request, 'admin/mapa_escassez.html', context)
+
     # Shows Escalas in Service View
     def escalas_col(self, obj):
         if hasattr(obj, "escalas"):
@@ -177,14 +226,24 @@ class EscalaAdmin(VersionAdmin):
             if not escala:
                 raise Http404("Escala não encontrada")
             
+            # A chave é o próprio conteúdo da tabela (militares e ordem), mais a unidade
+            filename = f"escala_{escala.pk}_militares.pdf"
+            config = ConfiguracaoUnidade.objects.first()
+            chave = chave_pdf(
+                'militares_escala', escala.pk, str(escala),
+                (config.nome_unidade, config.nome_subunidade) if config else None,
+                list(EscalaMilitar.objects.filter(escala=escala).order_by("ordem").values_list(
+                    'militar__nim', 'militar__posto', 'militar__nome', 'ordem'))
+            )
+            em_cache = resposta_pdf_em_cache(chave, filename)
+            if em_cache:
+                return em_cache
+            
             pdf_buffer = gerar_pdf_escala(escala)
             if not pdf_buffer:
                 raise ValueError("Erro ao gerar o PDF")
             
-            filename = f"escala_{escala.pk}_militares.pdf"
-            response = HttpResponse(pdf_buffer.read(), content_type='application/pdf')
-            response['Content-Disposition'] = f'attachment; filename="{filename}"'
-            return response
+            return resposta_pdf(chave, pdf_buffer.read(), filename)
         except Exception as e:
             messages.error(request, f"Erro ao gerar PDF: {str(e)}")
             return redirect('admin:core_escala_change', object_id)
@@ -231,6 +290,30 @@ class EscalaAdmin(VersionAdmin):
                     ordem=max_ordem
                 )
 
+def reparar_escalas_apos_commit(dispensa, periodo_anterior=None, removida=False):
+    """
+    Repara as escalas já geradas depois do commit da dispensa criada, alterada ou removida (e só se o
+    commit acontecer): substitui as nomeações que a dispensa invalida e preenche as vagas nos dias que
+    deixou de ocupar. `periodo_anterior` é (data_inicio, data_fim) antes da alteração.
+    """
+    def reparar():
+        removidas = 0 if removida else EscalaService.reparar_escalas_dispensa(dispensa)
+        if removidas:
+            acao = f"Reajustadas {removidas} nomeações devido à dispensa de {dispensa.militar.nome}"
+            criar_log(12345678, acao, 'Nomeacao', 'UPDATE')
+
+        if periodo_anterior:
+            libertados = EscalaService.dias_afetados_dispensa(*periodo_anterior)
+            if not removida:
+                libertados -= EscalaService.dias_afetados_dispensa(dispensa.data_inicio, dispensa.data_fim)
+            preenchidas = EscalaService.preencher_dias_libertados(dispensa.militar_id, libertados)
+            if preenchidas:
+                acao = f"Preenchidas {preenchidas} vagas nos dias libertados pela dispensa de {dispensa.militar.nome}"
+                criar_log(12345678, acao, 'Nomeacao', 'UPDATE')
+
+    transaction.on_commit(reparar)
+
+
 class DispensaAdmin(VersionAdmin):
     list_display = ('militar', 'data_inicio', 'data_fim', 'motivo', 'servico_atual')
     list_filter = ('militar__servicos', 'data_inicio', 'data_fim')
@@ -243,6 +326,24 @@ class DispensaAdmin(VersionAdmin):
         return ", ".join(str(s) for s in servicos)
     servico_atual.short_description = "Serviço Atual"
 
+    def save_model(self, request, obj, form, change):
+        periodo_anterior = None
+        if change:
+            periodo_anterior = Dispensa.objects.filter(pk=obj.pk).values_list('data_inicio', 'data_fim').first()
+        super().save_model(request, obj, form, change)
+        reparar_escalas_apos_commit(obj, periodo_anterior)
+
+    def delete_model(self, request, obj):
+        periodo = (obj.data_inicio, obj.data_fim)
+        super().delete_model(request, obj)
+        reparar_escalas_apos_commit(obj, periodo, removida=True)
+
+    def delete_queryset(self, request, queryset):
+        dispensas = list(queryset)
+        super().delete_queryset(request, queryset)
+        for dispensa in dispensas:
+            reparar_escalas_apos_commit(dispensa, (dispensa.data_inicio, dispensa.data_fim), removida=True)
+
     def changelist_view(self, request, extra_context=None):
         extra_context = extra_context or {}
         extra_context['show_mapa_link'] = True
@@ -260,115 +361,22 @@ class DispensaAdmin(VersionAdmin):
         # Obter o serviço selecionado do filtro
         servico_id = request.GET.get('servico')
         servico_selecionado = None
-        servicos = Servico.objects.all()
         
         if servico_id:
             servico_selecionado = get_object_or_404(Servico, id=servico_id)
-            servicos = [servico_selecionado]
         
         hoje = timezone.now().date()
         # Calcular dias até ao final do ano
         ultimo_dia_ano = date(hoje.year, 12, 31)
         dias_restantes = (ultimo_dia_ano - hoje).days
         
-        # Obter lista de feriados
-        feriados = obter_feriados(hoje, ultimo_dia_ano)
-        
-        # Agrupar dias por mês
-        dias_por_mes = {}
-        dias = []
-        data_atual = hoje
-        
-        while data_atual <= ultimo_dia_ano:
-            mes = data_atual.replace(day=1)
-            if mes not in dias_por_mes:
-                dias_por_mes[mes] = []
-            
-            e_fim_semana = data_atual.weekday() >= 5  # 5 = Sábado, 6 = Domingo
-            e_feriado = data_atual in feriados
-            
-            dia_info = {
-                'data': data_atual, 
-                'mes': mes,
-                'dia_semana': data_atual.strftime('%A'),
-                'e_fim_semana': e_fim_semana,
-                'e_feriado': e_feriado
-            }
-            
-            dias_por_mes[mes].append(dia_info)
-            dias.append(dia_info)
-            data_atual += timedelta(days=1)
-        
-        mapa_dispensas = {}
-        for servico in servicos:
-            # Obter todos os militares do serviço, ordenados por posto e NIM, usando select_related para otimizar
-            militares = servico.militares.all().select_related('user').order_by('posto', 'nim')
-            dispensas_servico = {}
-            
-            # Initialize summary data
-            resumo = {
-                'dispensados': {},
-                'disponiveis': {},
-                'total': {}
-            }
-            
-            for militar in militares:
-                dispensas = {}
-                # Obter todas as dispensas do militar no período
-                dispensas_periodo = Dispensa.objects.filter(
-                    militar=militar,
-                    data_inicio__lte=ultimo_dia_ano,
-                    data_fim__gte=hoje
-                )
-                
-                for dia in dias:
-                    # Verificar se o militar tem dispensa neste dia
-                    dispensa = next(
-                        (d for d in dispensas_periodo if d.data_inicio <= dia['data'] <= d.data_fim),
-                        None
-                    )
-                    
-                    if dispensa:
-                        dispensas[dia['data']] = {
-                            'motivo': dispensa.motivo
-                        }
-                        # Update summary for dispensados
-                        if dia['data'] not in resumo['dispensados']:
-                            resumo['dispensados'][dia['data']] = 0
-                        resumo['dispensados'][dia['data']] += 1
-                    
-                    # Update total
-                    if dia['data'] not in resumo['total']:
-                        resumo['total'][dia['data']] = 0
-                    resumo['total'][dia['data']] += 1
-                
-                dispensas_servico[militar] = dispensas
-            
-            # Calculate disponiveis for each day
-            for dia in dias:
-                total = resumo['total'].get(dia['data'], 0)
-                dispensados = resumo['dispensados'].get(dia['data'], 0)
-                resumo['disponiveis'][dia['data']] = total - dispensados
-            
-            mapa_dispensas[servico] = {
-                'militares': dispensas_servico,
-                'resumo': resumo
-            }
-        
-        if dias:
-            feriados = obter_feriados(min(d['data'] for d in dias), max(d['data'] for d in dias))
-        else:
-            feriados = []
-
+        # A grelha é carregada mês a mês pela API `mapa_dispensas_dados`
         return render(request, 'admin/mapa_dispensas.html', {
-            'mapa_dispensas': mapa_dispensas,
-            'dias': dias,
-            'dias_por_mes': dias_por_mes,
             'servicos': Servico.objects.all(),
             'servico_selecionado': servico_selecionado,
             'hoje': hoje,
+            'data_fim': ultimo_dia_ano,
             'dias_restantes': dias_restantes,
-            'feriados': feriados,
         })
 
     def adicionar_dispensa_view(self, request):
@@ -381,6 +389,7 @@ class DispensaAdmin(VersionAdmin):
                     data_fim=request.POST.get('data_fim'),
                     motivo=request.POST.get('motivo')
                 )
+                reparar_escalas_apos_commit(dispensa)
                 messages.success(request, 'Dispensa criada com sucesso.')
             except Exception as e:
                 messages.error(request, f'Erro ao criar dispensa: {str(e)}')
@@ -432,12 +441,13 @@ class PrevisaoEscalasAdmin(VersionAdmin):
                 if alerta:
                     messages.warning(request, alerta)
 
-                ok = EscalaService.gerar_escalas_automaticamente(servico, data_inicio, data_fim)
-                if not ok and data_inicio <= date.today():
+                if data_inicio <= date.today():
                     messages.error(request, ERRO_PREVISAO_DIA_ATUAL)
                 else:
-                    msg = "Previsões geradas com sucesso!" if ok else "Erro ao gerar previsões."
-                    (messages.success if ok else messages.error)(request, msg)
+                    # A geração é feita pelo processo de trabalho; a página acompanha o progresso
+                    tarefa = enfileirar_geracao(data_inicio, data_fim, servico, request.user)
+                    messages.info(request, "Geração de previsões em fila de espera.")
+                    return redirect(f"{request.path}?servico={servico_id}&tarefa={tarefa.pk}")
 
             except Exception as exc:  # pylint: disable=broad-except
                 messages.error(request, f"Erro: {exc}")
@@ -492,9 +502,29 @@ class PrevisaoEscalasAdmin(VersionAdmin):
                 self.admin_site.admin_view(self.remover_previsao),
                 name="remover_previsao",
             ),
+            path(
+                "tarefas/<int:tarefa_id>/estado/",
+                self.admin_site.admin_view(self.estado_tarefa_view),
+                name="estado_tarefa_geracao",
+            ),
         ]
         return custom + urls
 
+    # Estado de uma tarefa de geração (JSON), consultado periodicamente pela página de previsões
+    def estado_tarefa_view(self, request, tarefa_id):
+        tarefa = get_object_or_404(TarefaGeracao.objects.select_related("servico"), pk=tarefa_id)
+        return JsonResponse(estado_tarefa(tarefa), encoder=DjangoJSONEncoder)
+
+    def _enfileirar(self, request, data_inicio, data_fim, servico=None):
+        """Enfileira uma tarefa de geração e devolve o parâmetro `tarefa` para o redirecionamento."""
+        try:
+            tarefa = enfileirar_geracao(data_inicio, data_fim, servico, request.user)
+        except ValueError as exc:
+            messages.error(request, str(exc))
+            return ""
+        messages.info(request, "Geração de previsões em fila de espera.")
+        return f"&tarefa={tarefa.pk}"
+
     #  Remover flag 'prevista' de uma Escala
     def remover_previsao(self, request, escala_id):
         try:
@@ -534,6 +564,38 @@ class PrevisaoEscalasAdmin(VersionAdmin):
     # 5. Tela principal de previsões
 
     def previsao_view(self, request):
+        # ---------- geração de todos os serviços da unidade (POST) ----------
+        if request.method == "POST" and "gerar_todos" in request.POST:
+            servico_id = request.POST.get("servico")
+            data_inicio = date.fromisoformat(request.POST.get("data_inicio"))
+            data_fim = date.fromisoformat(request.POST.get("data_fim"))
+
+            tarefa = self._enfileirar(request, data_inicio, data_fim)
+            return redirect(f"{request.path}?servico={servico_id}&data_fim={data_fim.isoformat()}{tarefa}")
+
+        # ---------- simulação sem gravar (POST) ----------
+        if request.method == "POST" and "simular_escalas" in request.POST:
+            data_inicio = date.fromisoformat(request.POST.get("data_inicio"))
+            data_fim = date.fromisoformat(request.POST.get("data_fim"))
+            servico = Servico.objects.get(pk=request.POST.get("servico"))
+
+            try:
+                simulacao = EscalaService.simular_escalas([servico], data_inicio, data_fim)
+            except ValueError as exc:
+                messages.error(request, str(exc))
+                return redirect(f"{request.path}?servico={servico.pk}&data_fim={data_fim.isoformat()}")
+
+            if request.POST.get("formato") == "json":
+                return JsonResponse(simulacao, encoder=DjangoJSONEncoder)
+
+            context = self.get_previsao_context(request, servico, data_fim)
+            context.update({
+                'simulacao': simulacao,
+                'simulacao_dias': self._agrupar_simulacao_por_dia(simulacao),
+                'form_data_POST': request.POST,
+            })
+            return render(request, 'admin/escala/previsao.html', context)
+
         # ---------- geração automática (POST) ----------
         if request.method == "POST" and "gerar_escalas" in request.POST:
             servico_id = request.POST.get("servico")
@@ -553,14 +615,9 @@ class PrevisaoEscalasAdmin(VersionAdmin):
                     })
                     return render(request, 'admin/escala/previsao.html', context)
 
-            # Se não houve alerta ou o utilizador confirmou, gerar a escala
-            ok = EscalaService.gerar_escalas_automaticamente(servico, data_inicio, data_fim)
-            if ok:
-                messages.success(request, "Previsões geradas com sucesso!")
-            else:
-                messages.error(request, "Ocorreu um erro ao gerar as previsões.")
-
-            return redirect(f"{request.path}?servico={servico_id}&data_fim={data_fim.isoformat()}")
+            # Se não houve alerta ou o utilizador confirmou, enfileirar a geração
+            tarefa = self._enfileirar(request, data_inicio, data_fim, servico)
+            return redirect(f"{request.path}?servico={servico_id}&data_fim={data_fim.isoformat()}{tarefa}")
 
         # ---------- parâmetros GET ----------
         servico_id = request.GET.get("servico")
@@ -583,19 +640,34 @@ class PrevisaoEscalasAdmin(VersionAdmin):
             data_fim = hoje + timedelta(days=30)
         
         context = self.get_previsao_context(request, servico, data_fim)
+        tarefa_id = request.GET.get("tarefa")
+        if tarefa_id and tarefa_id.isdigit():
+            context["tarefa"] = TarefaGeracao.objects.filter(pk=tarefa_id).first()
         return render(request, 'admin/escala/previsao.html', context)
 
+    @staticmethod
+    def _agrupar_simulacao_por_dia(simulacao):
+        """Agrupa as nomeações simuladas por dia, com o nome de cada militar, para a tabela de pré-visualização."""
+        contagens = simulacao['contagens']
+        dias = {}
+        for nomeacao in simulacao['nomeacoes']:
+            dia = dias.setdefault(nomeacao['data'], {
+                'data': nomeacao['data'], 'e_escala_b': nomeacao['e_escala_b'], 'efetivos': [], 'reservas': []})
+            militar = contagens[nomeacao['nim']]
+            descricao = f"{militar['posto'].capitalize()} {nomeacao['nim']} {militar['nome']}"
+            dia['reservas' if nomeacao['e_reserva'] else 'efetivos'].append(descricao)
+        return list(dias.values())
+
     def get_previsao_context(self, request, servico, data_fim):
         """Método auxiliar para construir o contexto da página de previsão."""
         hoje = date.today()
-        # ---------- feriados / dias de escala ----------
-        feriados = obter_feriados(hoje, data_fim)
-        dias_escala = EscalaService.obter_dias_escala(hoje, data_fim)
+        historico_ini = hoje - timedelta(days=30)
+        # ---------- calendário do histórico e dos dias futuros ----------
+        calendario = calendario_dias(historico_ini, max(data_fim, hoje))
 
         datas = []
 
         # --- histórico (últimos 30 dias) ---
-        historico_ini = hoje - timedelta(days=30)
         historico_qs = (
             Nomeacao.objects.filter(
                 escala_militar__escala__servico=servico,
@@ -612,69 +684,54 @@ class PrevisaoEscalasAdmin(VersionAdmin):
 
         # Adicionar histórico aos dados
         for dia, nomeacoes in nomeacoes_por_dia.items():
-            e_feriado = dia in feriados
-            e_fim_semana = dia.weekday() >= 5
+            tipo_dia = calendario.tipo_dia(dia)
             datas.append({
-                "data": dia, "nomeacoes": nomeacoes, "e_fim_semana": e_fim_semana and not e_feriado,
-                "e_feriado": e_feriado, "tipo_dia": "feriado" if e_feriado else ("fim_semana" if e_fim_semana else "util")
+                "data": dia, "nomeacoes": nomeacoes, "e_fim_semana": tipo_dia == "fim_semana",
+                "e_feriado": tipo_dia == "feriado", "tipo_dia": tipo_dia
             })
 
-        # --- futuros | Escala B (fds / feriados) ---
-        for dia in dias_escala.get("escala_b", []):
-            if dia <= hoje and any(d["data"] == dia for d in datas):
+        # --- futuros: a primeira escala de cada tipo e as suas nomeações, numa consulta cada ---
+        escalas = {}
+        for escala in Escala.objects.filter(servico=servico).order_by("pk"):
+            escalas.setdefault(escala.e_escala_b, escala)
+        nomeacoes_futuras = defaultdict(list)
+        for nomeacao in Nomeacao.objects.filter(
+                escala_militar__escala__in=list(escalas.values()),
+                data__gte=hoje,
+                data__lte=data_fim,
+        ).select_related("escala_militar__militar"):
+            nomeacoes_futuras[(nomeacao.escala_militar.escala_id, nomeacao.data)].append(nomeacao)
+
+        for i in range(calendario.indice(hoje), calendario.indice(data_fim) + 1):
+            dia = calendario.data(i)
+            if dia == hoje and dia in nomeacoes_por_dia:
                 continue
-            escala = Escala.objects.filter(
-                servico=servico,
-                e_escala_b=True
-            ).first()
-            nomeacoes = []
-            if escala:
-                nomeacoes = Nomeacao.objects.filter(
-                    escala_militar__escala=escala,
-                    data=dia
-                ).select_related("escala_militar__militar")
-
-            e_feriado = dia in feriados
+            tipo_dia = calendario.tipo_dia(dia)
+            escala = escalas.get(tipo_dia != "util")
             datas.append(
                 {
                     "data": dia,
                     "escala": escala,
-                    "nomeacoes": nomeacoes,
-                    "e_fim_semana": not e_feriado,
-                    "e_feriado": e_feriado,
-                    "tipo_dia": "fim_semana" if not e_feriado else "feriado",
-                }
-            )
-
-        # --- futuros | Escala A (dias úteis) ---
-        for dia in dias_escala.get("escala_a", []):
-            if dia <= hoje and any(d["data"] == dia for d in datas):
-                continue
-            escala = Escala.objects.filter(
-                servico=servico,
-                e_escala_b=False
-            ).first()
-            nomeacoes = []
-            if escala:
-                nomeacoes = Nomeacao.objects.filter(
-                    escala_militar__escala=escala,
-                    data=dia
-                ).select_related("escala_militar__militar")
-
-            datas.append(
-                {
-                    "data": dia,
-                    "escala": escala,
-                    "nomeacoes": nomeacoes,
-                    "e_fim_semana": False,
-                    "e_feriado": False,
-                    "tipo_dia": "util",
+                    "nomeacoes": nomeacoes_futuras[(escala.pk, dia)] if escala else [],
+                    "e_fim_semana": tipo_dia == "fim_semana",
+                    "e_feriado": tipo_dia == "feriado",
+                    "tipo_dia": tipo_dia,
                 }
             )
 
         # ordena a lista consolidada
         datas.sort(key=lambda x: x["data"])
 
+        # --- militares disponíveis em cada dia futuro, avaliados em lote ---
+        dias_futuros = [item["data"] for item in datas if item["data"] > hoje]
+        militares = list(servico.militares.all())
+        disponibilidade = EscalaService.disponibilidade_em_lote(militares, dias_futuros)
+        for item in datas:
+            if item["data"] > hoje:
+                item["disponiveis"] = sum(
+                    1 for militar in militares if disponibilidade[militar.nim][item["data"]][0]
+                )
+
         # ---------- render ----------
         context = {
             "title": f"Previsões de Nomeação – {servico.nome}",
@@ -718,6 +775,17 @@ class LogAdmin(admin.ModelAdmin):
     def has_add_permission(self, request):
         return False
 
+class TarefaGeracaoAdmin(admin.ModelAdmin):
+    list_display = ('__str__', 'estado', 'dias_concluidos', 'total_dias', 'criada_por', 'criada_em', 'terminada_em')
+    list_filter = ('estado',)
+    readonly_fields = [field.name for field in TarefaGeracao._meta.fields]
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
 # Configuração do Admin Site
 class GeradorEscalasAdminSite(admin.AdminSite):
     site_header = 'Gerador de Escalas'
@@ -736,6 +804,13 @@ class GeradorEscalasAdminSite(admin.AdminSite):
                     'add_url': None,
                     'view_only': True,
                 })
+                app['models'].append({
+                    'name': 'Mapa de Escassez',
+                    'object_name': 'MapaEscassez',
+                    'admin_url': reverse('admin:mapa-escassez'),
+                    'add_url': None,
+                    'view_only': True,
+                })
                 # Ordenar modelos, colocando 'Previsões de Nomeação' no fim
                 app['models'].sort(key=lambda m: m['name'] == 'Previsões de Nomeação')
                 # Ordenar modelos, colocando 'Lista de Serviços' no fim
@@ -749,6 +824,8 @@ class GeradorEscalasAdminSite(admin.AdminSite):
                     'Servicos',
                     'Escalas',
                     'Previsões de Nomeação',
+                    'Mapa de Escassez',
+                    'Tarefas de Geração',
                     'Lista de Serviços',
                     'Logs',
                 ]
@@ -775,16 +852,16 @@ class GeradorEscalasAdminSite(admin.AdminSite):
         total_militares = sum(militares_por_servico.values())
         extra_context['total_militares'] = total_militares
 
-        # Militares dispensados por serviço (atuais)
+        # Militares dispensados por serviço (atuais), com as dispensas de hoje carregadas uma vez
         hoje = timezone.now().date()
-        dispensados_por_servico = {}
-        for servico in servicos:
-            militares = servico.militares.all()
-            count = militares.filter(
-                dispensas__data_inicio__lte=hoje,
-                dispensas__data_fim__gte=hoje
-            ).distinct().count()
-            dispensados_por_servico[servico.nome] = count
+        indice_dispensas = IndiceDispensas.carregar(hoje, hoje)
+        nims_por_servico = defaultdict(list)
+        for servico_id, nim in Servico.militares.through.objects.values_list('servico_id', 'militar_id'):
+            nims_por_servico[servico_id].append(nim)
+        dispensados_por_servico = {
+            servico.nome: len(indice_dispensas.dispensados_em(hoje, nims_por_servico[servico.pk]))
+            for servico in servicos
+        }
         extra_context['dispensados_por_servico'] = dispensados_por_servico
 
         # Top 5 militares com mais serviços realizados (nome + posto)
@@ -829,6 +906,7 @@ admin_site.register(Feriado, FeriadoAdmin)
 admin_site.register(PrevisaoEscalasProxy, PrevisaoEscalasAdmin)
 admin_site.register(ConfiguracaoUnidade, ConfiguracaoUnidadeAdmin)
 admin_site.register(Log, LogAdmin)
+admin_site.register(TarefaGeracao, TarefaGeracaoAdmin)
 # Registrar a Previsões de Nomeação como um modelo proxy (no fim)
 
 
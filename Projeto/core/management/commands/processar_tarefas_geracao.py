@@ -0,0 +1,52 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.models import TarefaGeracao
+from core.services.tarefas_geracao import reservar_proxima_tarefa, executar_tarefa
+
+
+class Command(BaseCommand):
+    help = 'Executa as tarefas de geração de escalas pendentes (processo de trabalho local)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--uma-vez',
+            action='store_true',
+            help='Executa as tarefas pendentes e termina, em vez de ficar à espera de novas',
+        )
+        parser.add_argument(
+            '--intervalo',
+            type=float,
+            default=2.0,
+            help='Segundos entre verificações quando não há tarefas pendentes (por omissão 2)',
+        )
+        parser.add_argument(
+            '--repor-interrompidas',
+            action='store_true',
+            help='Volta a pôr como pendentes as tarefas que ficaram em curso (ex.: processo terminado a meio)',
+        )
+
+    def handle(self, *args, **options):
+        if options['repor_interrompidas']:
+            repostas = TarefaGeracao.objects.filter(estado=TarefaGeracao.EM_CURSO).update(
+                estado=TarefaGeracao.PENDENTE, iniciada_em=None)
+            self.stdout.write(f'{repostas} tarefas interrompidas repostas como pendentes.')
+
+        self.stdout.write('A processar tarefas de geração...')
+        try:
+            while True:
+                tarefa = reservar_proxima_tarefa()
+                if tarefa is None:
+                    if options['uma_vez']:
+                        break
+                    time.sleep(options['intervalo'])
+                    continue
+
+                self.stdout.write(f'Tarefa {tarefa.pk}: {tarefa}')
+                if executar_tarefa(tarefa):
+                    self.stdout.write(self.style.SUCCESS(f'Tarefa {tarefa.pk} concluída.'))
+                else:
+                    self.stdout.write(self.style.ERROR(f'Tarefa {tarefa.pk} falhada.'))
+        except KeyboardInterrupt:
+            self.stdout.write('Processo de trabalho terminado.')
@@ -2,6 +2,7 @@ from django.db import models
 from django.contrib.auth.models import User, Permission
 from django.core.exceptions import ValidationError
 from datetime import time
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 # Lista de postos do Exército Português (excluindo oficiais generais)
@@ -187,6 +188,22 @@ class Servico(models.Model):
     # Precisamos disto?
     armamento = models.BooleanField(default=False, help_text="Se o serviço requer armamento")
 
+    MOTOR_OPTIONS = [
+        ("guloso", "Rotação (guloso)"),
+        ("otimizacao", "Otimização (fluxo de custo mínimo)"),
+    ]
+    motor_geracao = models.CharField(
+        max_length=10,
+        choices=MOTOR_OPTIONS,
+        default="guloso",
+        help_text="Algoritmo usado na geração automática das escalas deste serviço.",
+    )
+
+    # Versão das escalas do serviço, incrementada na mesma transação que altera as suas nomeações;
+    # dá o ETag/Last-Modified das páginas de previsões a todos os processos (ver services/versao_escalas.py)
+    versao_escalas = models.PositiveIntegerField(default=0, editable=False)
+    escalas_alteradas_em = models.DateTimeField(default=timezone.now, editable=False)
+
     def clean(self):
         super().clean()
 
@@ -336,3 +353,46 @@ class ConfiguracaoUnidade(models.Model):
         verbose_name = "Configuração da Unidade"
         verbose_name_plural = "Configuração da Unidade"
 
+
+
+# Tarefa de geração de escalas executada fora do pedido HTTP pelo comando `processar_tarefas_geracao`.
+class TarefaGeracao(models.Model):
+    PENDENTE = 'pendente'
+    EM_CURSO = 'em_curso'
+    CONCLUIDA = 'concluida'
+    FALHADA = 'falhada'
+    ESTADO_OPTIONS = [
+        (PENDENTE, 'Pendente'),
+        (EM_CURSO, 'Em curso'),
+        (CONCLUIDA, 'Concluída'),
+        (FALHADA, 'Falhada'),
+    ]
+
+    servico = models.ForeignKey(
+        Servico,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='tarefas_geracao',
+        help_text="Serviço a gerar; vazio para gerar todos os serviços da unidade"
+    )
+    data_inicio = models.DateField()
+    data_fim = models.DateField()
+    estado = models.CharField(max_length=10, choices=ESTADO_OPTIONS, default=PENDENTE)
+    dias_concluidos = models.PositiveIntegerField(default=0)
+    total_dias = models.PositiveIntegerField(default=0)
+    fase = models.CharField(max_length=200, blank=True, help_text="Passo em curso numa geração curta (sem blocos)")
+    mensagem = models.TextField(blank=True, verbose_name="Resultado")
+    criada_por = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    criada_em = models.DateTimeField(auto_now_add=True)
+    iniciada_em = models.DateTimeField(null=True, blank=True)
+    terminada_em = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Tarefa de Geração"
+        verbose_name_plural = "Tarefas de Geração"
+        ordering = ['-criada_em']
+
+    def __str__(self):
+        alvo = self.servico.nome if self.servico_id else "Todos os serviços"
+        return f"{alvo} de {self.data_inicio:%d/%m/%Y} a {self.data_fim:%d/%m/%Y} ({self.get_estado_display()})"
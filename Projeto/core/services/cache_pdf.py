@@ -0,0 +1,126 @@
+import hashlib
+import logging
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import Optional
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse
+
+logger = logging.getLogger(__name__)
+
+# Idade (segundos) a partir da qual um temporário na pasta da cache é considerado abandonado
+IDADE_MAXIMA_TEMPORARIO = 3600
+
+
+def chave_pdf(*partes) -> str:
+    """Chave de um PDF em cache: hash SHA-256 de tudo o que determina o seu conteúdo."""
+    return hashlib.sha256(repr(partes).encode('utf-8')).hexdigest()
+
+
+def _caminho(chave: str) -> Path:
+    return Path(settings.PDF_CACHE_DIR) / f'{chave}.pdf'
+
+
+def _content_disposition(resposta, nome_ficheiro: str, download: bool):
+    tipo = 'attachment' if download else 'inline'
+    resposta['Content-Disposition'] = f'{tipo}; filename="{nome_ficheiro}"'
+    return resposta
+
+
+def resposta_pdf_em_cache(chave: str, nome_ficheiro: str, download: bool = True) -> Optional[FileResponse]:
+    """
+    Resposta com o PDF em cache servido diretamente do ficheiro, ou None se não existir.
+    A data de modificação do ficheiro é atualizada, para que a remoção dos mais antigos seja LRU.
+    """
+    caminho = _caminho(chave)
+    try:
+        ficheiro = open(caminho, 'rb')
+        os.utime(caminho)
+    except OSError:
+        return None
+    resposta = FileResponse(ficheiro, content_type='application/pdf')
+    return _content_disposition(resposta, nome_ficheiro, download)
+
+
+def ler_pdf(chave: str) -> Optional[bytes]:
+    """Conteúdo do PDF em cache, ou None se não existir (atualiza a data de modificação, como acima)."""
+    caminho = _caminho(chave)
+    try:
+        conteudo = caminho.read_bytes()
+        os.utime(caminho)
+    except OSError:
+        return None
+    return conteudo
+
+
+def resposta_pdf(chave: str, conteudo: bytes, nome_ficheiro: str, download: bool = True) -> HttpResponse:
+    """Guarda o PDF acabado de gerar na cache e devolve-o na resposta."""
+    guardar_pdf(chave, conteudo)
+    resposta = HttpResponse(conteudo, content_type='application/pdf')
+    return _content_disposition(resposta, nome_ficheiro, download)
+
+
+def guardar_pdf(chave: str, conteudo: bytes) -> None:
+    """
+    Escreve o PDF num ficheiro temporário e move-o para o nome final (os leitores nunca veem um ficheiro
+    a meio). Se a pasta passar de `PDF_CACHE_MAXIMO_MB`, são removidos os PDFs usados há mais tempo.
+    Uma falha ao escrever não impede a exportação; o PDF é apenas gerado de novo da próxima vez.
+    """
+    pasta = Path(settings.PDF_CACHE_DIR)
+    try:
+        pasta.mkdir(parents=True, exist_ok=True)
+        descritor, temporario = tempfile.mkstemp(dir=pasta, suffix='.tmp')
+    except OSError as e:
+        logger.warning(f"Não foi possível guardar o PDF em cache: {e}")
+        return
+    try:
+        with os.fdopen(descritor, 'wb') as ficheiro:
+            ficheiro.write(conteudo)
+        os.replace(temporario, _caminho(chave))
+        limitar_cache_pdf()
+    except OSError as e:
+        logger.warning(f"Não foi possível guardar o PDF em cache: {e}")
+    finally:
+        # Depois de os.replace o temporário já não existe; se a escrita falhou, não fica na pasta
+        _remover(temporario)
+
+
+def _remover(caminho) -> None:
+    try:
+        os.remove(caminho)
+    except FileNotFoundError:
+        pass
+
+
+def limitar_cache_pdf(maximo_bytes: int = None) -> None:
+    """
+    Remove os PDFs usados há mais tempo (data de modificação) até a pasta caber em `maximo_bytes`.
+    Os temporários com mais de `IDADE_MAXIMA_TEMPORARIO` segundos (deixados por um processo que terminou
+    a meio da escrita) são removidos; os mais recentes podem estar a ser escritos e ficam.
+    """
+    if maximo_bytes is None:
+        maximo_bytes = settings.PDF_CACHE_MAXIMO_MB * 1024 * 1024
+    limite_temporarios = time.time() - IDADE_MAXIMA_TEMPORARIO
+    ficheiros = []
+    total = 0
+    for entrada in os.scandir(settings.PDF_CACHE_DIR):
+        if entrada.name.endswith('.pdf'):
+            estado = entrada.stat()
+            ficheiros.append((estado.st_mtime, estado.st_size, entrada.path))
+            total += estado.st_size
+        elif entrada.name.endswith('.tmp'):
+            try:
+                abandonado = entrada.stat().st_mtime < limite_temporarios
+            except FileNotFoundError:
+                # Entretanto foi movido para o nome final
+                continue
+            if abandonado:
+                _remover(entrada.path)
+    for _, tamanho, caminho in sorted(ficheiros):
+        if total <= maximo_bytes:
+            break
+        _remover(caminho)
+        total -= tamanho
@@ -1,11 +1,25 @@
+import logging
 from datetime import date, timedelta
-from typing import Tuple, List, Dict
+from typing import Callable, Iterable, Tuple, List, Dict, Optional
+from django.conf import settings
 from django.utils import timezone
 from collections import defaultdict
-from django.db.models import Count
+from django.db import transaction
+from django.db.models import Count, Exists, F, Max, Min, OuterRef, Q, Subquery
 
 from ..models import Escala, Militar, Servico, Feriado, EscalaMilitar, Dispensa, Nomeacao
-from ..utils import obter_feriados
+from ..utils import calendario_dias
+from .indice_disponibilidade import IndiceDisponibilidade
+from .matriz_disponibilidade import MatrizDisponibilidade
+from .rotacao import RotacaoEscala
+from .versao_escalas import atualizar_versao_escalas
+
+logger = logging.getLogger(__name__)
+
+# Período máximo de uma geração numa só passagem; períodos maiores são gerados em blocos
+MAXIMO_DIAS_PERIODO = 60
+# Dias de efetivos planeados para lá do fim de um bloco, para escolher os reservas dos últimos dias do bloco
+ANTECIPACAO_RESERVAS_DIAS = 7
 
 
 class EscalaService:
@@ -13,7 +27,7 @@ class EscalaService:
 
     @staticmethod
     def verificar_periodo(
-            data_inicio: date, data_fim: date) -> Tuple[bool, str]:
+            data_inicio: date, data_fim: date, maximo_dias: int = MAXIMO_DIAS_PERIODO) -> Tuple[bool, str]:
         """Verifica se o período para nomeações é válido."""
         hoje = timezone.now().date()
 
@@ -24,14 +38,14 @@ class EscalaService:
             return False, "A data inicial não pode ser no passado"
 
         dias_intervalo = (data_fim - data_inicio).days
-        if dias_intervalo > 60:
-            return False, "O intervalo máximo para nomeações é de 60 dias"
+        if dias_intervalo > maximo_dias:
+            return False, f"O intervalo máximo para nomeações é de {maximo_dias} dias"
 
         return True, "Período válido"
 
     @staticmethod
     def obter_dias_escala(
-            data_inicio: date, data_fim: date) -> Dict[str, List[date]]:
+            data_inicio: date, data_fim: date, maximo_dias: int = MAXIMO_DIAS_PERIODO) -> Dict[str, List[date]]:
         """Obtém as datas separadas por tipo de escala (dias úteis e fins de semana/feriados)."""
         dias = {
             'escala_a': [],
@@ -40,26 +54,12 @@ class EscalaService:
 
         # Verifica se o período é válido
         valido, mensagem = EscalaService.verificar_periodo(
-            data_inicio, data_fim)
+            data_inicio, data_fim, maximo_dias)
         if not valido:
             return dias
 
-        # Obter todos os feriados usando a função unificada
-        feriados = obter_feriados(data_inicio, data_fim)
-
-        data_atual = data_inicio
-        while data_atual <= data_fim:
-            e_fds = data_atual.weekday() >= 5
-            e_feriado = data_atual in feriados
-
-            if e_fds or e_feriado:
-                dias['escala_b'].append(data_atual)
-            else:
-                dias['escala_a'].append(data_atual)
-
-            data_atual += timedelta(days=1)
-
-        return dias
+        # Calendário partilhado do período (feriados e fins de semana já classificados)
+        return calendario_dias(data_inicio, data_fim).dias_escala()
 
     @staticmethod
     def militar_em_dispensa(militar: Militar, data: date) -> bool:
@@ -112,7 +112,26 @@ class EscalaService:
 
     @staticmethod
     def verificar_disponibilidade_militar(
-            militar: Militar, data: date) -> Tuple[bool, str]:
+            militar: Militar, data: date,
+            indice: IndiceDisponibilidade = None) -> Tuple[bool, str]:
+        """
+        Verifica se um militar pode ser nomeado como efetivo numa data.
+        Se for dado um `indice`, as regras são avaliadas em memória sem consultar a base de dados.
+        """
+        if indice is not None:
+            nim = militar.nim
+            if indice.em_dispensa(nim, data):
+                return False, "Militar em dispensa"
+            if indice.ja_nomeado(nim, data):
+                return False, "Militar já tem escala neste dia"
+            if indice.licenca_depois(nim, data):
+                return False, "Militar entra de licença no dia seguinte"
+            if indice.licenca_antes(nim, data):
+                return False, "Militar apresentou-se de licença no dia anterior"
+            if indice.conflito_nomeacao(nim, data):
+                return False, "Militar tem escala no dia anterior ou seguinte"
+            return True, "Militar disponível"
+
         if EscalaService.militar_em_dispensa(militar, data):
             return False, "Militar em dispensa"
         if EscalaService.militar_ja_nomeado(militar, data):
@@ -125,29 +144,68 @@ class EscalaService:
             return False, "Militar tem escala no dia anterior ou seguinte"
         return True, "Militar disponível"
 
+    @staticmethod
+    def disponibilidade_em_lote(
+            militares: Iterable[Militar], datas: Iterable[date],
+            indice: IndiceDisponibilidade = None) -> Dict[str, Dict[date, Tuple[bool, str]]]:
+        """
+        Avalia a disponibilidade como efetivo de vários militares em várias datas de uma só vez.
+
+        Em vez das cinco consultas por par (militar, data) de `verificar_disponibilidade_militar`,
+        carrega um único `IndiceDisponibilidade` para o intervalo das datas (duas consultas, seja qual
+        for o número de militares e de datas) e aplica as mesmas regras em memória.
+        Retorna {nim: {data: (disponivel, motivo)}}.
+        """
+        militares = list(militares)
+        datas = sorted(set(datas))
+        if not militares or not datas:
+            return {m.nim: {} for m in militares}
+        if indice is None:
+            indice = IndiceDisponibilidade.construir(datas[0], datas[-1], militares)
+        return {
+            militar.nim: {
+                dia: EscalaService.verificar_disponibilidade_militar(militar, dia, indice)
+                for dia in datas
+            }
+            for militar in militares
+        }
+
     @staticmethod
     def obter_militares_disponiveis(
             servico: Servico,
             data: date) -> List[Militar]:
-        """Obtém uma lista de militares disponíveis para um serviço numa data específica."""
-        # Obter todos os militares do serviço que estão ativos
-        militares_ativos = Militar.objects.filter(
-            servicos=servico,
-            ativo=True  # Assumindo que o modelo Militar tem um campo 'ativo'
-        ).distinct()
-
-        # Filtrar apenas os disponíveis
-        militares_disponiveis = [
-            m for m in militares_ativos
-            if EscalaService.verificar_disponibilidade_militar(m, data)[0]
-        ]
+        """
+        Obtém uma lista de militares disponíveis para um serviço numa data específica,
+        ordenada por folga (menor folga primeiro; quem nunca fez o serviço fica no fim).
 
-        # Ordenar por folga (menor folga primeiro)
-        militares_disponiveis.sort(
-            key=lambda m: m.calcular_folga(data, servico)
+        São considerados os militares do serviço ativos em pelo menos uma das suas escalas.
+        A data do último serviço é anotada em SQL e a disponibilidade avaliada em lote,
+        pelo que o número de consultas não depende do número de militares.
+        """
+        ultimo_servico = (
+            Nomeacao.objects
+            .filter(escala_militar__militar=OuterRef('pk'), escala_militar__escala__servico=servico)
+            .order_by()
+            .values('escala_militar__militar')
+            .annotate(ultima=Max('data'))
+            .values('ultima')
+        )
+        militares_ativos = list(
+            Militar.objects
+            .filter(servicos=servico)
+            .filter(Exists(EscalaMilitar.objects.filter(
+                militar=OuterRef('pk'), escala__servico=servico, ativo=True)))
+            .annotate(ultimo_servico=Subquery(ultimo_servico))
+            # Folga crescente equivale à data do último serviço decrescente
+            .order_by(F('ultimo_servico').desc(nulls_last=True), 'nim')
         )
 
-        return militares_disponiveis
+        # Filtrar apenas os disponíveis, mantendo a ordenação por folga
+        disponibilidade = EscalaService.disponibilidade_em_lote(militares_ativos, [data])
+        return [
+            m for m in militares_ativos
+            if disponibilidade[m.nim][data][0]
+        ]
 
     @staticmethod
     def criar_ou_obter_escala(servico: Servico, e_escala_b: bool) -> Escala:
@@ -157,56 +215,34 @@ class EscalaService:
         return escala
 
     @staticmethod
-    def nomear_efetivo(escala, militar, dia):
-        """Nomeia um militar como efetivo para uma escala num dia específico, se ainda não estiver nomeado."""
-        if not Nomeacao.objects.filter(
-            escala_militar__escala=escala,
-            escala_militar__militar=militar,
-            data=dia,
-            e_reserva=False
-        ).exists():
-            escala_militar, _ = EscalaMilitar.objects.get_or_create(
-                escala=escala,
-                militar=militar,
-                defaults={'ordem': 1}
-            )
-            Nomeacao.objects.create(
-                escala_militar=escala_militar,
-                data=dia,
-                e_reserva=False
-            )
-            return True
-        return False
-
-    @staticmethod
-    def nomear_reserva(escala, militar, dia):
-        """Nomeia um militar como reserva para uma escala num dia específico, se ainda não estiver nomeado."""
-        if not Nomeacao.objects.filter(
-            escala_militar__escala=escala,
-            escala_militar__militar=militar,
-            data=dia,
-            e_reserva=True
-        ).exists():
-            escala_militar, _ = EscalaMilitar.objects.get_or_create(
-                escala=escala,
-                militar=militar,
-                defaults={'ordem': 2}
-            )
-            Nomeacao.objects.create(
-                escala_militar=escala_militar,
-                data=dia,
-                e_reserva=True
-            )
-            return True
-        return False
+    def _obter_escala(servico: Servico, e_escala_b: bool, simular: bool = False) -> Optional[Escala]:
+        """Em simulação não cria a escala em falta: sem escala não há militares para nomear."""
+        if simular:
+            return Escala.objects.filter(servico=servico, e_escala_b=e_escala_b).first()
+        return EscalaService.criar_ou_obter_escala(servico, e_escala_b=e_escala_b)
 
     @staticmethod
     def verificar_disponibilidade_reserva(
-            militar: Militar, data: date, e_escala_b: bool) -> Tuple[bool, str]:
+            militar: Militar, data: date, e_escala_b: bool,
+            indice: IndiceDisponibilidade = None) -> Tuple[bool, str]:
         """
         Verifica se um militar pode ser nomeado como reserva em uma data específica.
         Considera dispensa, nomeações como efetivo em outras escalas e o dia após dispensa.
+        Se for dado um `indice`, as regras são avaliadas em memória.
         """
+        if indice is not None:
+            nim = militar.nim
+            if indice.em_dispensa(nim, data):
+                return False, "Militar em dispensa"
+            if indice.licenca_antes(nim, data):
+                return False, "Militar apresentou-se de dispensa no dia anterior"
+            if indice.ja_nomeado(nim, data):
+                return False, "Militar já tem escala neste dia"
+            escala_seguinte = indice.escala_efetivo_seguinte(nim, data)
+            if escala_seguinte is not None and escala_seguinte != e_escala_b:
+                return False, "Militar é efetivo de outra escala no dia seguinte"
+            return True, "Militar disponível para reserva"
+
         # Verificar se está em dispensa
         if EscalaService.militar_em_dispensa(militar, data):
             return False, "Militar em dispensa"
@@ -238,29 +274,39 @@ class EscalaService:
 
         return True, "Militar disponível para reserva"
 
+    @staticmethod
+    def obter_dias_seguintes(dias_escala) -> Dict[date, Optional[date]]:
+        """Mapa de cada dia de escala para o dia de escala seguinte (None no último)."""
+        dias_ordenados = sorted(dias_escala)
+        return dict(zip(dias_ordenados, dias_ordenados[1:] + [None]))
+
     @staticmethod
     def encontrar_proximo_efetivo_valido(dia_atual: date,
                                          efetivos_dict: dict,
                                          dias_escala: list,
-                                         e_escala_b: bool) -> Tuple[Militar,
-                                                                    date]:
+                                         e_escala_b: bool,
+                                         indice: IndiceDisponibilidade = None,
+                                         dias_seguintes: Dict[date, Optional[date]] = None) -> Tuple[Militar,
+                                                                                                      date]:
         """
         Encontra o próximo efetivo disponível para ser reserva após o dia atual.
         Retorna uma tupla com o militar e a data em que ele é efetivo.
+        `dias_seguintes` (ver `obter_dias_seguintes`) evita reordenar `dias_escala` em cada chamada.
         """
-        dias_ordenados = sorted(dias_escala)
-        idx_atual = dias_ordenados.index(dia_atual)
+        if dias_seguintes is None:
+            dias_seguintes = EscalaService.obter_dias_seguintes(dias_escala)
 
         # Procura nos próximos dias
-        for dia_futuro in dias_ordenados[idx_atual + 1:]:
-            if dia_futuro in efetivos_dict:
-                # Pega o primeiro militar disponível da lista de efetivos
-                for militar in efetivos_dict[dia_futuro]:
-                    # Verificar se o militar pode ser reserva
-                    disponivel, _ = EscalaService.verificar_disponibilidade_reserva(
-                        militar, dia_atual, e_escala_b)
-                    if disponivel:
-                        return militar, dia_futuro
+        dia_futuro = dias_seguintes.get(dia_atual)
+        while dia_futuro is not None:
+            # Pega o primeiro militar disponível da lista de efetivos
+            for militar in efetivos_dict.get(dia_futuro, ()):
+                # Verificar se o militar pode ser reserva
+                disponivel, _ = EscalaService.verificar_disponibilidade_reserva(
+                    militar, dia_atual, e_escala_b, indice)
+                if disponivel:
+                    return militar, dia_futuro
+            dia_futuro = dias_seguintes[dia_futuro]
         return None, None
 
     @staticmethod
@@ -268,196 +314,656 @@ class EscalaService:
         """
         Verifica se há escassez de militares e retorna uma lista de períodos problemáticos.
         Um período é uma sequência de um ou mais dias consecutivos.
+        As contagens diárias são obtidas da matriz de disponibilidade (NumPy) construída numa só passagem.
         """
-        militares_servico = servico.militares.all()
-        total_militares = militares_servico.count()
+        nims = list(servico.militares.values_list('nim', flat=True))
+        matriz = MatrizDisponibilidade.construir(data_inicio, data_fim, nims)
+        return matriz.periodos_escassez(minimo) or None
 
-        dispensas_por_dia = defaultdict(set)
-        dispensas_periodo = Dispensa.objects.filter(
-            militar__in=militares_servico,
-            data_inicio__lte=data_fim,
-            data_fim__gte=data_inicio
-        )
-        for dispensa in dispensas_periodo:
-            d_atual = max(dispensa.data_inicio, data_inicio)
-            d_fim_periodo = min(dispensa.data_fim, data_fim)
-            while d_atual <= d_fim_periodo:
-                dispensas_por_dia[d_atual].add(dispensa.militar_id)
-                d_atual += timedelta(days=1)
-
-        dias_problematicos = []
-        current_day = data_inicio
-        while current_day <= data_fim:
-            num_em_dispensa = len(dispensas_por_dia.get(current_day, set()))
-            if total_militares - num_em_dispensa < minimo:
-                dias_problematicos.append(current_day)
-            current_day += timedelta(days=1)
-
-        if not dias_problematicos:
-            return None
-
-        # Agrupar dias consecutivos em períodos
-        periodos = []
-        if dias_problematicos:
-            start_periodo = dias_problematicos[0]
-            for i in range(1, len(dias_problematicos)):
-                if dias_problematicos[i] != dias_problematicos[i-1] + timedelta(days=1):
-                    periodos.append({'inicio': start_periodo, 'fim': dias_problematicos[i-1]})
-                    start_periodo = dias_problematicos[i]
-            periodos.append({'inicio': start_periodo, 'fim': dias_problematicos[-1]})
-        
-        return periodos
-
-    @staticmethod
-    def _inicializar_geracao(servico, data_inicio, data_fim):
-        """Valida as datas, limpa nomeações existentes e retorna os dados iniciais."""
+    @staticmethod
+    def _inicializar_geracao(servicos, data_inicio, data_fim):
+        """
+        Valida as datas e retorna os dados iniciais. As nomeações existentes só são apagadas na gravação.
+        Um período inválido (por exemplo, com mais de `MAXIMO_DIAS_PERIODO` dias) lança `ValueError` com a
+        mensagem de `verificar_periodo`, em vez de gerar um plano vazio.
+        """
         hoje = timezone.now().date()
         if data_inicio <= hoje:
             raise ValueError("Só é possível gerar previsões para datas futuras.")
-
-        Nomeacao.objects.filter(
-            escala_militar__escala__servico=servico,
-            data__gte=data_inicio,
-            data__lte=data_fim
-        ).delete()
+        valido, mensagem = EscalaService.verificar_periodo(data_inicio, data_fim)
+        if not valido:
+            raise ValueError(mensagem)
 
         dias_escala = EscalaService.obter_dias_escala(data_inicio, data_fim)
-        militares = list(servico.militares.all())
-        militares_dict = {m.nim: m for m in militares}
-        return dias_escala, militares, militares_dict
+        militares, militares_por_servico = EscalaService._carregar_militares(servicos)
+        return dias_escala, militares, militares_por_servico
+
+    @staticmethod
+    def _carregar_militares(servicos):
+        """
+        Militares dos serviços e, por serviço, {nim: militar}.
+        Um militar inscrito em vários serviços é representado por um único objeto partilhado.
+        """
+        militares = list(Militar.objects.filter(servicos__in=servicos).distinct())
+        todos_militares = {m.nim: m for m in militares}
+
+        militares_por_servico = {servico.pk: {} for servico in servicos}
+        inscricoes = Servico.militares.through.objects.filter(
+            servico__in=servicos
+        ).values_list('servico_id', 'militar_id')
+        for servico_id, nim in inscricoes:
+            militares_por_servico[servico_id][nim] = todos_militares[nim]
+        return militares, militares_por_servico
 
     @staticmethod
     def _atualizar_ultimas_nomeacoes(militares, data_inicio):
-        """Atualiza e retorna as últimas datas de nomeação para cada militar."""
+        """
+        Atualiza e retorna as últimas datas de nomeação como efetivo para cada militar.
+        Uma única consulta agregada devolve a data máxima por militar e por tipo de escala (A ou B).
+        Os novos valores ficam nos objetos em memória e são gravados com o plano, em `_gravar_plano`.
+        """
+        ultimas = (
+            Nomeacao.objects
+            .filter(escala_militar__militar__in=militares, data__lt=data_inicio, e_reserva=False)
+            .values('escala_militar__militar_id', 'escala_militar__escala__e_escala_b')
+            .annotate(ultima=Max('data'))
+        )
+
+        ultima_nomeacao_a = {m.nim: None for m in militares}
+        ultima_nomeacao_b = {m.nim: None for m in militares}
+        for linha in ultimas:
+            if linha['escala_militar__escala__e_escala_b']:
+                ultima_nomeacao_b[linha['escala_militar__militar_id']] = linha['ultima']
+            else:
+                ultima_nomeacao_a[linha['escala_militar__militar_id']] = linha['ultima']
+
         for militar in militares:
-            ultima_a = Nomeacao.objects.filter(
-                escala_militar__militar=militar, data__lt=data_inicio, e_reserva=False
-            ).order_by('-data').first()
-            ultima_b = Nomeacao.objects.filter(
-                escala_militar__militar=militar, data__lt=data_inicio, e_reserva=False
-            ).order_by('-data').first()
-            militar.ultima_nomeacao_a = ultima_a.data if ultima_a else None
-            militar.ultima_nomeacao_b = ultima_b.data if ultima_b else None
-            militar.save()
-
-        ultima_nomeacao_a = {m.nim: m.ultima_nomeacao_a for m in militares}
-        ultima_nomeacao_b = {m.nim: m.ultima_nomeacao_b for m in militares}
+            militar.ultima_nomeacao_a = ultima_nomeacao_a[militar.nim]
+            militar.ultima_nomeacao_b = ultima_nomeacao_b[militar.nim]
+
         return ultima_nomeacao_a, ultima_nomeacao_b
 
     @staticmethod
-    def _processar_efetivos_para_escala(servico, dias_para_processar, ultima_nomeacao_dict, e_escala_b, militares_dict):
-        """Processa e nomeia os efetivos para um tipo de escala (A ou B)."""
+    def _processar_efetivos_para_escala(servico, dias_para_processar, ultima_nomeacao_dict, e_escala_b, militares_dict,
+                                        indice, plano, simular=False):
+        """
+        Planeia os efetivos para um tipo de escala (A ou B).
+        As nomeações são acrescentadas a `plano` como tuplos (escala_id, nim, dia, e_reserva); nada é gravado.
+        """
         efetivos_por_dia = defaultdict(list)
-        escala = EscalaService.criar_ou_obter_escala(servico, e_escala_b=e_escala_b)
-        
-        dias_ordenados = sorted(dias_para_processar)
-        
-        # Filtra militares que estão ativos nesta escala específica
-        militares_ativos_nims = list(EscalaMilitar.objects.filter(
-            escala=escala, 
-            ativo=True
-        ).values_list('militar__nim', flat=True))
-
-        for dia in dias_ordenados:
-            def get_ordem(nim):
-                militar = militares_dict[nim]
-                try:
-                    escala_militar = EscalaMilitar.objects.get(escala=escala, militar=militar)
-                    return escala_militar.ordem if escala_militar.ordem is not None else 9999
-                except EscalaMilitar.DoesNotExist:
-                    return 9999
-
-            rotacao_nim = sorted(
-                [nim for nim in militares_ativos_nims if nim in militares_dict],
-                key=lambda nim: (ultima_nomeacao_dict.get(nim) or date.min, get_ordem(nim))
-            )
-
-            disponiveis_nim = [
-                nim for nim in rotacao_nim if EscalaService.verificar_disponibilidade_militar(militares_dict[nim], dia)[0]
-            ]
-
-            for i in range(servico.n_elementos):
-                if i < len(disponiveis_nim):
-                    nim_efetivo = disponiveis_nim[i]
-                    militar_efetivo = militares_dict[nim_efetivo]
-                    
-                    if EscalaService.nomear_efetivo(escala, militar_efetivo, dia):
-                        ultima_nomeacao_dict[nim_efetivo] = dia
-                        militar_efetivo.ultima_nomeacao_a = dia if not e_escala_b else militar_efetivo.ultima_nomeacao_a
-                        militar_efetivo.ultima_nomeacao_b = dia if e_escala_b else militar_efetivo.ultima_nomeacao_b
-                        militar_efetivo.save()
-                        efetivos_por_dia[dia].append(militar_efetivo)
+        escala = EscalaService._obter_escala(servico, e_escala_b, simular)
+        if escala is None:
+            return efetivos_por_dia
+
+        # Rotação dos militares ativos nesta escala específica, ordenada por (última nomeação, ordem)
+        rotacao = RotacaoEscala.da_escala(escala, ultima_nomeacao_dict, nims_validos=militares_dict)
+
+        for dia in sorted(dias_para_processar):
+            def disponivel(nim):
+                return EscalaService.verificar_disponibilidade_militar(militares_dict[nim], dia, indice)[0]
+
+            for nim_efetivo in rotacao.selecionar(dia, servico.n_elementos, disponivel):
+                militar_efetivo = militares_dict[nim_efetivo]
+                plano.append((escala.pk, nim_efetivo, dia, False))
+                indice.registar_nomeacao(nim_efetivo, dia, False, e_escala_b)
+                # Em geração de vários serviços o mesmo militar pode já ter uma data posterior
+                if e_escala_b:
+                    militar_efetivo.ultima_nomeacao_b = max(dia, militar_efetivo.ultima_nomeacao_b or dia)
+                else:
+                    militar_efetivo.ultima_nomeacao_a = max(dia, militar_efetivo.ultima_nomeacao_a or dia)
+                efetivos_por_dia[dia].append(militar_efetivo)
 
         return efetivos_por_dia
 
     @staticmethod
-    def _processar_reservas_para_escala(servico, dias_para_processar, efetivos_por_dia, todos_dias_escala, e_escala_b):
-        """Processa e nomeia os reservas para um tipo de escala (A ou B)."""
-        escala = EscalaService.criar_ou_obter_escala(servico, e_escala_b=e_escala_b)
-        
+    def _processar_reservas_para_escala(servico, dias_para_processar, efetivos_por_dia, todos_dias_escala, e_escala_b,
+                                        indice, plano, simular=False):
+        """Planeia os reservas para um tipo de escala (A ou B), acrescentando-os a `plano`."""
+        escala = EscalaService._obter_escala(servico, e_escala_b, simular)
+        if escala is None:
+            return
+
+        # Calculado uma vez: cada passo da procura é um acesso O(1) ao dia de escala seguinte
+        dias_seguintes = EscalaService.obter_dias_seguintes(todos_dias_escala)
+
         for dia in sorted(dias_para_processar):
-            reservas_nomeados = 0
-            while reservas_nomeados < servico.n_reservas:
-                dia_seguinte = dia + timedelta(days=1)
-                militar_reserva = None
-
-                # Tenta encontrar no dia seguinte imediato da mesma escala
-                if dia_seguinte in efetivos_por_dia:
-                    for militar in efetivos_por_dia[dia_seguinte]:
-                        disponivel, _ = EscalaService.verificar_disponibilidade_reserva(militar, dia, e_escala_b)
-                        if disponivel and not Nomeacao.objects.filter(escala_militar__escala=escala, escala_militar__militar=militar, data=dia, e_reserva=True).exists():
-                            militar_reserva = militar
-                            break
-
-                # Se não encontrou, procura no próximo dia de escala válido
+            for _ in range(servico.n_reservas):
+                # Procura entre os efetivos do dia de escala seguinte e, se nenhum estiver disponível,
+                # dos dias de escala que se seguem. Um reserva já escolhido fica registado no índice
+                # como nomeado neste dia, pelo que não volta a ser escolhido.
+                militar_reserva, _ = EscalaService.encontrar_proximo_efetivo_valido(
+                    dia, efetivos_por_dia, todos_dias_escala, e_escala_b, indice, dias_seguintes
+                )
+
                 if not militar_reserva:
-                    militar_reserva, _ = EscalaService.encontrar_proximo_efetivo_valido(
-                        dia, efetivos_por_dia, todos_dias_escala, e_escala_b
+                    break  # Não há mais militares para nomear como reserva
+
+                plano.append((escala.pk, militar_reserva.nim, dia, True))
+                indice.registar_nomeacao(militar_reserva.nim, dia, True, e_escala_b)
+
+    @staticmethod
+    def _gravar_plano(servicos, data_inicio, data_fim, plano, militares):
+        """
+        Grava o plano numa única transação: apaga as nomeações do período,
+        cria as novas com um `bulk_create` e atualiza as últimas nomeações com um `bulk_update`.
+        Se algo falhar, a escala anterior mantém-se intacta.
+        """
+        escalas_ids = {escala_id for escala_id, _, _, _ in plano}
+        roster = {
+            (em.escala_id, em.militar_id): em
+            for em in EscalaMilitar.objects.filter(escala_id__in=escalas_ids)
+        }
+
+        with transaction.atomic():
+            Nomeacao.objects.filter(
+                escala_militar__escala__servico__in=list(servicos),
+                data__gte=data_inicio,
+                data__lte=data_fim
+            ).delete()
+
+            nomeacoes = []
+            for escala_id, nim, dia, e_reserva in plano:
+                escala_militar = roster.get((escala_id, nim))
+                if escala_militar is None:
+                    escala_militar, _ = EscalaMilitar.objects.get_or_create(
+                        escala_id=escala_id,
+                        militar_id=nim,
+                        defaults={'ordem': 2 if e_reserva else 1}
                     )
+                    roster[(escala_id, nim)] = escala_militar
+                nomeacoes.append(Nomeacao(escala_militar=escala_militar, data=dia, e_reserva=e_reserva))
 
-                if militar_reserva and EscalaService.nomear_reserva(escala, militar_reserva, dia):
-                    reservas_nomeados += 1
-                else:
-                    break  # Não há mais militares para nomear como reserva ou ocorreu um erro
+            Nomeacao.objects.bulk_create(nomeacoes)
+            Militar.objects.bulk_update(militares, ['ultima_nomeacao_a', 'ultima_nomeacao_b'])
+            # bulk_create e delete em massa não disparam sinais por nomeação
+            atualizar_versao_escalas(servico.pk for servico in servicos)
+
+    @staticmethod
+    def _motor_geracao(servico):
+        """
+        Devolve as funções (efetivos, reservas) do motor escolhido no serviço.
+        Ambas têm a interface de `_processar_efetivos_para_escala` e `_processar_reservas_para_escala`.
+        """
+        if servico.motor_geracao == "otimizacao":
+            from .motor_otimizacao import processar_efetivos_otimizados, processar_reservas_otimizadas
+            return processar_efetivos_otimizados, processar_reservas_otimizadas
+        return EscalaService._processar_efetivos_para_escala, EscalaService._processar_reservas_para_escala
+
+    @staticmethod
+    def _planear_servicos(servicos, data_inicio, data_fim, excluir_servicos=None, simular=False, antecipacao=0,
+                          progresso_passos=None):
+        """
+        Planeia em memória as escalas de um ou mais serviços, partilhando um único índice de disponibilidade.
+        Processa primeiro os efetivos de Escala B de todos os serviços, depois os de Escala A e por fim os reservas,
+        para que as regras de "já nomeado" e de dias consecutivos se apliquem entre serviços.
+        `excluir_servicos` (por omissão, os próprios serviços) indica as nomeações do período que vão ser substituídas.
+        Com `simular=True` não é feita nenhuma escrita na base de dados (nem as escalas em falta são criadas).
+        Com `antecipacao`, os efetivos são planeados até `data_fim + antecipacao` dias apenas para servirem de
+        reservas aos últimos dias; o plano devolvido e as últimas nomeações ficam limitados a `data_fim`.
+        `progresso_passos(passos_concluidos, total_passos, fase)` é chamado antes de cada passo (efetivos ou
+        reservas de um serviço numa escala) e, no fim, antes da gravação, que conta como o último passo.
+        Retorna o plano e a lista de militares envolvidos.
+        """
+        data_fim_planeamento = data_fim + timedelta(days=antecipacao)
+        dias_escala, militares, militares_por_servico = EscalaService._inicializar_geracao(
+            servicos, data_inicio, data_fim_planeamento)
+        indice = IndiceDisponibilidade.construir(
+            data_inicio, data_fim_planeamento, militares,
+            excluir_servicos=excluir_servicos if excluir_servicos is not None else servicos)
+
+        ultima_nomeacao_a, ultima_nomeacao_b = EscalaService._atualizar_ultimas_nomeacoes(militares, data_inicio)
+
+        plano = []
+        efetivos_por_servico = {}
+        motores = {servico.pk: EscalaService._motor_geracao(servico) for servico in servicos}
+
+        passos = [
+            (e_escala_b, servico)
+            for e_escala_b, tipos in ((True, ("B", "AB")), (False, ("A", "AB")))
+            for servico in servicos if servico.tipo_escalas in tipos
+        ]
+        total_passos = len(passos) + sum(1 for _, servico in passos if servico.n_reservas > 0) + 1
+        passos_concluidos = 0
+
+        def passo(fase):
+            nonlocal passos_concluidos
+            if progresso_passos is not None:
+                progresso_passos(passos_concluidos, total_passos, fase)
+            passos_concluidos += 1
+
+        for e_escala_b, tipos, dias, ultimas in (
+                (True, ("B", "AB"), dias_escala['escala_b'], ultima_nomeacao_b),
+                (False, ("A", "AB"), dias_escala['escala_a'], ultima_nomeacao_a)):
+            for servico in servicos:
+                if servico.tipo_escalas in tipos:
+                    passo(f"Efetivos da Escala {'B' if e_escala_b else 'A'} – {servico.nome}")
+                    # Cada serviço tem a sua própria rotação, a partir das nomeações anteriores ao período
+                    processar_efetivos, _ = motores[servico.pk]
+                    efetivos_por_servico[(servico.pk, e_escala_b)] = processar_efetivos(
+                        servico, dias, dict(ultimas), e_escala_b, militares_por_servico[servico.pk], indice, plano,
+                        simular=simular
+                    )
+
+        for e_escala_b, dias in ((True, dias_escala['escala_b']), (False, dias_escala['escala_a'])):
+            dias_reservas = [dia for dia in dias if dia <= data_fim]
+            for servico in servicos:
+                efetivos_por_dia = efetivos_por_servico.get((servico.pk, e_escala_b))
+                if efetivos_por_dia is not None and servico.n_reservas > 0:
+                    passo(f"Reservas da Escala {'B' if e_escala_b else 'A'} – {servico.nome}")
+                    _, processar_reservas = motores[servico.pk]
+                    processar_reservas(
+                        servico, dias_reservas, efetivos_por_dia, dias, e_escala_b, indice, plano, simular=simular
+                    )
+
+        if antecipacao:
+            # Os dias antecipados serão planeados de novo no bloco seguinte
+            plano = [linha for linha in plano if linha[2] <= data_fim]
+            for militar in militares:
+                militar.ultima_nomeacao_a = ultima_nomeacao_a[militar.nim]
+                militar.ultima_nomeacao_b = ultima_nomeacao_b[militar.nim]
+            for (_, e_escala_b), efetivos_por_dia in efetivos_por_servico.items():
+                for dia, efetivos in efetivos_por_dia.items():
+                    if dia > data_fim:
+                        continue
+                    for militar in efetivos:
+                        if e_escala_b:
+                            militar.ultima_nomeacao_b = max(dia, militar.ultima_nomeacao_b or dia)
+                        else:
+                            militar.ultima_nomeacao_a = max(dia, militar.ultima_nomeacao_a or dia)
+
+        passo("A gravar as nomeações")
+        return plano, militares
+
+    @staticmethod
+    def _replanear_reservas(servicos, data_inicio: date, data_fim: date) -> None:
+        """
+        Planeia de novo os reservas de [data_inicio, data_fim] a partir dos efetivos gravados, incluindo os dos
+        `ANTECIPACAO_RESERVAS_DIAS` dias seguintes, e grava-os com `_gravar_plano` (os efetivos ficam iguais).
+        Na geração de longo prazo, os reservas do fim de um bloco foram escolhidos entre os efetivos antecipados,
+        que o bloco seguinte volta a planear e pode ter mudado.
+        """
+        servicos = list(servicos)
+        data_fim_efetivos = data_fim + timedelta(days=ANTECIPACAO_RESERVAS_DIAS)
+        dias_escala = EscalaService.obter_dias_escala(data_inicio, data_fim_efetivos)
+        militares, _ = EscalaService._carregar_militares(servicos)
+        militares_dict = {militar.nim: militar for militar in militares}
+        # As nomeações dos serviços no período são substituídas; os efetivos são registados de novo abaixo
+        indice = IndiceDisponibilidade.construir(data_inicio, data_fim, militares, excluir_servicos=servicos)
+
+        plano = []
+        efetivos_por_servico = defaultdict(lambda: defaultdict(list))
+        efetivos = (
+            Nomeacao.objects
+            .filter(escala_militar__escala__servico__in=servicos, e_reserva=False,
+                    data__gte=data_inicio, data__lte=data_fim_efetivos)
+            .order_by('data', 'id')
+            .values_list('escala_militar__escala_id', 'escala_militar__escala__servico_id',
+                         'escala_militar__escala__e_escala_b', 'escala_militar__militar_id', 'data')
+        )
+        for escala_id, servico_id, e_escala_b, nim, dia in efetivos:
+            if nim in militares_dict:
+                efetivos_por_servico[(servico_id, e_escala_b)][dia].append(militares_dict[nim])
+            if dia <= data_fim:
+                plano.append((escala_id, nim, dia, False))
+                indice.registar_nomeacao(nim, dia, False, e_escala_b)
+
+        for e_escala_b, dias in ((True, dias_escala['escala_b']), (False, dias_escala['escala_a'])):
+            dias_reservas = [dia for dia in dias if dia <= data_fim]
+            for servico in servicos:
+                efetivos_por_dia = efetivos_por_servico.get((servico.pk, e_escala_b))
+                if efetivos_por_dia and servico.n_reservas > 0:
+                    _, processar_reservas = EscalaService._motor_geracao(servico)
+                    processar_reservas(servico, dias_reservas, efetivos_por_dia, dias, e_escala_b, indice, plano)
+
+        EscalaService._gravar_plano(servicos, data_inicio, data_fim, plano, [])
 
     @staticmethod
     def gerar_escalas_automaticamente(
             servico: Servico,
             data_inicio: date,
-            data_fim: date) -> bool:
+            data_fim: date,
+            progresso_passos: Callable[[int, int, str], None] = None,
+            lancar_erros: bool = False) -> bool:
         """
         Gera escalas automaticamente para um serviço no período especificado.
-        Esta função orquestra a chamada a sub-funções para inicialização,
-        processamento de efetivos e de reservas para cada tipo de escala.
+        O plano completo é construído em memória (efetivos e reservas de cada
+        tipo de escala) e só no fim é gravado numa única transação.
+        Períodos com mais de `MAXIMO_DIAS_PERIODO` dias são gerados em blocos (ver `gerar_escalas_longo_prazo`).
+        `progresso_passos` é passado a `_planear_servicos`. Um erro é registado e devolve False ou,
+        com `lancar_erros=True`, é lançado (o processador de tarefas grava a mensagem original).
         """
+        if (data_fim - data_inicio).days > MAXIMO_DIAS_PERIODO:
+            return EscalaService.gerar_escalas_longo_prazo(
+                [servico], data_inicio, data_fim, processos=1, lancar_erros=lancar_erros)
         try:
-            dias_escala, militares, militares_dict = EscalaService._inicializar_geracao(servico, data_inicio, data_fim)
-            
-            ultima_nomeacao_a, ultima_nomeacao_b = EscalaService._atualizar_ultimas_nomeacoes(militares, data_inicio)
+            plano, militares = EscalaService._planear_servicos(
+                [servico], data_inicio, data_fim, progresso_passos=progresso_passos)
+            EscalaService._gravar_plano([servico], data_inicio, data_fim, plano, militares)
+            return True
+        except Exception:
+            if lancar_erros:
+                raise
+            logger.exception("Erro ao gerar escalas")
+            return False
 
-            efetivos_por_dia_b = defaultdict(list)
-            if servico.tipo_escalas in ("B", "AB"):
-                efetivos_por_dia_b = EscalaService._processar_efetivos_para_escala(
-                    servico, dias_escala['escala_b'], ultima_nomeacao_b, True, militares_dict
-                )
+    @staticmethod
+    def simular_escalas(servicos, data_inicio: date, data_fim: date) -> Dict:
+        """
+        Modo de simulação ("e se?"): planeia as escalas dos serviços indicados exatamente como a geração,
+        mas sem apagar, criar ou alterar nada na base de dados nem disparar sinais.
+
+        Retorna um dicionário com:
+          - `nomeacoes`: lista ordenada por data de dicionários (servico_id, servico, e_escala_b, data, nim, e_reserva);
+          - `escassez`: períodos de escassez por nome de serviço (ver `gerar_alerta_escassez_militares`);
+          - `contagens`: por NIM, o nome, posto e número de nomeações como efetivo e como reserva;
+          - `dias_incompletos`: (servico, data, em falta) para os dias sem efetivos suficientes.
+        As datas são objetos `date`; para JSON basta serializar com `DjangoJSONEncoder`.
+        """
+        servicos = list(servicos)
+        plano, militares = EscalaService._planear_servicos(servicos, data_inicio, data_fim, simular=True)
+
+        servicos_por_id = {servico.pk: servico for servico in servicos}
+        escalas = {
+            escala_id: (servico_id, e_escala_b)
+            for escala_id, servico_id, e_escala_b in Escala.objects.filter(
+                servico__in=servicos).values_list('id', 'servico_id', 'e_escala_b')
+        }
+        militares_por_nim = {militar.nim: militar for militar in militares}
+
+        nomeacoes = []
+        contagens = {}
+        efetivos_por_dia = defaultdict(int)
+        for escala_id, nim, dia, e_reserva in sorted(plano, key=lambda n: (n[2], n[0], n[3])):
+            servico_id, e_escala_b = escalas[escala_id]
+            nomeacoes.append({
+                'servico_id': servico_id,
+                'servico': servicos_por_id[servico_id].nome,
+                'e_escala_b': e_escala_b,
+                'data': dia,
+                'nim': nim,
+                'e_reserva': e_reserva,
+            })
+            if nim not in contagens:
+                militar = militares_por_nim[nim]
+                contagens[nim] = {'nome': militar.nome, 'posto': militar.posto, 'efetivo': 0, 'reserva': 0}
+            contagens[nim]['reserva' if e_reserva else 'efetivo'] += 1
+            if not e_reserva:
+                efetivos_por_dia[(servico_id, dia)] += 1
 
-            efetivos_por_dia_a = defaultdict(list)
+        dias_escala = EscalaService.obter_dias_escala(data_inicio, data_fim)
+        dias_incompletos = []
+        for servico in servicos:
+            dias = []
             if servico.tipo_escalas in ("A", "AB"):
-                efetivos_por_dia_a = EscalaService._processar_efetivos_para_escala(
-                    servico, dias_escala['escala_a'], ultima_nomeacao_a, False, militares_dict
-                )
-            
-            if servico.tipo_escalas in ("B", "AB") and servico.n_reservas > 0:
-                EscalaService._processar_reservas_para_escala(
-                    servico, dias_escala['escala_b'], efetivos_por_dia_b, dias_escala['escala_b'], True
-                )
+                dias += dias_escala['escala_a']
+            if servico.tipo_escalas in ("B", "AB"):
+                dias += dias_escala['escala_b']
+            for dia in sorted(dias):
+                em_falta = servico.n_elementos - efetivos_por_dia[(servico.pk, dia)]
+                if em_falta > 0:
+                    dias_incompletos.append({'servico': servico.nome, 'data': dia, 'em_falta': em_falta})
+
+        escassez = {}
+        for servico in servicos:
+            periodos = EscalaService.gerar_alerta_escassez_militares(servico, data_inicio, data_fim)
+            if periodos:
+                escassez[servico.nome] = periodos
+
+        return {
+            'data_inicio': data_inicio,
+            'data_fim': data_fim,
+            'nomeacoes': nomeacoes,
+            'escassez': escassez,
+            'contagens': contagens,
+            'dias_incompletos': dias_incompletos,
+        }
 
-            if servico.tipo_escalas in ("A", "AB") and servico.n_reservas > 0:
-                EscalaService._processar_reservas_para_escala(
-                    servico, dias_escala['escala_a'], efetivos_por_dia_a, dias_escala['escala_a'], False
-                )
+    @staticmethod
+    def gerar_escalas_unidade(
+            data_inicio: date,
+            data_fim: date,
+            servicos=None,
+            processos: int = None,
+            progresso_passos: Callable[[int, int, str], None] = None,
+            lancar_erros: bool = False) -> bool:
+        """
+        Gera numa só passagem as escalas de todos os serviços da unidade (ou dos indicados) no período.
+        Os serviços partilham o mesmo estado de disponibilidade, pelo que o resultado não depende da
+        ordem de geração, e tudo é gravado numa única transação.
+        Grupos de serviços sem militares em comum são planeados em paralelo em até `processos`
+        processos (por omissão, `settings.GERACAO_PROCESSOS`).
+        Períodos com mais de `MAXIMO_DIAS_PERIODO` dias são gerados em blocos (ver `gerar_escalas_longo_prazo`).
+        `progresso_passos` e `lancar_erros` como em `gerar_escalas_automaticamente`.
+        """
+        from .geracao_paralela import planear_em_paralelo
+        if (data_fim - data_inicio).days > MAXIMO_DIAS_PERIODO:
+            return EscalaService.gerar_escalas_longo_prazo(
+                servicos, data_inicio, data_fim, processos=processos, lancar_erros=lancar_erros)
+        try:
+            servicos = list(servicos if servicos is not None else Servico.objects.all())
+            if processos is None:
+                processos = getattr(settings, 'GERACAO_PROCESSOS', 1)
+            plano, militares = planear_em_paralelo(
+                servicos, data_inicio, data_fim, processos, progresso_passos=progresso_passos)
+            EscalaService._gravar_plano(servicos, data_inicio, data_fim, plano, militares)
+            return True
+        except Exception:
+            if lancar_erros:
+                raise
+            logger.exception("Erro ao gerar escalas da unidade")
+            return False
 
+    @staticmethod
+    def gerar_escalas_longo_prazo(
+            servicos,
+            data_inicio: date,
+            data_fim: date,
+            dias_por_bloco: int = None,
+            progresso: Callable[[int, int], None] = None,
+            processos: int = None,
+            lancar_erros: bool = False) -> bool:
+        """
+        Gera escalas para horizontes longos (um semestre, um ano ou mais) em blocos de `dias_por_bloco`
+        dias (por omissão, `settings.GERACAO_DIAS_POR_BLOCO`). Cada bloco é planeado e gravado em bloco
+        na sua própria transação, pelo que a memória usada depende do tamanho do bloco e não do período.
+
+        A rotação continua de um bloco para o seguinte: cada bloco parte das últimas nomeações gravadas
+        pelo anterior. Os efetivos são planeados `ANTECIPACAO_RESERVAS_DIAS` dias para lá do fim do bloco,
+        para que os reservas dos últimos dias continuem a ser os efetivos dos dias de escala seguintes.
+        Como o bloco seguinte planeia esses dias de novo, depois de o gravar os reservas dos últimos
+        `ANTECIPACAO_RESERVAS_DIAS` dias do bloco anterior são escolhidos de novo entre os efetivos gravados.
+
+        `progresso(dias_concluidos, total_dias)` é chamado depois de gravado cada bloco. Se um bloco falhar,
+        os blocos anteriores ficam gravados e a geração pode ser retomada a partir do bloco em falta;
+        o erro é lançado com `lancar_erros=True`, como em `gerar_escalas_automaticamente`.
+        """
+        from .geracao_paralela import planear_em_paralelo
+        try:
+            servicos = list(servicos if servicos is not None else Servico.objects.all())
+            valido, mensagem = EscalaService.verificar_periodo(
+                data_inicio, data_fim, getattr(settings, 'GERACAO_LONGO_PRAZO_MAXIMO_DIAS', 731))
+            if not valido:
+                raise ValueError(mensagem)
+            if processos is None:
+                processos = getattr(settings, 'GERACAO_PROCESSOS', 1)
+            if dias_por_bloco is None:
+                dias_por_bloco = getattr(settings, 'GERACAO_DIAS_POR_BLOCO', 30)
+            # Cada bloco, com a antecipação, tem de caber no período máximo de uma geração
+            dias_por_bloco = max(1, min(dias_por_bloco, MAXIMO_DIAS_PERIODO - ANTECIPACAO_RESERVAS_DIAS))
+
+            total_dias = (data_fim - data_inicio).days + 1
+            inicio_bloco = data_inicio
+            while inicio_bloco <= data_fim:
+                fim_bloco = min(inicio_bloco + timedelta(days=dias_por_bloco - 1), data_fim)
+                antecipacao = min(ANTECIPACAO_RESERVAS_DIAS, (data_fim - fim_bloco).days)
+                plano, militares = planear_em_paralelo(
+                    servicos, inicio_bloco, fim_bloco, processos, antecipacao=antecipacao)
+                EscalaService._gravar_plano(servicos, inicio_bloco, fim_bloco, plano, militares)
+                if inicio_bloco > data_inicio:
+                    fim_anterior = inicio_bloco - timedelta(days=1)
+                    EscalaService._replanear_reservas(
+                        servicos, max(data_inicio, fim_anterior - timedelta(days=ANTECIPACAO_RESERVAS_DIAS - 1)),
+                        fim_anterior)
+
+                if progresso is not None:
+                    progresso((fim_bloco - data_inicio).days + 1, total_dias)
+                inicio_bloco = fim_bloco + timedelta(days=1)
             return True
-        except (ValueError, Exception) as e:
-            print(f"Erro ao gerar escalas: {str(e)}")
+        except Exception:
+            if lancar_erros:
+                raise
+            logger.exception("Erro ao gerar escalas de longo prazo")
             return False
+
+    @staticmethod
+    def reparar_escalas_dispensa(dispensa: Dispensa) -> int:
+        """
+        Repara as escalas já geradas depois de uma dispensa ser criada ou alterada.
+        Só as nomeações futuras do militar invalidadas pela dispensa (incluindo o dia seguinte ao fim e,
+        para efetivos, o dia anterior ao início) são removidas; cada vaga é preenchida de novo com as
+        regras da geração e as restantes nomeações ficam como estão.
+        Retorna o número de nomeações removidas.
+        """
+        hoje = timezone.now().date()
+        data_inicio = Dispensa._meta.get_field('data_inicio').to_python(dispensa.data_inicio)
+        data_fim = Dispensa._meta.get_field('data_fim').to_python(dispensa.data_fim)
+        dia_antes = data_inicio - timedelta(days=1)
+        dia_depois = data_fim + timedelta(days=1)
+
+        invalidas = list(
+            Nomeacao.objects
+            .filter(escala_militar__militar_id=dispensa.militar_id, data__gt=hoje)
+            .filter(Q(data__gte=data_inicio, data__lte=dia_depois) | Q(data=dia_antes, e_reserva=False))
+            .select_related('escala_militar__escala')
+            .order_by('data')
+        )
+        if not invalidas:
+            return 0
+
+        with transaction.atomic():
+            Nomeacao.objects.filter(pk__in=[n.pk for n in invalidas]).delete()
+            EscalaService._preencher_vagas([
+                (n.escala_militar.escala, n.data, n.e_reserva, n.observacoes) for n in invalidas
+            ])
+
+        return len(invalidas)
+
+    @staticmethod
+    def dias_afetados_dispensa(data_inicio: date, data_fim: date) -> set:
+        """Dias em que uma dispensa pode invalidar nomeações: o período, o dia anterior e o dia seguinte."""
+        return {data_inicio + timedelta(days=i) for i in range(-1, (data_fim - data_inicio).days + 2)}
+
+    @staticmethod
+    def preencher_dias_libertados(militar_id, dias: Iterable[date]) -> int:
+        """
+        Preenche as vagas que ficaram por preencher nos dias que uma dispensa deixou de ocupar (dispensa
+        encurtada, mudada de datas ou removida), nas escalas dos serviços do militar.
+        Só são considerados os dias futuros dentro do período já gerado de cada escala; os efetivos e
+        reservas em falta são escolhidos com as mesmas regras de `reparar_escalas_dispensa`.
+        Retorna o número de nomeações criadas.
+        """
+        hoje = timezone.now().date()
+        dias = sorted(dia for dia in dias if dia > hoje)
+        if not dias:
+            return 0
+
+        escalas = list(Escala.objects.filter(servico__militares=militar_id).select_related('servico').distinct())
+        periodos = {
+            linha['escala_militar__escala_id']: (linha['primeira'], linha['ultima'])
+            for linha in Nomeacao.objects
+            .filter(escala_militar__escala__in=escalas, data__gt=hoje)
+            .values('escala_militar__escala_id')
+            .annotate(primeira=Min('data'), ultima=Max('data'))
+        }
+        nomeados = defaultdict(int)
+        for escala_id, dia, e_reserva in Nomeacao.objects.filter(
+                escala_militar__escala__in=escalas, data__in=dias
+        ).values_list('escala_militar__escala_id', 'data', 'e_reserva'):
+            nomeados[(escala_id, dia, e_reserva)] += 1
+
+        calendario = calendario_dias(dias[0], dias[-1])
+        vagas = []
+        for escala in escalas:
+            tipos = ("B", "AB") if escala.e_escala_b else ("A", "AB")
+            if escala.pk not in periodos or escala.servico.tipo_escalas not in tipos:
+                continue
+            primeira, ultima = periodos[escala.pk]
+            for dia in dias:
+                if not primeira <= dia <= ultima or (calendario.tipo_dia(dia) != 'util') != escala.e_escala_b:
+                    continue
+                for e_reserva, necessarios in ((False, escala.servico.n_elementos), (True, escala.servico.n_reservas)):
+                    vagas += [(escala, dia, e_reserva, '')] * (necessarios - nomeados[(escala.pk, dia, e_reserva)])
+        if not vagas:
+            return 0
+
+        vagas.sort(key=lambda vaga: (vaga[1], vaga[2]))
+        with transaction.atomic():
+            preenchidas = EscalaService._preencher_vagas(vagas)
+        return preenchidas
+
+    @staticmethod
+    def _preencher_vagas(vagas) -> int:
+        """
+        Preenche vagas (escala, dia, é reserva, observações), por ordem de data, com as regras da geração:
+        os efetivos seguem a rotação de cada escala e os reservas são escolhidos entre os efetivos dos dias
+        de escala seguintes. Uma vaga sem militar disponível fica por preencher.
+        Retorna o número de nomeações criadas.
+        """
+        dias = [dia for _, dia, _, _ in vagas]
+        escalas = {escala.pk: escala for escala, _, _, _ in vagas}
+        servicos = list(Servico.objects.filter(escalas__in=list(escalas)).distinct())
+        militares, militares_por_servico = EscalaService._carregar_militares(servicos)
+        indice = IndiceDisponibilidade.construir(min(dias), max(dias), militares)
+        ultima_nomeacao_a, ultima_nomeacao_b = EscalaService._atualizar_ultimas_nomeacoes(militares, min(dias))
+        roster = {
+            (em.escala_id, em.militar_id): em
+            for em in EscalaMilitar.objects.filter(escala_id__in=list(escalas))
+        }
+
+        rotacoes = {}
+        novas = []
+        for escala, dia, e_reserva, observacoes in vagas:
+            militares_dict = militares_por_servico[escala.servico_id]
+
+            if e_reserva:
+                nim = EscalaService._escolher_reserva_substituta(escala, dia, militares_dict, indice)
+            else:
+                if escala.pk not in rotacoes:
+                    ultimas = ultima_nomeacao_b if escala.e_escala_b else ultima_nomeacao_a
+                    rotacoes[escala.pk] = RotacaoEscala.da_escala(escala, dict(ultimas), nims_validos=militares_dict)
+
+                def disponivel(nim):
+                    return EscalaService.verificar_disponibilidade_militar(militares_dict[nim], dia, indice)[0]
+
+                escolhidos = rotacoes[escala.pk].selecionar(dia, 1, disponivel)
+                nim = escolhidos[0] if escolhidos else None
+
+            if nim is None or (escala.pk, nim) not in roster:
+                continue
+            indice.registar_nomeacao(nim, dia, e_reserva, escala.e_escala_b)
+            novas.append(Nomeacao(
+                escala_militar=roster[(escala.pk, nim)],
+                data=dia,
+                e_reserva=e_reserva,
+                observacoes=observacoes,
+            ))
+
+        Nomeacao.objects.bulk_create(novas)
+        atualizar_versao_escalas(servico.pk for servico in servicos)
+        return len(novas)
+
+    @staticmethod
+    def _escolher_reserva_substituta(escala, dia, militares_dict, indice, dias_procura=7):
+        """Escolhe um reserva para `dia` entre os efetivos dos dias de escala seguintes, como na geração."""
+        efetivos_seguintes = (
+            Nomeacao.objects
+            .filter(escala_militar__escala=escala, e_reserva=False,
+                    data__gt=dia, data__lte=dia + timedelta(days=dias_procura))
+            .order_by('data')
+            .values_list('escala_militar__militar_id', flat=True)
+        )
+        for nim in efetivos_seguintes:
+            if nim in militares_dict and EscalaService.verificar_disponibilidade_reserva(
+                    militares_dict[nim], dia, escala.e_escala_b, indice)[0]:
+                return nim
+        return None
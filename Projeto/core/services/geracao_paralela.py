@@ -0,0 +1,121 @@
+import logging
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date
+from typing import Callable, List, Tuple
+
+import django
+from django.db import connection, connections
+
+from ..models import Militar, Servico
+from .escala_service import EscalaService
+
+logger = logging.getLogger(__name__)
+
+
+def agrupar_servicos_independentes(servicos) -> List[List[Servico]]:
+    """
+    Divide os serviços em grupos independentes (componentes ligadas):
+    dois serviços ficam no mesmo grupo se partilharem pelo menos um militar.
+    """
+    servicos = list(servicos)
+    pais = {servico.pk: servico.pk for servico in servicos}
+
+    def raiz(servico_id):
+        while pais[servico_id] != servico_id:
+            pais[servico_id] = pais[pais[servico_id]]
+            servico_id = pais[servico_id]
+        return servico_id
+
+    primeiro_servico_do_militar = {}
+    inscricoes = Servico.militares.through.objects.filter(
+        servico__in=servicos
+    ).values_list('servico_id', 'militar_id')
+    for servico_id, nim in inscricoes:
+        outro = primeiro_servico_do_militar.setdefault(nim, servico_id)
+        pais[raiz(servico_id)] = raiz(outro)
+
+    grupos = {}
+    for servico in servicos:
+        grupos.setdefault(raiz(servico.pk), []).append(servico)
+    return list(grupos.values())
+
+
+def _inicializar_processo():
+    """Prepara o Django em cada processo de trabalho (necessário quando os processos são lançados com spawn)."""
+    django.setup()
+
+
+def _planear_grupo(servico_ids, excluir_ids, data_inicio, data_fim, antecipacao=0):
+    """
+    Planeia um grupo de serviços num processo de trabalho e devolve o resultado em tipos simples.
+    O planeamento é feito com `simular=True`: o processo de trabalho só lê a base de dados, e tudo o que
+    é escrito (escalas em falta, nomeações) fica a cargo do processo principal.
+    """
+    try:
+        servicos = list(Servico.objects.filter(pk__in=servico_ids))
+        excluir = list(Servico.objects.filter(pk__in=excluir_ids))
+        plano, militares = EscalaService._planear_servicos(
+            servicos, data_inicio, data_fim, excluir_servicos=excluir, simular=True, antecipacao=antecipacao)
+        return plano, [(m.nim, m.ultima_nomeacao_a, m.ultima_nomeacao_b) for m in militares]
+    finally:
+        connections.close_all()
+
+
+def planear_em_paralelo(servicos, data_inicio: date, data_fim: date, processos: int,
+                        antecipacao: int = 0,
+                        progresso_passos: Callable[[int, int, str], None] = None) -> Tuple[list, list]:
+    """
+    Planeia os serviços dividindo-os em grupos independentes, cada um num processo separado.
+    Os planos parciais são juntados e devolvidos para serem gravados de uma só vez.
+
+    Se só houver um grupo, um processo, ou se a chamada decorrer dentro de uma transação
+    (os processos de trabalho não veriam os dados ainda não confirmados), o planeamento
+    é feito no processo atual. `antecipacao` e `progresso_passos` são passados a
+    `EscalaService._planear_servicos`; em paralelo, cada passo é um grupo de serviços planeado.
+    """
+    servicos = list(servicos)
+    grupos = agrupar_servicos_independentes(servicos)
+    if processos <= 1 or len(grupos) <= 1 or connection.in_atomic_block:
+        return EscalaService._planear_servicos(
+            servicos, data_inicio, data_fim, antecipacao=antecipacao, progresso_passos=progresso_passos)
+
+    # Os processos de trabalho não escrevem na base de dados: as escalas em falta são criadas aqui,
+    # antes de os lançar, como no planeamento no processo atual, e as nomeações são gravadas por quem chamou
+    for servico in servicos:
+        for e_escala_b, tipos in ((True, ("B", "AB")), (False, ("A", "AB"))):
+            if servico.tipo_escalas in tipos:
+                EscalaService.criar_ou_obter_escala(servico, e_escala_b)
+
+    # Os processos de trabalho abrem as suas próprias ligações; não podem herdar as do processo atual
+    connections.close_all()
+    excluir_ids = [servico.pk for servico in servicos]
+    grupos.sort(key=len, reverse=True)
+
+    def passo(concluidos, fase):
+        if progresso_passos is not None:
+            progresso_passos(concluidos, len(grupos) + 1, fase)
+
+    plano = []
+    militares = []
+    passo(0, f"A planear {len(grupos)} grupos de serviços em paralelo")
+    with ProcessPoolExecutor(max_workers=min(processos, len(grupos)),
+                             initializer=_inicializar_processo) as executor:
+        futuros = [
+            executor.submit(_planear_grupo, [s.pk for s in grupo], excluir_ids, data_inicio, data_fim, antecipacao)
+            for grupo in grupos
+        ]
+        for concluidos, futuro in enumerate(as_completed(futuros), start=1):
+            futuro.result()
+            if concluidos < len(grupos):
+                passo(concluidos, f"Planeados {concluidos} de {len(grupos)} grupos de serviços")
+        for futuro in futuros:
+            plano_grupo, ultimas = futuro.result()
+            plano.extend(plano_grupo)
+            militares.extend(
+                Militar(nim=nim, ultima_nomeacao_a=ultima_a, ultima_nomeacao_b=ultima_b)
+                for nim, ultima_a, ultima_b in ultimas
+            )
+
+    logger.info(f"Planeados {len(servicos)} serviços em {len(grupos)} grupos independentes")
+    passo(len(grupos), "A gravar as nomeações")
+    return plano, militares
@@ -0,0 +1,144 @@
+from bisect import bisect_right
+from datetime import date, timedelta
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from ..models import Dispensa
+
+
+class IndiceDispensas:
+    """
+    Índice de intervalos das dispensas de uma janela de datas, carregadas numa única consulta.
+
+    As dispensas de cada militar ficam ordenadas pela data de início, com o máximo acumulado das
+    datas de fim, pelo que "o militar está dispensado no dia D?" é uma pesquisa binária. As contagens
+    (por dia ou num intervalo) usam um varrimento (sweep-line) sobre os eventos de início e fim
+    ordenados, contando cada militar uma só vez mesmo que tenha dispensas sobrepostas.
+    """
+
+    def __init__(self, data_inicio: date, data_fim: date, dispensas: Iterable[Tuple[str, date, date, str]]):
+        self.data_inicio = data_inicio
+        self.data_fim = data_fim
+        # nim -> lista de (inicio, fim, motivo) ordenada pelo início
+        self._por_militar: Dict[str, List[Tuple[date, date, str]]] = {}
+        for nim, inicio, fim, motivo in sorted(dispensas, key=lambda d: (d[0], d[1])):
+            if inicio <= fim:
+                self._por_militar.setdefault(nim, []).append((inicio, fim, motivo))
+
+        self._inicios: Dict[str, List[date]] = {}
+        self._fim_maximo: Dict[str, List[date]] = {}
+        # Intervalos de cada militar já unidos, usados nas contagens
+        self._unidos: Dict[str, List[Tuple[date, date]]] = {}
+        for nim, intervalos in self._por_militar.items():
+            self._inicios[nim] = [inicio for inicio, _, _ in intervalos]
+            maximos = []
+            unidos = []
+            for inicio, fim, _ in intervalos:
+                maximos.append(max(fim, maximos[-1]) if maximos else fim)
+                if unidos and inicio <= unidos[-1][1] + timedelta(days=1):
+                    unidos[-1] = (unidos[-1][0], max(unidos[-1][1], fim))
+                else:
+                    unidos.append((inicio, fim))
+            self._fim_maximo[nim] = maximos
+            self._unidos[nim] = unidos
+
+    @classmethod
+    def carregar(cls, data_inicio: date, data_fim: date, militares: Optional[Iterable] = None) -> 'IndiceDispensas':
+        """Carrega as dispensas que tocam [data_inicio, data_fim]; `militares` (objetos ou NIMs) limita a carga."""
+        dispensas = Dispensa.objects.filter(data_inicio__lte=data_fim, data_fim__gte=data_inicio)
+        if militares is not None:
+            dispensas = dispensas.filter(militar_id__in=[getattr(m, 'nim', m) for m in militares])
+        return cls(data_inicio, data_fim,
+                   dispensas.values_list('militar_id', 'data_inicio', 'data_fim', 'motivo'))
+
+    def intervalos(self, nims: Optional[Iterable[str]] = None) -> List[Tuple[str, date, date]]:
+        """Intervalos (nim, inicio, fim) das dispensas carregadas, dos militares indicados (todos, se omitido)."""
+        nims = self._por_militar.keys() if nims is None else nims
+        return [
+            (nim, inicio, fim)
+            for nim in nims
+            for inicio, fim, _ in self._por_militar.get(nim, ())
+        ]
+
+    def dispensa_em(self, nim: str, dia: date) -> Optional[Tuple[date, date, str]]:
+        """
+        Devolve a dispensa (inicio, fim, motivo) que cobre `dia`, ou None.
+        Havendo dispensas sobrepostas, devolve a que começou primeiro.
+        """
+        inicios = self._inicios.get(nim)
+        if not inicios:
+            return None
+        i = bisect_right(inicios, dia) - 1
+        maximos = self._fim_maximo[nim]
+        intervalos = self._por_militar[nim]
+        encontrada = None
+        # Só vale a pena recuar enquanto alguma dispensa anterior ainda possa terminar depois de `dia`
+        while i >= 0 and maximos[i] >= dia:
+            if intervalos[i][1] >= dia:
+                encontrada = intervalos[i]
+            i -= 1
+        return encontrada
+
+    def expandir(self, nim: str, inicio: date = None, fim: date = None) -> Dict[date, str]:
+        """
+        Expande as dispensas do militar em {dia: motivo} nos dias de [inicio, fim] (por omissão, a janela
+        carregada), percorrendo cada intervalo uma vez. Havendo sobreposição, fica o motivo da dispensa
+        que começou primeiro, como em `dispensa_em`.
+        """
+        inicio = inicio or self.data_inicio
+        fim = fim or self.data_fim
+        dias = {}
+        for a, b, motivo in self._por_militar.get(nim, ()):
+            if a > fim:
+                break
+            dia = max(a, inicio)
+            ultimo = min(b, fim)
+            while dia <= ultimo:
+                dias.setdefault(dia, motivo)
+                dia += timedelta(days=1)
+        return dias
+
+    def em_dispensa(self, nim: str, dia: date) -> bool:
+        return self.dispensa_em(nim, dia) is not None
+
+    def dispensados_em(self, dia: date, nims: Optional[Iterable[str]] = None) -> Set[str]:
+        """NIMs dos militares (dos indicados) dispensados em `dia`."""
+        nims = self._por_militar.keys() if nims is None else nims
+        return {nim for nim in nims if self.dispensa_em(nim, dia) is not None}
+
+    def contagem_por_dia(self, inicio: date = None, fim: date = None,
+                         nims: Optional[Iterable[str]] = None) -> List[int]:
+        """
+        Número de militares dispensados em cada dia de [inicio, fim] (por omissão, a janela carregada),
+        por varrimento dos eventos ordenados: +1 no início de cada intervalo e -1 no dia seguinte ao fim.
+        """
+        inicio = inicio or self.data_inicio
+        fim = fim or self.data_fim
+        n_dias = (fim - inicio).days + 1
+        if n_dias <= 0:
+            return []
+
+        eventos = []
+        for nim in (self._unidos.keys() if nims is None else nims):
+            for a, b in self._unidos.get(nim, ()):
+                if a <= fim and b >= inicio:
+                    eventos.append(((max(a, inicio) - inicio).days, 1))
+                    eventos.append(((min(b, fim) - inicio).days + 1, -1))
+        eventos.sort()
+
+        contagens = []
+        ativos = 0
+        e = 0
+        for d in range(n_dias):
+            while e < len(eventos) and eventos[e][0] <= d:
+                ativos += eventos[e][1]
+                e += 1
+            contagens.append(ativos)
+        return contagens
+
+    def contagem_intervalo(self, inicio: date, fim: date, nims: Optional[Iterable[str]] = None) -> int:
+        """Número de militares (dos indicados) com alguma dispensa que toca [inicio, fim]."""
+        nims = self._unidos.keys() if nims is None else nims
+        return sum(
+            1 for nim in nims
+            if any(a <= fim and b >= inicio for a, b in self._unidos.get(nim, ()))
+        )
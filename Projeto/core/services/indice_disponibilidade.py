@@ -0,0 +1,116 @@
+from datetime import date, timedelta
+from typing import Iterable, Optional
+from collections import defaultdict
+
+from ..models import Dispensa, Nomeacao
+
+
+class IndiceDisponibilidade:
+    """
+    Índice em memória das dispensas e nomeações de uma janela de datas.
+
+    É construído uma única vez por geração a partir de uma carga em bloco de
+    dispensas e nomeações (janela ± 1 dia) e responde em O(1) às mesmas
+    perguntas que as verificações de `EscalaService` fazem à base de dados.
+    As nomeações feitas durante a geração devem ser registadas com
+    `registar_nomeacao` para que o índice se mantenha atualizado.
+    """
+
+    def __init__(self, data_inicio: date, data_fim: date):
+        self.data_inicio = data_inicio
+        self.data_fim = data_fim
+        # (nim, data) de cada dia coberto por uma dispensa
+        self._dias_dispensa = set()
+        # (nim, data) do primeiro e do último dia de cada dispensa
+        self._inicios_dispensa = set()
+        self._fins_dispensa = set()
+        # (nim, data) -> lista de (e_reserva, e_escala_b), pela ordem de criação
+        self._nomeacoes = defaultdict(list)
+
+    @classmethod
+    def construir(cls, data_inicio: date, data_fim: date,
+                  militares: Optional[Iterable] = None,
+                  excluir_servicos: Optional[Iterable] = None) -> 'IndiceDisponibilidade':
+        """
+        Carrega as dispensas e nomeações da janela [data_inicio - 1, data_fim + 1].
+
+        `militares` limita a carga a esses militares (todos, se omitido).
+        As nomeações dos serviços em `excluir_servicos` dentro de
+        [data_inicio, data_fim] são ignoradas, pois vão ser substituídas
+        pela geração em curso.
+        """
+        janela_inicio = data_inicio - timedelta(days=1)
+        janela_fim = data_fim + timedelta(days=1)
+        indice = cls(janela_inicio, janela_fim)
+
+        dispensas = Dispensa.objects.filter(
+            data_inicio__lte=janela_fim,
+            data_fim__gte=janela_inicio,
+        )
+        nomeacoes = Nomeacao.objects.filter(
+            data__gte=janela_inicio,
+            data__lte=janela_fim,
+        )
+        if militares is not None:
+            nims = [getattr(m, 'nim', m) for m in militares]
+            dispensas = dispensas.filter(militar_id__in=nims)
+            nomeacoes = nomeacoes.filter(escala_militar__militar_id__in=nims)
+        if excluir_servicos is not None:
+            nomeacoes = nomeacoes.exclude(
+                escala_militar__escala__servico__in=list(excluir_servicos),
+                data__gte=data_inicio,
+                data__lte=data_fim,
+            )
+
+        for nim, inicio, fim in dispensas.values_list('militar_id', 'data_inicio', 'data_fim'):
+            indice.registar_dispensa(nim, inicio, fim)
+
+        for nim, dia, e_reserva, e_escala_b in (
+            nomeacoes
+            .order_by('data', 'id')
+            .values_list('escala_militar__militar_id', 'data', 'e_reserva',
+                         'escala_militar__escala__e_escala_b')
+        ):
+            indice.registar_nomeacao(nim, dia, e_reserva, e_escala_b)
+
+        return indice
+
+    def registar_dispensa(self, nim: str, data_inicio: date, data_fim: date):
+        """Acrescenta uma dispensa ao índice, expandida apenas dentro da janela."""
+        self._inicios_dispensa.add((nim, data_inicio))
+        self._fins_dispensa.add((nim, data_fim))
+        dia = max(data_inicio, self.data_inicio)
+        ultimo = min(data_fim, self.data_fim)
+        while dia <= ultimo:
+            self._dias_dispensa.add((nim, dia))
+            dia += timedelta(days=1)
+
+    def registar_nomeacao(self, nim: str, data: date, e_reserva: bool, e_escala_b: bool):
+        """Regista em memória uma nomeação (existente ou acabada de planear)."""
+        self._nomeacoes[(nim, data)].append((e_reserva, e_escala_b))
+
+    def em_dispensa(self, nim: str, data: date) -> bool:
+        return (nim, data) in self._dias_dispensa
+
+    def ja_nomeado(self, nim: str, data: date) -> bool:
+        return bool(self._nomeacoes.get((nim, data)))
+
+    def licenca_antes(self, nim: str, data: date) -> bool:
+        return (nim, data - timedelta(days=1)) in self._fins_dispensa
+
+    def licenca_depois(self, nim: str, data: date) -> bool:
+        return (nim, data + timedelta(days=1)) in self._inicios_dispensa
+
+    def conflito_nomeacao(self, nim: str, data: date) -> bool:
+        return (self.ja_nomeado(nim, data - timedelta(days=1))
+                or self.ja_nomeado(nim, data + timedelta(days=1)))
+
+    def escala_efetivo_seguinte(self, nim: str, data: date) -> Optional[bool]:
+        """
+        Devolve `e_escala_b` da primeira nomeação como efetivo no dia seguinte,
+        ou None se o militar não for efetivo nesse dia.
+        """
+        for e_reserva, e_escala_b in self._nomeacoes.get((nim, data + timedelta(days=1)), ()):
+            if not e_reserva:
+                return e_escala_b
+        return None
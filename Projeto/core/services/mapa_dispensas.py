@@ -0,0 +1,123 @@
+from datetime import date, timedelta
+from typing import Dict, Iterable, List
+
+from django.utils.dateformat import format as formatar_data
+
+from ..models import Servico
+from ..utils import calendario_dias
+from .indice_dispensas import IndiceDispensas
+
+# Maior janela (em dias) servida de uma só vez pela API do mapa de dispensas
+MAXIMO_DIAS_JANELA = 366
+
+
+def construir_mapa_dispensas(servicos: Iterable[Servico], data_inicio: date, data_fim: date) -> Dict:
+    """
+    Dados da grelha do mapa de dispensas (vista pública e administração) para o período.
+
+    Uma consulta carrega as dispensas e outra os militares de todos os serviços. As dispensas de cada
+    militar são expandidas uma só vez em {dia: {'motivo'}} e a linha é partilhada por todos os serviços
+    em que o militar está; os totais diários de cada serviço vêm de um varrimento dos intervalos.
+    O custo é linear no número de militares e de dias de dispensa, em vez de militares × dias.
+    Retorna {servico: {'militares': {militar: {dia: {'motivo'}}}, 'resumo': {'total', 'dispensados', 'disponiveis'}}}.
+    """
+    servicos = list(servicos)
+    indice = IndiceDispensas.carregar(data_inicio, data_fim)
+
+    militares_por_servico = {servico.pk: [] for servico in servicos}
+    militares = {}
+    for ligacao in (
+        Servico.militares.through.objects
+        .filter(servico__in=servicos)
+        .select_related('militar__user')
+        .order_by('militar__posto', 'militar__nim')
+    ):
+        militar = militares.setdefault(ligacao.militar_id, ligacao.militar)
+        militares_por_servico[ligacao.servico_id].append(militar)
+
+    # Linha de cada militar: dias de dispensa com o motivo
+    linhas = {
+        nim: {dia: {'motivo': motivo} for dia, motivo in indice.expandir(nim, data_inicio, data_fim).items()}
+        for nim in militares
+    }
+
+    n_dias = max(0, (data_fim - data_inicio).days + 1)
+    dias = [data_inicio + timedelta(days=i) for i in range(n_dias)]
+
+    mapa = {}
+    for servico in servicos:
+        militares_servico = militares_por_servico[servico.pk]
+        total = len(militares_servico)
+        resumo = {
+            'dispensados': {},
+            'disponiveis': {},
+            'total': {}
+        }
+        contagens = indice.contagem_por_dia(data_inicio, data_fim, [m.nim for m in militares_servico])
+        for dia, dispensados in zip(dias, contagens):
+            if dispensados:
+                resumo['dispensados'][dia] = dispensados
+            resumo['total'][dia] = total
+            resumo['disponiveis'][dia] = total - dispensados
+        mapa[servico] = {
+            'militares': {militar: linhas[militar.nim] for militar in militares_servico},
+            'resumo': resumo
+        }
+    return mapa
+
+
+def _codificar_linha(linha: Dict[date, Dict], data_inicio: date, motivos: Dict[str, int]) -> List[List[int]]:
+    """Codifica os dias de dispensa de um militar em sequências [dia inicial, número de dias, índice do motivo]."""
+    sequencias = []
+    for dia in sorted(linha):
+        indice_dia = (dia - data_inicio).days
+        motivo = motivos.setdefault(linha[dia]['motivo'], len(motivos))
+        if sequencias and sequencias[-1][0] + sequencias[-1][1] == indice_dia and sequencias[-1][2] == motivo:
+            sequencias[-1][1] += 1
+        else:
+            sequencias.append([indice_dia, 1, motivo])
+    return sequencias
+
+
+def janela_mapa_dispensas(servicos: Iterable[Servico], data_inicio: date, data_fim: date) -> Dict:
+    """
+    Uma janela do mapa de dispensas (por exemplo, um mês) num formato JSON compacto.
+
+    Os dias são referidos pelo índice na janela. `tipos` tem um carácter por dia (0 útil, 1 fim de
+    semana, 2 feriado); as dispensas de cada militar vêm codificadas por sequências
+    [dia inicial, número de dias, índice em `motivos`] e aparecem uma só vez, mesmo que o militar esteja
+    em vários serviços; cada serviço indica os NIMs dos seus militares e o número de dispensados por dia.
+    """
+    mapa = construir_mapa_dispensas(servicos, data_inicio, data_fim)
+    calendario = calendario_dias(data_inicio, data_fim)
+    dias = [calendario.data(i) for i in range(len(calendario))]
+
+    motivos = {}
+    militares = {}
+    servicos_json = []
+    for servico, dados in mapa.items():
+        for militar, linha in dados['militares'].items():
+            if militar.nim not in militares:
+                militares[militar.nim] = {
+                    'descricao': f"{militar.posto} {militar.nome} ({militar.nim})",
+                    'dispensas': _codificar_linha(linha, data_inicio, motivos),
+                }
+        servicos_json.append({
+            'id': servico.pk,
+            'nome': servico.nome,
+            'militares': [militar.nim for militar in dados['militares']],
+            'dispensados': [dados['resumo']['dispensados'].get(dia, 0) for dia in dias],
+        })
+
+    return {
+        'inicio': data_inicio.isoformat(),
+        'fim': data_fim.isoformat(),
+        'tipos': calendario.codigos(),
+        'meses': [
+            {'inicio': inicio, 'dias': fim - inicio, 'nome': formatar_data(mes, 'F Y')}
+            for mes, inicio, fim in calendario.meses()
+        ],
+        'motivos': list(motivos),
+        'militares': militares,
+        'servicos': servicos_json,
+    }
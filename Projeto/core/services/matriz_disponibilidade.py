@@ -0,0 +1,131 @@
+from datetime import date, timedelta
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+from ..models import Servico
+from .indice_dispensas import IndiceDispensas
+
+
+class MatrizDisponibilidade:
+    """
+    Matriz booleana militares × dias (NumPy) com os dias de dispensa de cada militar num período.
+
+    É construída numa única passagem a partir dos intervalos das dispensas: cada dispensa soma +1 no
+    primeiro dia e -1 no dia seguinte ao último de um vetor de diferenças, e a soma acumulada ao longo
+    dos dias dá a matriz. As contagens por dia, os períodos de escassez e os mapas de calor por serviço
+    são depois obtidos com operações vetoriais, sem percorrer os dias em Python.
+    """
+
+    def __init__(self, data_inicio: date, data_fim: date, nims: List[str], dispensado: np.ndarray):
+        self.data_inicio = data_inicio
+        self.data_fim = data_fim
+        self.nims = nims
+        self.linhas = {nim: i for i, nim in enumerate(nims)}
+        # dispensado[i, d] é True se o militar i está dispensado no dia data_inicio + d
+        self.dispensado = dispensado
+
+    @classmethod
+    def construir(cls, data_inicio: date, data_fim: date, militares: Optional[Iterable] = None,
+                  indice: Optional[IndiceDispensas] = None) -> 'MatrizDisponibilidade':
+        """
+        Constrói a matriz a partir dos intervalos do `IndiceDispensas` do período (carregado numa
+        só consulta, se não for indicado).
+        `militares` (objetos ou NIMs) define as linhas; por omissão, todos os militares com dispensas.
+        """
+        nims = None if militares is None else [getattr(m, 'nim', m) for m in militares]
+        if indice is None:
+            indice = IndiceDispensas.carregar(data_inicio, data_fim, nims)
+        intervalos = indice.intervalos(nims)
+        if nims is None:
+            nims = sorted({nim for nim, _, _ in intervalos})
+
+        n_dias = max(0, (data_fim - data_inicio).days + 1)
+        matriz = cls(data_inicio, data_fim, list(nims), np.zeros((len(nims), n_dias), dtype=bool))
+        intervalos = [(nim, inicio, fim) for nim, inicio, fim in intervalos if nim in matriz.linhas and inicio <= fim]
+        if not intervalos or n_dias == 0:
+            return matriz
+
+        linhas = np.fromiter((matriz.linhas[nim] for nim, _, _ in intervalos), dtype=np.intp, count=len(intervalos))
+        origem = np.datetime64(data_inicio, 'D')
+        inicios = np.array([inicio for _, inicio, _ in intervalos], dtype='datetime64[D]') - origem
+        fins = np.array([fim for _, _, fim in intervalos], dtype='datetime64[D]') - origem
+        inicios = np.clip(inicios.astype(np.intp), 0, n_dias)
+        fins = np.clip(fins.astype(np.intp) + 1, 0, n_dias)
+
+        diferencas = np.zeros((len(nims), n_dias + 1), dtype=np.int32)
+        np.add.at(diferencas, (linhas, inicios), 1)
+        np.add.at(diferencas, (linhas, fins), -1)
+        matriz.dispensado = np.cumsum(diferencas, axis=1)[:, :n_dias] > 0
+        return matriz
+
+    @property
+    def dias(self) -> List[date]:
+        return [self.data_inicio + timedelta(days=d) for d in range(self.dispensado.shape[1])]
+
+    def _selecao(self, nims: Optional[Iterable[str]]) -> np.ndarray:
+        """Linhas da matriz dos militares indicados (todas, se omitido)."""
+        if nims is None:
+            return self.dispensado
+        return self.dispensado[[self.linhas[nim] for nim in nims if nim in self.linhas]]
+
+    def disponiveis_por_dia(self, nims: Optional[Iterable[str]] = None) -> np.ndarray:
+        """Número de militares (dos indicados) não dispensados em cada dia do período."""
+        selecao = self._selecao(nims)
+        return selecao.shape[0] - selecao.sum(axis=0)
+
+    def periodos_escassez(self, minimo: int, nims: Optional[Iterable[str]] = None) -> List[Dict[str, date]]:
+        """Sequências de dias consecutivos com menos de `minimo` militares disponíveis."""
+        return self.periodos(self.disponiveis_por_dia(nims) < minimo)
+
+    def periodos(self, mascara: np.ndarray) -> List[Dict[str, date]]:
+        """Converte uma máscara diária em períodos {'inicio', 'fim'} detetando as transições com `np.diff`."""
+        transicoes = np.diff(np.concatenate(([0], mascara.astype(np.int8), [0])))
+        inicios = np.flatnonzero(transicoes == 1)
+        fins = np.flatnonzero(transicoes == -1) - 1
+        return [
+            {'inicio': self.data_inicio + timedelta(days=int(i)), 'fim': self.data_inicio + timedelta(days=int(f))}
+            for i, f in zip(inicios, fins)
+        ]
+
+
+def niveis_escassez(disponiveis: np.ndarray, total: int, minimo: int) -> np.ndarray:
+    """
+    Nível de cada dia para o mapa de calor: 0 sem dispensas, 1 com dispensas, 2 a menos de
+    dois militares da escassez e 3 em escassez (menos de `minimo` disponíveis).
+    """
+    return np.select(
+        [disponiveis < minimo, disponiveis < minimo + 2, disponiveis < total],
+        [3, 2, 1],
+        default=0,
+    )
+
+
+def mapa_calor_servicos(servicos, data_inicio: date, data_fim: date, minimo: int = 4) -> Dict:
+    """
+    Mapa de calor da escassez de todos os serviços num período (por exemplo, um ano).
+
+    Uma consulta às inscrições e outra às dispensas alimentam uma única matriz partilhada, da qual
+    se tiram, por serviço, o número de militares disponíveis em cada dia e os períodos de escassez.
+    Retorna {servico.pk: {'total', 'disponiveis' e 'niveis' (arrays por dia), 'periodos'}}.
+    """
+    servicos = list(servicos)
+    nims_por_servico = {servico.pk: [] for servico in servicos}
+    for servico_id, nim in Servico.militares.through.objects.filter(
+            servico__in=servicos).values_list('servico_id', 'militar_id'):
+        nims_por_servico[servico_id].append(nim)
+
+    todos_nims = sorted({nim for nims in nims_por_servico.values() for nim in nims})
+    matriz = MatrizDisponibilidade.construir(data_inicio, data_fim, todos_nims)
+
+    mapa = {}
+    for servico in servicos:
+        nims = nims_por_servico[servico.pk]
+        disponiveis = matriz.disponiveis_por_dia(nims)
+        mapa[servico.pk] = {
+            'total': len(nims),
+            'disponiveis': disponiveis,
+            'niveis': niveis_escassez(disponiveis, len(nims), minimo),
+            'periodos': matriz.periodos(disponiveis < minimo),
+        }
+    return mapa
@@ -0,0 +1,354 @@
+import heapq
+import logging
+import math
+import time
+from collections import defaultdict
+from datetime import timedelta
+from typing import Dict, List, Optional
+
+from django.conf import settings
+
+from ..models import EscalaMilitar
+from .escala_service import EscalaService
+from .rotacao import ORDEM_POR_OMISSAO
+
+logger = logging.getLogger(__name__)
+
+INFINITO = float('inf')
+
+# Pesos da função de custo (inteiros, para o fluxo ser exato)
+PESO_RONDA = 3          # efetivos: a segunda nomeação numa ronda custa como 3 intervalos de desvio
+PESO_ANTECIPACAO = 4    # efetivos: nomear antes da vez custa 4 vezes mais do que nomear depois
+PESO_PREFERENCIA = 100  # reservas: não ser efetivo no dia de escala seguinte
+PESO_RESERVA = 20       # reservas: cada reserva já atribuída ao militar
+
+
+class TempoEsgotado(Exception):
+    """O motor de otimização excedeu o tempo disponível."""
+
+
+class FluxoCustoMinimo:
+    """
+    Rede de fluxo de custo mínimo resolvida por caminhos mais curtos sucessivos
+    (Dijkstra com potenciais). Os custos das arestas têm de ser não negativos.
+    """
+
+    def __init__(self, n_nos: int):
+        # Cada aresta é [destino, capacidade residual, custo, índice da aresta inversa]
+        self.grafo = [[] for _ in range(n_nos)]
+
+    def adicionar_no(self) -> int:
+        self.grafo.append([])
+        return len(self.grafo) - 1
+
+    def adicionar_aresta(self, origem: int, destino: int, capacidade, custo: int):
+        """Acrescenta uma aresta e devolve uma referência para consultar o fluxo que passou nela."""
+        self.grafo[origem].append([destino, capacidade, custo, len(self.grafo[destino])])
+        self.grafo[destino].append([origem, 0, -custo, len(self.grafo[origem]) - 1])
+        return origem, len(self.grafo[origem]) - 1
+
+    def fluxo(self, aresta) -> int:
+        origem, i = aresta
+        destino, _, _, inversa = self.grafo[origem][i]
+        return self.grafo[destino][inversa][1]
+
+    def resolver(self, fonte: int, sumidouro: int, prazo: Optional[float] = None):
+        """
+        Envia o fluxo máximo de `fonte` para `sumidouro` com custo mínimo.
+        Lança `TempoEsgotado` se `time.monotonic()` ultrapassar `prazo`.
+        Retorna (fluxo, custo).
+        """
+        n = len(self.grafo)
+        potencial = [0] * n
+        fluxo_total = custo_total = 0
+
+        while True:
+            if prazo is not None and time.monotonic() > prazo:
+                raise TempoEsgotado()
+
+            distancia = [INFINITO] * n
+            anterior = [None] * n
+            distancia[fonte] = 0
+            fila = [(0, fonte)]
+            while fila:
+                d, u = heapq.heappop(fila)
+                if d > distancia[u]:
+                    continue
+                for i, (v, capacidade, custo, _) in enumerate(self.grafo[u]):
+                    if capacidade > 0:
+                        nova = d + custo + potencial[u] - potencial[v]
+                        if nova < distancia[v]:
+                            distancia[v] = nova
+                            anterior[v] = (u, i)
+                            heapq.heappush(fila, (nova, v))
+
+            if distancia[sumidouro] == INFINITO:
+                break
+            for v in range(n):
+                if distancia[v] < INFINITO:
+                    potencial[v] += distancia[v]
+
+            quantidade = INFINITO
+            v = sumidouro
+            while v != fonte:
+                u, i = anterior[v]
+                quantidade = min(quantidade, self.grafo[u][i][1])
+                v = u
+            v = sumidouro
+            while v != fonte:
+                u, i = anterior[v]
+                aresta = self.grafo[u][i]
+                aresta[1] -= quantidade
+                self.grafo[v][aresta[3]][1] += quantidade
+                v = u
+
+            fluxo_total += quantidade
+            custo_total += quantidade * (potencial[sumidouro] - potencial[fonte])
+
+        return fluxo_total, custo_total
+
+
+def _prazo() -> float:
+    return time.monotonic() + getattr(settings, 'OTIMIZACAO_TEMPO_LIMITE', 10)
+
+
+def _avisar_tempo_esgotado(servico, nomeacoes: str) -> None:
+    logger.warning(
+        f"Tempo limite do motor de otimização excedido em {servico.nome} ({nomeacoes}); a usar o motor guloso")
+
+
+def _militares_da_escala(escala, militares_dict) -> List[str]:
+    """NIMs dos militares ativos da escala, pela ordem de desempate da rotação (ordem, depois inscrição)."""
+    entradas = (
+        EscalaMilitar.objects
+        .filter(escala=escala, ativo=True)
+        .order_by('id')
+        .values_list('militar_id', 'ordem')
+    )
+    entradas = [
+        (ordem if ordem is not None else ORDEM_POR_OMISSAO, posicao, nim)
+        for posicao, (nim, ordem) in enumerate(entradas)
+        if nim in militares_dict
+    ]
+    return [nim for _, _, nim in sorted(entradas)]
+
+
+def _atribuir_dias(dias, nims, por_dia, candidato, custo, carga, peso_carga, prazo,
+                   ronda=None, custo_ronda=None, peso_ronda=0) -> Dict:
+    """
+    Resolve a atribuição de `por_dia` militares a cada dia de `dias` como um fluxo de custo mínimo:
+
+        fonte -> dia (capacidade por_dia) -> [(militar, ronda) ->] militar -> sumidouro
+
+    `candidato(nim, dia)` indica as arestas permitidas e `custo(nim, dia)` o seu custo.
+    Com `ronda(nim, dia)`, a primeira nomeação do militar em cada ronda custa `custo_ronda(nim, ronda)`
+    e as seguintes `peso_ronda`;
+    entre militar e sumidouro, a k-ésima nomeação custa `peso_carga * (carga + k)`, o que
+    distribui o serviço de forma equilibrada. Retorna {dia: [nim, ...]}.
+    Lança `TempoEsgotado` se o `prazo` for ultrapassado, tanto na construção da rede como na resolução.
+    """
+    if not dias or not nims:
+        return {}
+
+    fonte, sumidouro = 0, 1
+    indice_dia = {dia: 2 + i for i, dia in enumerate(dias)}
+    indice_militar = {nim: 2 + len(dias) + i for i, nim in enumerate(nims)}
+    nos_ronda = {}
+    rede = FluxoCustoMinimo(2 + len(dias) + len(nims))
+
+    arestas = []
+    for dia in dias:
+        # As verificações de disponibilidade de cada dia podem custar mais do que a própria resolução
+        if prazo is not None and time.monotonic() > prazo:
+            raise TempoEsgotado()
+        rede.adicionar_aresta(fonte, indice_dia[dia], por_dia, 0)
+        for nim in nims:
+            if not candidato(nim, dia):
+                continue
+            destino = indice_militar[nim]
+            if ronda is not None:
+                chave = (nim, ronda(nim, dia))
+                if chave not in nos_ronda:
+                    nos_ronda[chave] = rede.adicionar_no()
+                    rede.adicionar_aresta(nos_ronda[chave], destino, 1, custo_ronda(*chave))
+                    rede.adicionar_aresta(nos_ronda[chave], destino, len(dias), peso_ronda)
+                destino = nos_ronda[chave]
+            arestas.append((dia, nim, rede.adicionar_aresta(indice_dia[dia], destino, 1, custo(nim, dia))))
+
+    # Custo marginal crescente por militar; a última aresta absorve o excedente
+    limite = math.ceil(len(dias) * por_dia / len(nims)) + 1
+    for nim in nims:
+        for k in range(limite):
+            rede.adicionar_aresta(indice_militar[nim], sumidouro, 1, peso_carga * (carga[nim] + k))
+        rede.adicionar_aresta(indice_militar[nim], sumidouro, len(dias), peso_carga * (carga[nim] + limite))
+
+    rede.resolver(fonte, sumidouro, prazo)
+
+    atribuicao = defaultdict(list)
+    for dia, nim, aresta in arestas:
+        if rede.fluxo(aresta):
+            atribuicao[dia].append(nim)
+    return atribuicao
+
+
+def processar_efetivos_otimizados(servico, dias_para_processar, ultima_nomeacao_dict, e_escala_b, militares_dict,
+                                  indice, plano, simular=False):
+    """
+    Alternativa a `EscalaService._processar_efetivos_para_escala` com a mesma interface.
+
+    Cada militar tem uma data ideal por ronda (quando lhe volta a caber a vez) e o fluxo minimiza o desvio
+    de todas as nomeações do período em relação a essas datas, respeitando a disponibilidade.
+    A regra "sem dias consecutivos" não cabe num único problema de fluxo, por isso os dias são
+    divididos pela paridade: dentro de cada metade não há dias seguidos, e cada metade é resolvida
+    de uma só vez para todo o período. A segunda metade já vê as nomeações da primeira.
+    Se o tempo limite for excedido, usa o motor guloso.
+    """
+    escala = EscalaService._obter_escala(servico, e_escala_b, simular)
+    if escala is None or not dias_para_processar:
+        return defaultdict(list)
+
+    nims = _militares_da_escala(escala, militares_dict)
+    dias = sorted(dias_para_processar)
+    if not nims:
+        return defaultdict(list)
+
+    # Intervalo ideal entre nomeações de um militar, em dias de calendário
+    dias_por_dia_escala = ((dias[-1] - dias[0]).days + 1) / len(dias)
+    intervalo = max(2.0, len(nims) / servico.n_elementos * dias_por_dia_escala)
+
+    # Data em que volta a caber a vez a cada militar: última nomeação + intervalo. Quem nunca foi nomeado
+    # entra escalonado no início do período, pela ordem da escala, como na rotação.
+    inicio = dias[0].toordinal()
+    vez = {}
+    novos = 0
+    for nim in nims:
+        ultima = ultima_nomeacao_dict.get(nim)
+        if ultima:
+            vez[nim] = ultima.toordinal() + intervalo
+        else:
+            vez[nim] = inicio + (novos // servico.n_elementos) * dias_por_dia_escala
+            novos += 1
+    posicao = {nim: i for i, nim in enumerate(sorted(nims, key=lambda nim: vez[nim]))}
+
+    # Unidade de custo: um dia de desvio ao quadrado; a posição só desempata
+    unidade = len(nims)
+    penalizacao_ronda = PESO_RONDA * int(intervalo) ** 2 * unidade
+
+    def ronda(nim, dia):
+        """Ronda do militar em `dia`: a k-ésima vez, centrada em vez + k * intervalo (nunca antes da primeira)."""
+        return max(0, round((dia.toordinal() - vez[nim]) / intervalo))
+
+    def custo(nim, dia):
+        # O desvio ao quadrado em relação à data ideal faz com que, entre vários militares, quem espera
+        # há mais tempo seja nomeado primeiro, e permite adiar ou antecipar quando há dispensas
+        desvio = dia.toordinal() - (vez[nim] + ronda(nim, dia) * intervalo)
+        peso = PESO_ANTECIPACAO if desvio < 0 else 1
+        return int(peso * desvio * desvio) * unidade + posicao[nim]
+
+    rondas_usadas = set()
+    fim = dias[-1].toordinal()
+
+    def custo_ronda(nim, k):
+        # Uma ronda cuja data ideal cai no período tem de ser cumprida: as restantes (que só existem
+        # porque o militar pode ser nomeado mais cedo ou mais tarde) e as já usadas custam mais
+        if (nim, k) in rondas_usadas:
+            return penalizacao_ronda
+        if vez[nim] + k * intervalo <= fim:
+            return 0
+        return int(intervalo) ** 2 * unidade
+
+    carga = defaultdict(int)
+    escolhidos = set()
+
+    def candidato(nim, dia):
+        if (nim, dia - timedelta(days=1)) in escolhidos or (nim, dia + timedelta(days=1)) in escolhidos:
+            return False
+        return EscalaService.verificar_disponibilidade_militar(militares_dict[nim], dia, indice)[0]
+
+    prazo = _prazo()
+    paridade = dias[0].toordinal() % 2
+    atribuicao = {}
+    try:
+        for metade in (paridade, 1 - paridade):
+            dias_metade = [dia for dia in dias if dia.toordinal() % 2 == metade]
+            parcial = _atribuir_dias(dias_metade, nims, servico.n_elementos, candidato, custo, carga,
+                                     unidade, prazo, ronda, custo_ronda, penalizacao_ronda)
+            for dia, nims_dia in parcial.items():
+                for nim in nims_dia:
+                    escolhidos.add((nim, dia))
+                    rondas_usadas.add((nim, ronda(nim, dia)))
+                    carga[nim] += 1
+            atribuicao.update(parcial)
+    except TempoEsgotado:
+        _avisar_tempo_esgotado(servico, 'efetivos')
+        return EscalaService._processar_efetivos_para_escala(
+            servico, dias_para_processar, ultima_nomeacao_dict, e_escala_b, militares_dict, indice, plano,
+            simular=simular)
+
+    efetivos_por_dia = defaultdict(list)
+    for dia in dias:
+        for nim in atribuicao.get(dia, ()):
+            militar = militares_dict[nim]
+            plano.append((escala.pk, nim, dia, False))
+            indice.registar_nomeacao(nim, dia, False, e_escala_b)
+            ultima_nomeacao_dict[nim] = dia
+            if e_escala_b:
+                militar.ultima_nomeacao_b = max(dia, militar.ultima_nomeacao_b or dia)
+            else:
+                militar.ultima_nomeacao_a = max(dia, militar.ultima_nomeacao_a or dia)
+            efetivos_por_dia[dia].append(militar)
+
+    return efetivos_por_dia
+
+
+def processar_reservas_otimizadas(servico, dias_para_processar, efetivos_por_dia, todos_dias_escala, e_escala_b,
+                                  indice, plano, simular=False):
+    """
+    Alternativa a `EscalaService._processar_reservas_para_escala` com a mesma interface.
+
+    Todas as vagas de reserva do período são resolvidas num único fluxo de custo mínimo, em vez de
+    dia a dia: são preferidos os efetivos do dia de escala seguinte e as reservas são repartidas
+    entre os militares, pelo que não há vagas perdidas enquanto houver alguém disponível.
+    Se o tempo limite for excedido, usa o motor guloso.
+    """
+    escala = EscalaService._obter_escala(servico, e_escala_b, simular)
+    if escala is None or not dias_para_processar:
+        return
+
+    dias = sorted(dias_para_processar)
+    militares_dict = {}
+    for efetivos in efetivos_por_dia.values():
+        for militar in efetivos:
+            militares_dict[militar.nim] = militar
+    nims = sorted(militares_dict)
+
+    seguinte = EscalaService.obter_dias_seguintes(todos_dias_escala)
+    efetivos_seguinte = {
+        dia: {militar.nim for militar in efetivos_por_dia.get(seguinte.get(dia), ())}
+        for dia in dias
+    }
+
+    def candidato(nim, dia):
+        return EscalaService.verificar_disponibilidade_reserva(militares_dict[nim], dia, e_escala_b, indice)[0]
+
+    def custo(nim, dia):
+        return 0 if nim in efetivos_seguinte.get(dia, ()) else PESO_PREFERENCIA
+
+    carga = defaultdict(int)
+    for _, nim, _, e_reserva in plano:
+        if e_reserva:
+            carga[nim] += 1
+
+    try:
+        atribuicao = _atribuir_dias(dias, nims, servico.n_reservas, candidato, custo, carga,
+                                    PESO_RESERVA, _prazo())
+    except TempoEsgotado:
+        _avisar_tempo_esgotado(servico, 'reservas')
+        return EscalaService._processar_reservas_para_escala(
+            servico, dias_para_processar, efetivos_por_dia, todos_dias_escala, e_escala_b, indice, plano,
+            simular=simular)
+
+    for dia in dias:
+        for nim in atribuicao.get(dia, ()):
+            plano.append((escala.pk, nim, dia, True))
+            indice.registar_nomeacao(nim, dia, True, e_escala_b)
@@ -0,0 +1,111 @@
+import hashlib
+from datetime import date, timedelta
+from typing import Dict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count
+
+from ..models import Nomeacao, Servico
+from .indice_dispensas import IndiceDispensas
+from .versao_escalas import versao_escalas
+
+# Prefixo da chave da cache com os dados da página inicial; a chave inclui o dia e a versão das escalas
+CHAVE_CACHE_PAINEL = 'core:painel_inicial'
+
+
+def cor_banner(nome_servico: str) -> str:
+    """Cor do banner de um serviço na página inicial, conforme o seu nome."""
+    nome_lower = nome_servico.lower()
+    if "oficial" in nome_lower:
+        return "bg-danger text-white"  # vermelho
+    if "sargento" in nome_lower or "comandante" in nome_lower:
+        return "bg-success text-white"  # verde
+    if "cabo" in nome_lower:
+        return "bg-primary text-white"  # azul
+    if "graduado" in nome_lower:
+        return "bg-secondary text-white"  # roxo/cinzento
+    return "bg-warning text-dark"  # amarelo (praças)
+
+
+def calcular_painel(hoje: date) -> Dict:
+    """
+    Calcula os dados da página inicial com um número fixo de consultas agrupadas (cinco),
+    independentemente do número de serviços e do histórico de nomeações.
+    """
+    amanha = hoje + timedelta(days=1)
+    servicos = list(Servico.objects.all())
+
+    # Militares de cada serviço numa só consulta à tabela de ligação
+    nims_por_servico = {servico.pk: [] for servico in servicos}
+    for servico_id, nim in Servico.militares.through.objects.values_list('servico_id', 'militar_id'):
+        nims_por_servico.setdefault(servico_id, []).append(nim)
+
+    # Dispensas de hoje carregadas uma vez; as contagens por serviço são feitas em memória
+    indice_dispensas = IndiceDispensas.carregar(hoje, hoje)
+
+    # Efetivos de hoje e de amanhã de todos os serviços; fica o primeiro de cada serviço e dia
+    efetivos = {}
+    for nomeacao in (
+        Nomeacao.objects
+        .filter(data__in=[hoje, amanha], e_reserva=False)
+        .select_related('escala_militar__escala', 'escala_militar__militar')
+        .order_by('data', 'pk')
+    ):
+        efetivos.setdefault((nomeacao.escala_militar.escala.servico_id, nomeacao.data), nomeacao.escala_militar.militar)
+
+    # Top 5 militares com mais serviços realizados
+    top_militares_qs = (
+        Nomeacao.objects
+        .values('escala_militar__militar__nome', 'escala_militar__militar__posto')
+        .annotate(total=Count('id'))
+        .order_by('-total')[:5]
+    )
+    top_militares = [
+        (f"{item['escala_militar__militar__posto']} {item['escala_militar__militar__nome']}", item['total'])
+        for item in top_militares_qs
+    ]
+
+    servicos_info = [
+        {
+            'obj': servico,
+            'total_militares': len(nims_por_servico[servico.pk]),
+            'dispensados_hoje': len(indice_dispensas.dispensados_em(hoje, nims_por_servico[servico.pk])),
+            'militar_hoje': efetivos.get((servico.pk, hoje)),
+            'militar_amanha': efetivos.get((servico.pk, amanha)),
+            'cor_banner': cor_banner(servico.nome),
+        }
+        for servico in servicos
+    ]
+
+    return {
+        'servicos_info': servicos_info,
+        'total_militares': sum(info['total_militares'] for info in servicos_info),
+        'total_dispensados': len(indice_dispensas.dispensados_em(hoje)),
+        'top_militares': top_militares,
+    }
+
+
+def chave_painel(hoje: date) -> str:
+    """
+    Chave da cache do painel: o dia e um hash da versão das escalas de todos os serviços (lida numa consulta).
+    A versão está na base de dados e muda na transação que altera nomeações, dispensas, serviços, escalas
+    ou militares, pelo que uma alteração feita em qualquer processo muda a chave em todos.
+    """
+    versoes, ultima = versao_escalas()
+    return f"{CHAVE_CACHE_PAINEL}:{hoje.isoformat()}:{hashlib.sha256(repr((versoes, ultima)).encode()).hexdigest()}"
+
+
+def obter_painel(hoje: date = None) -> Dict:
+    """
+    Dados da página inicial, servidos da cache durante `PAINEL_INICIAL_CACHE_SEGUNDOS` enquanto a chave
+    (`chave_painel`) não muda. Não é preciso invalidar nada: com uma cache local de cada processo (LocMem),
+    cada processo calcula o painel uma vez por versão, mas nenhum serve dados de uma versão anterior.
+    """
+    hoje = hoje or date.today()
+    chave = chave_painel(hoje)
+    dados = cache.get(chave)
+    if dados is None:
+        dados = calcular_painel(hoje)
+        cache.set(chave, dados, settings.PAINEL_INICIAL_CACHE_SEGUNDOS)
+    return dados
@@ -0,0 +1,211 @@
+import io
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime
+from typing import Dict, List, Optional, Tuple
+
+import django
+from django.db import connection, connections
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import cm
+from reportlab.pdfgen import canvas
+
+from ..models import ConfiguracaoUnidade, Nomeacao
+from ..utils import calendario_dias
+from .cache_pdf import chave_pdf, guardar_pdf, ler_pdf
+
+logger = logging.getLogger(__name__)
+
+
+def nome_cabecalho_unidade(config: Optional[ConfiguracaoUnidade]) -> str:
+    """Nome da unidade (e subunidade) no cabeçalho dos PDFs."""
+    if config:
+        if config.nome_subunidade:
+            return f"{config.nome_unidade} - {config.nome_subunidade}"
+        return config.nome_unidade
+    return "Unidade Militar"
+
+
+def chave_previsoes_pdf(nome_cabecalho: str, nome_servico: str, dias: List[Dict], linhas: Dict,
+                        exportado_em: date) -> str:
+    """
+    Chave na cache de PDFs das previsões de um serviço: o próprio conteúdo do documento (cabeçalho, serviço,
+    dias com o seu tipo e linhas), pelo que é válida em qualquer processo, sem depender de invalidações.
+    Inclui o dia da exportação, que o documento mostra em "Exportado em": um PDF nunca é servido noutro dia.
+    """
+    return chave_pdf(
+        'previsoes', nome_cabecalho, nome_servico,
+        [(dia['data'], dia['tipo_dia']) for dia in dias], sorted(linhas.items()), exportado_em
+    )
+
+
+def dados_previsoes(servico_ids: List[int], hoje: date) -> Dict[int, Tuple[List[Dict], Dict]]:
+    """
+    Dados das previsões (a partir de hoje) de vários serviços numa só consulta, em tipos simples:
+    {servico_id: (dias, linhas)}, com `dias` como na grelha de previsões e
+    `linhas` = {data: (efetivo, reserva, observações)}. Serviços sem nomeações ficam de fora.
+    """
+    linhas_por_servico = {}
+    for servico_id, data, e_reserva, posto, nome, observacoes in (
+        Nomeacao.objects
+        .filter(escala_militar__escala__servico_id__in=servico_ids, data__gte=hoje)
+        .order_by('data', 'pk')
+        .values_list('escala_militar__escala__servico_id', 'data', 'e_reserva',
+                     'escala_militar__militar__posto', 'escala_militar__militar__nome',
+                     'escala_militar__escala__observacoes')
+    ):
+        linhas = linhas_por_servico.setdefault(servico_id, {})
+        efetivo, reserva, _ = linhas.get(data, (None, None, ''))
+        if e_reserva:
+            reserva = f"{posto} {nome}"
+        else:
+            efetivo = f"{posto} {nome}"
+        linhas[data] = (efetivo, reserva, observacoes or '')
+
+    dados = {}
+    for servico_id, linhas in linhas_por_servico.items():
+        datas_ordenadas = list(linhas)
+        dias = calendario_dias(datas_ordenadas[0], datas_ordenadas[-1]).classificar(datas_ordenadas)
+        dados[servico_id] = (dias, linhas)
+    return dados
+
+
+def desenhar_previsoes_pdf(nome_cabecalho: str, nome_servico: str, dias: List[Dict],
+                           linhas: Dict, timestamp: str) -> bytes:
+    """Desenha o PDF das previsões de um serviço (o mesmo documento da exportação individual)."""
+    buffer = io.BytesIO()
+    p = canvas.Canvas(buffer, pagesize=A4)
+    width, height = A4
+
+    def draw_header():
+        # Centralizar o nome da unidade
+        p.setFont("Helvetica-Bold", 16)
+        text_width = p.stringWidth(nome_cabecalho, "Helvetica-Bold", 16)
+        x_centro = (width - text_width) / 2
+        p.drawString(x_centro, height-2*cm, nome_cabecalho)
+
+        p.setFont("Helvetica-Bold", 14)
+        p.drawString(2*cm, height-3*cm, f"Previsões de Nomeação – {nome_servico}")
+        # Adicionar timestamp no canto superior direito
+        p.setFont("Helvetica", 8)
+        p.drawRightString(width-2*cm, height-1.5*cm, timestamp)
+        p.setFont("Helvetica", 10)
+
+    def draw_footer():
+        p.setFont("Helvetica", 8)
+        # Desenhar o aviso mais abaixo
+        aviso = "Atenção: Estas previsões podem ser alteradas. Deve sempre consultar a Ordem de Serviço antes de sair da Unidade."
+        p.drawString(2*cm, 1*cm, aviso)
+
+    def draw_table_header(y):
+        p.setFillColor(colors.HexColor('#4A5D23'))
+        p.rect(2*cm, y, width-4*cm, 0.7*cm, fill=1)
+        p.setFillColor(colors.white)
+        p.drawString(2.1*cm, y+0.2*cm, "Data")
+        p.drawString(5*cm, y+0.2*cm, "Efetivo")
+        p.drawString(10*cm, y+0.2*cm, "Reserva")
+        p.drawString(15*cm, y+0.2*cm, "Observações")
+
+    draw_header()
+    draw_footer()
+    y = height-4*cm
+
+    # Cabeçalho da tabela
+    draw_table_header(y)
+    y -= 0.7*cm
+
+    for dia in dias:
+        if y < 2*cm:
+            p.showPage()
+            draw_header()
+            draw_footer()
+            y = height-3*cm
+            p.setFont("Helvetica", 10)
+            y -= 1*cm
+            draw_table_header(y)
+            y -= 0.7*cm
+
+        data_str = dia['data'].strftime('%d/%m/%Y')
+        efetivo, reserva, obs = linhas.get(dia['data'], (None, None, ''))
+
+        # Destacar Escala B (fim de semana ou feriado)
+        if dia['tipo_dia'] in ['feriado', 'fim_semana']:
+            p.saveState()
+            p.setFillColor(colors.HexColor('#e6f2d8'))
+            p.rect(2*cm, y, width-4*cm, 0.6*cm, fill=1, stroke=0)
+            p.restoreState()
+            p.setFont("Helvetica-Bold", 9)
+            p.setFillColor(colors.HexColor('#4A5D23'))
+        else:
+            p.setFont("Helvetica", 9)
+            p.setFillColor(colors.black)
+
+        p.drawString(2.1*cm, y+0.1*cm, data_str)
+        p.drawString(5*cm, y+0.1*cm, efetivo or "—")
+        p.drawString(10*cm, y+0.1*cm, reserva or "—")
+        p.drawString(15*cm, y+0.1*cm, obs[:40])
+        y -= 0.6*cm
+
+    p.showPage()
+    p.save()
+    return buffer.getvalue()
+
+
+def _inicializar_processo():
+    """Prepara o Django em cada processo de trabalho (necessário quando os processos são lançados com spawn)."""
+    django.setup()
+
+
+def _desenhar_em_processo(argumentos) -> bytes:
+    return desenhar_previsoes_pdf(*argumentos)
+
+
+def exportar_previsoes_lote(servicos, hoje: date, processos: int) -> List[Tuple[str, bytes]]:
+    """
+    PDFs das previsões de vários serviços, como [(nome do ficheiro, conteúdo)].
+
+    Os dados de todos os serviços são lidos no processo atual com uma consulta; os PDFs que já estão
+    na cache são lidos do disco e os restantes desenhados em paralelo em `processos` processos de
+    trabalho (que só recebem tipos simples e não acedem à base de dados) e guardados na cache.
+    Dentro de uma transação, ou com um só PDF por desenhar, tudo decorre no processo atual.
+    Serviços sem nomeações futuras ficam de fora.
+    """
+    servicos = list(servicos)
+    config = ConfiguracaoUnidade.objects.first()
+    nome_cabecalho = nome_cabecalho_unidade(config)
+    agora = datetime.now()
+    timestamp = agora.strftime('Exportado em: %d/%m/%Y %H:%M')
+    dados = dados_previsoes([servico.pk for servico in servicos], hoje)
+
+    ficheiros = {}
+    por_desenhar = []
+    for servico in servicos:
+        if servico.pk not in dados:
+            continue
+        dias, linhas = dados[servico.pk]
+        chave = chave_previsoes_pdf(nome_cabecalho, servico.nome, dias, linhas, agora.date())
+        conteudo = ler_pdf(chave)
+        if conteudo is not None:
+            ficheiros[servico.pk] = conteudo
+        else:
+            por_desenhar.append((servico.pk, chave, (nome_cabecalho, servico.nome, dias, linhas, timestamp)))
+
+    if processos <= 1 or len(por_desenhar) <= 1 or connection.in_atomic_block:
+        desenhados = [desenhar_previsoes_pdf(*argumentos) for _, _, argumentos in por_desenhar]
+    else:
+        # Os processos de trabalho não podem herdar as ligações à base de dados do processo atual
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=min(processos, len(por_desenhar)),
+                                 initializer=_inicializar_processo) as executor:
+            desenhados = list(executor.map(_desenhar_em_processo, [argumentos for _, _, argumentos in por_desenhar]))
+        logger.info(f"Desenhados {len(por_desenhar)} PDFs de previsões em {min(processos, len(por_desenhar))} processos")
+
+    for (servico_id, chave, _), conteudo in zip(por_desenhar, desenhados):
+        guardar_pdf(chave, conteudo)
+        ficheiros[servico_id] = conteudo
+
+    return [
+        (f"previsoes_{servico.nome}.pdf", ficheiros[servico.pk])
+        for servico in servicos if servico.pk in ficheiros
+    ]
@@ -0,0 +1,70 @@
+import heapq
+from datetime import date
+from typing import Callable, Dict, Iterable, List, Optional
+
+from ..models import EscalaMilitar
+
+# Ordem atribuída a militares sem ordem definida na escala (ficam no fim da rotação)
+ORDEM_POR_OMISSAO = 9999
+
+
+class RotacaoEscala:
+    """
+    Rotação dos militares de uma escala mantida numa fila de prioridade (heap).
+
+    A chave de cada militar é (última nomeação, ordem): quem não é nomeado há
+    mais tempo sai primeiro e a ordem manual da escala serve de desempate.
+    Escolher os efetivos de um dia custa O(k log M), em que k é o número de
+    militares retirados da fila até encontrar os disponíveis.
+    """
+
+    def __init__(self, entradas: Iterable, ultima_nomeacao_dict: Dict[str, Optional[date]]):
+        """`entradas` são pares (nim, ordem) pela ordem de desempate final."""
+        self.ultima_nomeacao_dict = ultima_nomeacao_dict
+        self._heap = []
+        for posicao, (nim, ordem) in enumerate(entradas):
+            ordem = ordem if ordem is not None else ORDEM_POR_OMISSAO
+            ultima = ultima_nomeacao_dict.get(nim) or date.min
+            self._heap.append((ultima, ordem, posicao, nim))
+        heapq.heapify(self._heap)
+
+    @classmethod
+    def da_escala(cls, escala, ultima_nomeacao_dict: Dict[str, Optional[date]],
+                  nims_validos=None) -> 'RotacaoEscala':
+        """Constrói a rotação a partir de uma única consulta aos militares ativos da escala."""
+        entradas = (
+            EscalaMilitar.objects
+            .filter(escala=escala, ativo=True)
+            .order_by('id')
+            .values_list('militar_id', 'ordem')
+        )
+        if nims_validos is not None:
+            entradas = [(nim, ordem) for nim, ordem in entradas if nim in nims_validos]
+        return cls(entradas, ultima_nomeacao_dict)
+
+    def __len__(self):
+        return len(self._heap)
+
+    def selecionar(self, dia: date, quantidade: int, disponivel: Callable[[str], bool]) -> List[str]:
+        """
+        Retira da fila os primeiros `quantidade` militares disponíveis em `dia`.
+
+        Os escolhidos voltam à fila com a última nomeação igual a `dia`; os que
+        foram saltados por indisponibilidade voltam com a chave que tinham.
+        """
+        escolhidos = []
+        saltados = []
+        while self._heap and len(escolhidos) < quantidade:
+            entrada = heapq.heappop(self._heap)
+            if disponivel(entrada[3]):
+                escolhidos.append(entrada)
+            else:
+                saltados.append(entrada)
+
+        for entrada in saltados:
+            heapq.heappush(self._heap, entrada)
+        for _, ordem, posicao, nim in escolhidos:
+            self.ultima_nomeacao_dict[nim] = dia
+            heapq.heappush(self._heap, (dia, ordem, posicao, nim))
+
+        return [entrada[3] for entrada in escolhidos]
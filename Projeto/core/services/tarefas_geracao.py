@@ -0,0 +1,127 @@
+import logging
+from datetime import date
+from typing import Dict, Optional
+
+from django.conf import settings
+from django.utils import timezone
+
+from ..models import Servico, TarefaGeracao
+from .escala_service import EscalaService, MAXIMO_DIAS_PERIODO
+
+logger = logging.getLogger(__name__)
+
+
+def enfileirar_geracao(data_inicio: date, data_fim: date, servico: Servico = None,
+                       utilizador=None) -> TarefaGeracao:
+    """
+    Cria uma tarefa de geração pendente para um serviço (ou, sem serviço, para toda a unidade).
+    A geração é feita fora do pedido HTTP pelo comando `processar_tarefas_geracao`.
+    Lança ValueError se o período não for válido.
+    """
+    if data_inicio <= timezone.now().date():
+        raise ValueError("Só é possível gerar previsões para datas futuras.")
+    valido, mensagem = EscalaService.verificar_periodo(
+        data_inicio, data_fim, getattr(settings, 'GERACAO_LONGO_PRAZO_MAXIMO_DIAS', 731))
+    if not valido:
+        raise ValueError(mensagem)
+
+    return TarefaGeracao.objects.create(
+        servico=servico,
+        data_inicio=data_inicio,
+        data_fim=data_fim,
+        total_dias=(data_fim - data_inicio).days + 1,
+        criada_por=utilizador if utilizador is not None and utilizador.is_authenticated else None,
+    )
+
+
+def reservar_proxima_tarefa() -> Optional[TarefaGeracao]:
+    """
+    Marca como em curso a tarefa pendente mais antiga e devolve-a (None se não houver).
+    A reserva é feita com um UPDATE condicional ao estado, pelo que dois processos de trabalho
+    nunca executam a mesma tarefa, sem precisar de bloqueios nem de um broker externo.
+    """
+    pendentes = (
+        TarefaGeracao.objects
+        .filter(estado=TarefaGeracao.PENDENTE)
+        .order_by('criada_em', 'pk')
+        .values_list('pk', flat=True)
+    )
+    for tarefa_id in pendentes[:10]:
+        reservada = TarefaGeracao.objects.filter(pk=tarefa_id, estado=TarefaGeracao.PENDENTE).update(
+            estado=TarefaGeracao.EM_CURSO, iniciada_em=timezone.now())
+        if reservada:
+            return TarefaGeracao.objects.select_related('servico').get(pk=tarefa_id)
+    return None
+
+
+def executar_tarefa(tarefa: TarefaGeracao) -> bool:
+    """
+    Executa uma tarefa já reservada e grava o resultado.
+    Períodos longos são gerados por blocos e o progresso é gravado depois de cada bloco. Nos períodos
+    curtos, o progresso é gravado antes de cada passo do planeamento (serviço e escala) e da gravação,
+    convertido na fração equivalente dos dias, com a descrição do passo em `fase`.
+    Se a geração falhar, a mensagem do erro fica no resultado da tarefa.
+    """
+    def progresso(dias_concluidos, total_dias):
+        TarefaGeracao.objects.filter(pk=tarefa.pk).update(
+            dias_concluidos=dias_concluidos, total_dias=total_dias)
+
+    def progresso_passos(passos_concluidos, total_passos, fase):
+        TarefaGeracao.objects.filter(pk=tarefa.pk).update(
+            dias_concluidos=tarefa.total_dias * passos_concluidos // total_passos, fase=fase)
+
+    try:
+        if (tarefa.data_fim - tarefa.data_inicio).days > MAXIMO_DIAS_PERIODO:
+            servicos = [tarefa.servico] if tarefa.servico_id else None
+            ok = EscalaService.gerar_escalas_longo_prazo(
+                servicos, tarefa.data_inicio, tarefa.data_fim, progresso=progresso, lancar_erros=True)
+        elif tarefa.servico_id:
+            ok = EscalaService.gerar_escalas_automaticamente(
+                tarefa.servico, tarefa.data_inicio, tarefa.data_fim,
+                progresso_passos=progresso_passos, lancar_erros=True)
+        else:
+            ok = EscalaService.gerar_escalas_unidade(
+                tarefa.data_inicio, tarefa.data_fim, progresso_passos=progresso_passos, lancar_erros=True)
+        mensagem = "Previsões geradas com sucesso." if ok else "Ocorreu um erro ao gerar as previsões."
+    except Exception as e:
+        logger.exception(f"Erro na tarefa de geração {tarefa.pk}")
+        ok = False
+        mensagem = f"Erro: {e}"
+
+    tarefa.refresh_from_db(fields=['dias_concluidos', 'total_dias'])
+    tarefa.estado = TarefaGeracao.CONCLUIDA if ok else TarefaGeracao.FALHADA
+    if ok:
+        tarefa.dias_concluidos = tarefa.total_dias
+    tarefa.mensagem = mensagem
+    tarefa.terminada_em = timezone.now()
+    tarefa.save(update_fields=['estado', 'dias_concluidos', 'mensagem', 'terminada_em'])
+    return ok
+
+
+def estado_tarefa(tarefa: TarefaGeracao) -> Dict:
+    """
+    Resumo da tarefa para o pedido de estado (JSON): progresso, passo em curso, tempo restante estimado e resultado.
+    O tempo restante é estimado pelo ritmo do progresso já feito; é None enquanto não houver progresso.
+    """
+    percentagem = round(100 * tarefa.dias_concluidos / tarefa.total_dias) if tarefa.total_dias else 0
+    segundos_restantes = None
+    if tarefa.estado == TarefaGeracao.EM_CURSO and tarefa.dias_concluidos and tarefa.iniciada_em:
+        decorrido = (timezone.now() - tarefa.iniciada_em).total_seconds()
+        por_fazer = tarefa.total_dias - tarefa.dias_concluidos
+        segundos_restantes = round(decorrido / tarefa.dias_concluidos * por_fazer)
+
+    return {
+        'id': tarefa.pk,
+        'servico': tarefa.servico.nome if tarefa.servico_id else None,
+        'data_inicio': tarefa.data_inicio,
+        'data_fim': tarefa.data_fim,
+        'estado': tarefa.estado,
+        'estado_display': tarefa.get_estado_display(),
+        'dias_concluidos': tarefa.dias_concluidos,
+        'total_dias': tarefa.total_dias,
+        'percentagem': percentagem,
+        'fase': tarefa.fase,
+        'segundos_restantes': segundos_restantes,
+        'terminada': tarefa.estado in (TarefaGeracao.CONCLUIDA, TarefaGeracao.FALHADA),
+        'mensagem': tarefa.mensagem,
+    }
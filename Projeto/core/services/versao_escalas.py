@@ -0,0 +1,79 @@
+import hashlib
+from datetime import date, datetime
+from functools import wraps
+from typing import Callable, Iterable, Optional
+
+from django.db.models import F
+from django.utils import timezone
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.views.decorators.http import condition
+
+from ..models import Servico
+
+
+def atualizar_versao_escalas(servico_ids: Optional[Iterable[int]] = None, servicos=None) -> None:
+    """
+    Incrementa a versão das escalas dos serviços indicados (de todos, se omitido) com um único UPDATE.
+    Chamada dentro da transação que altera as nomeações, a nova versão fica visível a todos os processos
+    (servidores web e processador de tarefas) exatamente quando as alterações ficam.
+    `servicos` pode ser um queryset de serviços já filtrado (por exemplo, os de um militar).
+    """
+    if servicos is None:
+        servicos = Servico.objects.all()
+        if servico_ids is not None:
+            servicos = servicos.filter(pk__in=list(servico_ids))
+    servicos.update(versao_escalas=F('versao_escalas') + 1, escalas_alteradas_em=timezone.now())
+
+
+def versao_escalas(servico_ids: Optional[Iterable[int]] = None) -> tuple:
+    """
+    Versão das escalas dos serviços indicados (todos, se omitido), lida numa consulta à tabela dos serviços:
+    ((id, versão), ...) e o instante da última alteração.
+    """
+    servicos = Servico.objects.order_by('pk')
+    if servico_ids is not None:
+        servicos = servicos.filter(pk__in=list(servico_ids))
+    linhas = list(servicos.values_list('pk', 'versao_escalas', 'escalas_alteradas_em'))
+    ultima = max((alterada_em for _, _, alterada_em in linhas), default=None)
+    return tuple((pk, versao) for pk, versao, _ in linhas), ultima
+
+
+def condicional_escalas(servicos_do_pedido: Callable) -> Callable:
+    """
+    Decorador de vistas com GET condicional (ETag e Last-Modified) a partir da versão das escalas.
+
+    `servicos_do_pedido(request, *args, **kwargs)` indica os serviços mostrados pela vista (None para todos).
+    Se nada mudou desde o pedido anterior do cliente, a resposta é um 304 sem executar a vista nem
+    consultar as nomeações. O ETag inclui o dia e a sessão (não apenas o utilizador): depois de um novo
+    login, a página em cache no navegador tinha um token CSRF que já não é válido, por exemplo no
+    formulário de logout. As respostas levam `Cache-Control: private, no-cache` e `Vary: Cookie`, para
+    serem sempre revalidadas e nunca partilhadas entre sessões.
+    """
+    def versao(request, *args, **kwargs):
+        if not hasattr(request, '_versao_escalas'):
+            request._versao_escalas = versao_escalas(servicos_do_pedido(request, *args, **kwargs))
+        return request._versao_escalas
+
+    def etag(request, *args, **kwargs):
+        versoes, ultima = versao(request, *args, **kwargs)
+        alterada_em = ultima.timestamp() if ultima else 0
+        partes = f'{versoes}-{alterada_em:.6f}-{date.today().isoformat()}-{request.user.pk}-{request.session.session_key}'
+        return hashlib.sha1(partes.encode('utf-8')).hexdigest()
+
+    def ultima_alteracao(request, *args, **kwargs):
+        _, ultima = versao(request, *args, **kwargs)
+        inicio_do_dia = timezone.make_aware(datetime.combine(date.today(), datetime.min.time()))
+        return max(ultima, inicio_do_dia) if ultima else inicio_do_dia
+
+    def decorador(vista):
+        vista_condicional = condition(etag_func=etag, last_modified_func=ultima_alteracao)(vista)
+
+        @wraps(vista)
+        def vista_com_cabecalhos(request, *args, **kwargs):
+            resposta = vista_condicional(request, *args, **kwargs)
+            patch_cache_control(resposta, private=True, no_cache=True)
+            patch_vary_headers(resposta, ['Cookie'])
+            return resposta
+        return vista_com_cabecalhos
+
+    return decorador
@@ -3,7 +3,10 @@ from django.contrib.auth.models import User
 from django.db.models.signals import post_save, post_delete, m2m_changed
 from django.contrib.auth.signals import user_logged_in, user_logged_out
 from django.dispatch import receiver
-from .models import Militar, Servico, Dispensa, Escala, Log, Role, EscalaMilitar, Nomeacao
+from .models import Militar, Servico, Dispensa, Escala, Log, Role, EscalaMilitar, Nomeacao, Feriado
+from .services.versao_escalas import atualizar_versao_escalas
+from .utils import limpar_cache_feriados
+from django.db import transaction
 from decouple import config
 from django.db.models import Max
 from django.contrib.auth.models import Permission
@@ -69,6 +72,64 @@ def log_alteracoes_dispensa(sender, instance, **kwargs):
     
     criar_log(12345678, acao, 'Dispensa', tipo_acao)
 
+@receiver([post_save, post_delete], sender=Nomeacao)
+def versao_escalas_nomeacao(sender, instance, origin=None, **kwargs):
+    """
+    Nova versão das escalas do serviço da nomeação criada, alterada ou removida.
+    Numa remoção em massa ou em cascata (`origin` é o queryset ou o objeto removido), o serviço de
+    cada EscalaMilitar só é atualizado uma vez
+    """
+    if origin is not None:
+        vistos = origin.__dict__.setdefault('_versao_escalas_vistos', set())
+        if instance.escala_militar_id in vistos:
+            return
+        vistos.add(instance.escala_militar_id)
+    atualizar_versao_escalas(servicos=Servico.objects.filter(escalas__roster=instance.escala_militar_id))
+
+@receiver([post_save, post_delete], sender=Dispensa)
+def versao_escalas_dispensa(sender, instance, **kwargs):
+    """
+    Nova versão das escalas dos serviços do militar dispensado. Um militar sem serviços só aparece no total
+    de dispensados da página inicial, cuja cache depende da versão de todos os serviços
+    """
+    servicos = Servico.objects.filter(militares=instance.militar_id)
+    atualizar_versao_escalas(servicos=servicos if servicos.exists() else None)
+
+@receiver(post_save, sender=Servico)
+def versao_escalas_servico(sender, instance, **kwargs):
+    atualizar_versao_escalas([instance.pk])
+
+@receiver(post_save, sender=EscalaMilitar)
+def versao_escalas_escala_militar(sender, instance, **kwargs):
+    """Militar acrescentado a uma escala, ativado, desativado ou com outra ordem"""
+    atualizar_versao_escalas(servicos=Servico.objects.filter(escalas=instance.escala_id))
+
+@receiver(m2m_changed, sender=Servico.militares.through)
+def versao_escalas_militares_servico(sender, instance, action, reverse, pk_set, **kwargs):
+    """Militares acrescentados ou retirados de um serviço (ou serviços de um militar, do lado inverso)"""
+    if action not in ['post_add', 'post_remove', 'post_clear']:
+        return
+    if not reverse:
+        atualizar_versao_escalas([instance.pk])
+    else:
+        # Num `clear` do lado do militar, `pk_set` é None: não se sabe que serviços tinha
+        atualizar_versao_escalas(pk_set)
+
+@receiver([post_save, post_delete], sender=Feriado)
+@receiver([post_save, post_delete], sender=Militar)
+@receiver(post_delete, sender=EscalaMilitar)
+def versao_escalas_todas(sender, instance, **kwargs):
+    """Feriados e dados dos militares aparecem em todas as escalas; remover um EscalaMilitar apaga as suas nomeações"""
+    atualizar_versao_escalas()
+
+@receiver([post_save, post_delete], sender=Feriado)
+def invalidar_cache_feriados(sender, instance, **kwargs):
+    """
+    Esquece os feriados em cache só depois do commit: limpá-los já dentro da transação deixaria um
+    feriado de uma gravação revertida em cache, se fosse lido antes do rollback
+    """
+    transaction.on_commit(limpar_cache_feriados)
+
 @receiver([post_save, post_delete], sender=Escala)
 def log_alteracoes_escala(sender, instance, **kwargs):
     # ► extrair intervalo de datas ligado a esta Escala
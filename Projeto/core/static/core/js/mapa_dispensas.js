@@ -0,0 +1,187 @@
+/*
+ * Grelha do mapa de dispensas carregada mês a mês (vista pública e administração).
+ *
+ * O contentor indica a API (data-url), o período (data-inicio, data-fim) e, opcionalmente, o
+ * serviço filtrado (data-servico). O primeiro mês é pedido logo ao abrir a página; os seguintes
+ * são pedidos quando a grelha de um serviço é deslocada até perto da margem direita (ou enquanto
+ * não enche a largura disponível). Cada mês é um bloco próprio, acrescentado ao lado dos anteriores,
+ * e a coluna dos nomes fica fixa à esquerda.
+ */
+(function () {
+    const MARGEM_CARREGAMENTO = 300;  // píxeis até à margem direita a partir dos quais se pede o mês seguinte
+
+    function criar(tag, classes, texto) {
+        const elemento = document.createElement(tag);
+        if (classes) {
+            elemento.className = classes;
+        }
+        if (texto !== undefined) {
+            elemento.textContent = texto;
+        }
+        return elemento;
+    }
+
+    function diaSeguinte(iso) {
+        const dia = new Date(iso + 'T00:00:00Z');
+        dia.setUTCDate(dia.getUTCDate() + 1);
+        return dia.toISOString().slice(0, 10);
+    }
+
+    function classesDia(tipo) {
+        if (tipo === '2') {
+            return ' feriado';
+        }
+        return tipo === '1' ? ' fim-semana' : '';
+    }
+
+    function MapaDispensas(contentor) {
+        this.contentor = contentor;
+        this.url = contentor.dataset.url;
+        this.proximoInicio = contentor.dataset.inicio;
+        this.fim = contentor.dataset.fim;
+        this.servico = contentor.dataset.servico || '';
+        this.aCarregar = false;
+        this.seccoes = {};  // id do serviço -> {faixa, deslocamento, nims}
+    }
+
+    MapaDispensas.prototype.carregar = function () {
+        if (this.aCarregar || this.proximoInicio > this.fim) {
+            return;
+        }
+        this.aCarregar = true;
+        const parametros = new URLSearchParams({inicio: this.proximoInicio});
+        if (this.servico) {
+            parametros.set('servico', this.servico);
+        }
+        fetch(this.url + '?' + parametros.toString(), {headers: {'X-Requested-With': 'XMLHttpRequest'}})
+            .then(resposta => resposta.json())
+            .then(dados => {
+                this.aCarregar = false;
+                if (!dados.success) {
+                    console.error('Erro ao carregar o mapa de dispensas:', dados.message);
+                    return;
+                }
+                this.acrescentar(dados);
+                this.proximoInicio = diaSeguinte(dados.fim);
+                if (this.precisaDeMais()) {
+                    this.carregar();
+                }
+            })
+            .catch(erro => {
+                this.aCarregar = false;
+                console.error('Erro ao carregar o mapa de dispensas:', erro);
+            });
+    };
+
+    MapaDispensas.prototype.precisaDeMais = function () {
+        return Object.values(this.seccoes).some(seccao => {
+            const elemento = seccao.deslocamento;
+            return elemento.scrollWidth - elemento.scrollLeft - elemento.clientWidth < MARGEM_CARREGAMENTO;
+        });
+    };
+
+    MapaDispensas.prototype.acrescentar = function (dados) {
+        if (!dados.servicos.length && !Object.keys(this.seccoes).length) {
+            this.contentor.appendChild(criar('div', 'alert alert-info', 'Não existem dispensas para exibir.'));
+            this.proximoInicio = diaSeguinte(this.fim);
+            return;
+        }
+        dados.servicos.forEach(servico => {
+            const seccao = this.seccoes[servico.id] || this.criarSeccao(servico, dados);
+            seccao.faixa.appendChild(this.blocoMes(servico, dados));
+        });
+    };
+
+    MapaDispensas.prototype.criarSeccao = function (servico, dados) {
+        const grelha = criar('div', 'dispensa-grid');
+        grelha.dataset.servico = servico.id;
+        grelha.appendChild(criar('h3', '', servico.nome));
+
+        const deslocamento = criar('div', 'mapa-deslocamento');
+        const faixa = criar('div', 'mapa-faixa');
+        const nomes = criar('div', 'mapa-bloco-nomes');
+        nomes.appendChild(criar('div', 'grid-header', 'Nome'));
+        nomes.appendChild(criar('div', 'grid-header'));
+        servico.militares.forEach(nim => {
+            nomes.appendChild(criar('div', 'militar-cell', dados.militares[nim].descricao));
+        });
+        ['Total', 'Dispensados', 'Disponíveis'].forEach(rotulo => {
+            nomes.appendChild(criar('div', 'total-label', rotulo));
+        });
+        faixa.appendChild(nomes);
+        deslocamento.appendChild(faixa);
+        grelha.appendChild(deslocamento);
+        this.contentor.appendChild(grelha);
+
+        deslocamento.addEventListener('scroll', () => {
+            if (this.precisaDeMais()) {
+                this.carregar();
+            }
+        });
+        const seccao = {faixa: faixa, deslocamento: deslocamento};
+        this.seccoes[servico.id] = seccao;
+        return seccao;
+    };
+
+    MapaDispensas.prototype.blocoMes = function (servico, dados) {
+        const tipos = dados.tipos;
+        const numDias = tipos.length;
+        const bloco = criar('div', 'mapa-bloco-mes');
+        bloco.style.setProperty('--num-dias', numDias);
+
+        dados.meses.forEach(mes => {
+            const cabecalho = criar('div', 'month-header', mes.nome);
+            cabecalho.style.setProperty('--span-days', mes.dias);
+            bloco.appendChild(cabecalho);
+        });
+
+        const datas = [];
+        let data = dados.inicio;
+        for (let i = 0; i < numDias; i++) {
+            datas.push(data);
+            bloco.appendChild(criar('div', 'grid-day-header' + classesDia(tipos[i]), data.slice(8, 10)));
+            data = diaSeguinte(data);
+        }
+
+        const fragmento = document.createDocumentFragment();
+        servico.militares.forEach(nim => {
+            // Motivo de cada dia da janela, a partir das sequências [dia inicial, número de dias, motivo]
+            const motivos = new Array(numDias);
+            dados.militares[nim].dispensas.forEach(([inicio, dias, motivo]) => {
+                for (let i = inicio; i < inicio + dias; i++) {
+                    motivos[i] = dados.motivos[motivo];
+                }
+            });
+            for (let i = 0; i < numDias; i++) {
+                const celula = criar('div', 'grid-cell' + classesDia(tipos[i]) + (motivos[i] !== undefined ? ' dispensado' : ''));
+                celula.dataset.data = datas[i];
+                celula.dataset.militar = nim;
+                if (motivos[i] !== undefined) {
+                    const marca = criar('span', '', motivos[i].charAt(0).toUpperCase());
+                    marca.title = motivos[i];
+                    celula.appendChild(marca);
+                }
+                fragmento.appendChild(celula);
+            }
+        });
+        bloco.appendChild(fragmento);
+
+        const total = servico.militares.length;
+        [
+            ['total', () => total],
+            ['dispensados', i => servico.dispensados[i]],
+            ['disponiveis', i => total - servico.dispensados[i]],
+        ].forEach(([classe, valor]) => {
+            for (let i = 0; i < numDias; i++) {
+                bloco.appendChild(criar('div', 'total-cell ' + classe + classesDia(tipos[i]), valor(i)));
+            }
+        });
+        return bloco;
+    };
+
+    document.addEventListener('DOMContentLoaded', () => {
+        document.querySelectorAll('.mapa-dispensas[data-url]').forEach(contentor => {
+            new MapaDispensas(contentor).carregar();
+        });
+    });
+})();
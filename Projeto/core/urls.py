@@ -3,12 +3,12 @@ from django.views.generic import RedirectView, TemplateView
 from django.contrib.auth.views import LogoutView, PasswordChangeView, PasswordChangeDoneView
 from django.contrib import messages
 from .views import (
-    login_view, home_view, mapa_dispensas_view, escala_servico_view, 
+    login_view, home_view, mapa_dispensas_view, mapa_dispensas_dados, escala_servico_view, 
     gerar_escalas_view, lista_servicos_view,
     previsoes_por_servico_view, previsoes_servico_view, exportar_previsoes_pdf, 
     exportar_escalas_pdf, obter_militar,
     obter_militares_disponiveis, substituir_militar, obter_nomeacao_atual,
-    editar_observacao_nomeacao, previsualizar_previsoes_pdf,
+    editar_observacao_nomeacao, previsualizar_previsoes_pdf, exportar_previsoes_lote_view,
     atualizar_ordem_militares
 )
 
@@ -31,6 +31,7 @@ urlpatterns = [
     path('servicos/', lista_servicos_view, name='lista_servicos'),
     path('previsoes-por-servico/', previsoes_por_servico_view, name='previsoes_por_servico'),
     path('previsoes-servico/<int:servico_id>/', previsoes_servico_view, name='previsoes_servico'),
+    path('previsoes-servico/exportar-todos/', exportar_previsoes_lote_view, name='exportar_previsoes_lote'),
     path('previsoes-servico/<int:servico_id>/previsualizar/', previsualizar_previsoes_pdf, name='previsualizar_previsoes_pdf'),
     path('previsoes-servico/<int:servico_id>/exportar/', exportar_previsoes_pdf, name='exportar_previsoes_pdf'),
     path('previsoes-servico/<int:servico_id>/exportar_pdf/', RedirectView.as_view(url='/previsoes-servico/%(servico_id)s/exportar/'), name='exportar_previsoes_pdf_old'),
@@ -38,6 +39,7 @@ urlpatterns = [
     path('alterar-senha/', PasswordChangeView.as_view(template_name='core/alterar_senha.html'), name='alterar_senha'),
     path('senha-alterada/', PasswordChangeDoneView.as_view(template_name='core/senha_alterada.html'), name='senha_alterada'),
     path('senha-alterada/', PasswordChangeDoneView.as_view(template_name='core/senha_alterada.html'), name='password_change_done'),
+    path('api/mapa-dispensas/', mapa_dispensas_dados, name='mapa_dispensas_dados'),
     path('api/militar/<str:militar_nim>/', obter_militar, name='obter_militar'),
     path('api/militares/disponiveis/<int:servico_id>/<str:data>/', obter_militares_disponiveis, name='obter_militares_disponiveis'),
     path('api/nomeacao/substituir/', substituir_militar, name='substituir_militar'),
@@ -1,7 +1,21 @@
+import time
 from datetime import date, timedelta
+from functools import lru_cache
+from django.conf import settings
 from .models import Feriado
-from typing import List
+from typing import Dict, FrozenSet, Iterable, List, Tuple
 
+# Cache dos feriados por ano (fixos, móveis e da base de dados), própria de cada processo.
+# Neste processo é limpa após o commit de qualquer alteração a um Feriado (ver core/signals.py);
+# nos restantes expira ao fim de FERIADOS_CACHE_SEGUNDOS.
+_feriados_por_ano: Dict[int, FrozenSet[date]] = {}
+# Calendários já construídos, por período; limpos e expirados juntamente com os feriados
+_calendarios: Dict[Tuple[date, date], 'CalendarioDias'] = {}
+MAXIMO_CALENDARIOS_CACHE = 64
+# Instante (time.monotonic) em que a cache foi limpa pela última vez
+_cache_limpa_em = 0.0
+
+@lru_cache(maxsize=None)
 def calcular_pascoa(ano: int) -> date:
     """
     Calcula a data da Páscoa para um determinado ano usando o algoritmo de Meeus/Jones/Butcher.
@@ -52,21 +66,16 @@ def calcular_feriados_moveis(ano: int) -> List[date]:
         corpo_deus     # Corpo de Deus
     ]
 
-def obter_feriados(data_inicio: date = None, data_fim: date = None) -> List[date]:
+def feriados_do_ano(ano: int) -> FrozenSet[date]:
     """
-    Obtém todos os feriados no período especificado.
-    Se não forem fornecidas datas, usa o ano atual.
+    Devolve o conjunto dos feriados de um ano: fixos, móveis e os registados na base de dados.
+    O resultado fica em cache, pelo que só a primeira chamada de cada ano (em cada FERIADOS_CACHE_SEGUNDOS)
+    consulta a base de dados.
     """
-    if data_inicio is None:
-        data_inicio = date.today()
-    if data_fim is None:
-        data_fim = date(data_inicio.year, 12, 31)
-    
-    feriados = []
-    
-    # Adiciona feriados fixos
-    for ano in range(data_inicio.year, data_fim.year + 1):
-        feriados.extend([
+    _expirar_cache_feriados()
+    feriados = _feriados_por_ano.get(ano)
+    if feriados is None:
+        feriados = frozenset([
             date(ano, 1, 1),    # Ano Novo
             date(ano, 4, 25),   # Dia da Liberdade
             date(ano, 5, 1),    # Dia do Trabalhador
@@ -77,16 +86,133 @@ def obter_feriados(data_inicio: date = None, data_fim: date = None) -> List[date
             date(ano, 12, 1),   # Restauração da Independência
             date(ano, 12, 8),   # Imaculada Conceição
             date(ano, 12, 25),  # Natal
+            # Feriados móveis
+            *calcular_feriados_moveis(ano),
+            # Feriados personalizados da base de dados
+            *Feriado.objects.filter(data__year=ano).values_list('data', flat=True),
         ])
-        
-        # Adiciona feriados móveis
-        feriados.extend(calcular_feriados_moveis(ano))
-    
-    # Adiciona feriados personalizados do banco de dados
-    feriados.extend(
-        list(Feriado.objects.filter(data__gte=data_inicio, data__lte=data_fim).values_list('data', flat=True))
-    )
-    
-    # Filtra apenas os feriados dentro do período e remove duplicatas
-    feriados = [f for f in feriados if data_inicio <= f <= data_fim]
-    return sorted(list(set(feriados))) 
\ No newline at end of file
+        _feriados_por_ano[ano] = feriados
+    return feriados
+
+def limpar_cache_feriados() -> None:
+    """Esquece os feriados em cache; chamado após o commit sempre que um Feriado é criado, alterado ou removido."""
+    global _cache_limpa_em
+    _feriados_por_ano.clear()
+    _calendarios.clear()
+    _cache_limpa_em = time.monotonic()
+
+def _expirar_cache_feriados() -> None:
+    """
+    Limpa a cache se tiver mais de FERIADOS_CACHE_SEGUNDOS: as alterações feitas noutros processos
+    (outro servidor web, o processador de tarefas) não chegam aos sinais deste.
+    """
+    if time.monotonic() - _cache_limpa_em >= settings.FERIADOS_CACHE_SEGUNDOS:
+        limpar_cache_feriados()
+
+def conjunto_feriados(data_inicio: date = None, data_fim: date = None) -> FrozenSet[date]:
+    """
+    Feriados do período como `frozenset`, para verificações de pertença em O(1).
+    Se não forem fornecidas datas, usa o ano atual.
+    """
+    if data_inicio is None:
+        data_inicio = date.today()
+    if data_fim is None:
+        data_fim = date(data_inicio.year, 12, 31)
+    if data_inicio.year == data_fim.year:
+        feriados = feriados_do_ano(data_inicio.year)
+        if data_inicio == date(data_inicio.year, 1, 1) and data_fim == date(data_fim.year, 12, 31):
+            return feriados
+    else:
+        feriados = frozenset().union(*(feriados_do_ano(ano) for ano in range(data_inicio.year, data_fim.year + 1)))
+    return frozenset(f for f in feriados if data_inicio <= f <= data_fim)
+
+def obter_feriados(data_inicio: date = None, data_fim: date = None) -> List[date]:
+    """
+    Obtém todos os feriados no período especificado, por ordem cronológica.
+    Se não forem fornecidas datas, usa o ano atual.
+    """
+    return sorted(conjunto_feriados(data_inicio, data_fim))
+
+
+class CalendarioDias:
+    """
+    Calendário compacto de um período: o tipo de cada dia (útil, fim de semana ou feriado) guardado
+    num array indexado pelo ordinal da data, os limites dos meses e as listas de dias das Escalas A e B.
+
+    É construído uma vez por período (ver `calendario_dias`) e partilhado pelos serviços, pelas vistas
+    e pelos PDFs, que deixam de repetir o ciclo de classificação dos dias.
+    """
+
+    UTIL, FIM_SEMANA, FERIADO = 0, 1, 2
+    TIPOS_DIA = ('util', 'fim_semana', 'feriado')
+
+    def __init__(self, data_inicio: date, data_fim: date, feriados: Iterable[date]):
+        self.data_inicio = data_inicio
+        self.data_fim = data_fim
+        self._origem = data_inicio.toordinal()
+        n_dias = max(0, (data_fim - data_inicio).days + 1)
+
+        semana = data_inicio.weekday()
+        tipos = bytearray(n_dias)
+        for i in range(n_dias):
+            if (semana + i) % 7 >= 5:
+                tipos[i] = self.FIM_SEMANA
+        for feriado in feriados:
+            if data_inicio <= feriado <= data_fim:
+                tipos[feriado.toordinal() - self._origem] = self.FERIADO
+        self._tipos = bytes(tipos)
+
+        # Índice do primeiro dia de cada mês do período (o primeiro dia do período abre sempre um mês)
+        self._inicios_mes = [
+            i for i in range(n_dias)
+            if i == 0 or date.fromordinal(self._origem + i).day == 1
+        ]
+        self._escala_a = tuple(self.data(i) for i in range(n_dias) if tipos[i] == self.UTIL)
+        self._escala_b = tuple(self.data(i) for i in range(n_dias) if tipos[i] != self.UTIL)
+
+    def __len__(self) -> int:
+        return len(self._tipos)
+
+    def indice(self, dia: date) -> int:
+        return dia.toordinal() - self._origem
+
+    def data(self, indice: int) -> date:
+        return date.fromordinal(self._origem + indice)
+
+    def tipo_dia(self, dia: date) -> str:
+        """'feriado', 'fim_semana' ou 'util' (um feriado ao fim de semana conta como feriado)."""
+        return self.TIPOS_DIA[self._tipos[dia.toordinal() - self._origem]]
+
+    def codigos(self) -> str:
+        """Tipo de cada dia do período num carácter: '0' útil, '1' fim de semana, '2' feriado."""
+        return ''.join(str(tipo) for tipo in self._tipos)
+
+    def dias_escala(self) -> Dict[str, List[date]]:
+        return {'escala_a': list(self._escala_a), 'escala_b': list(self._escala_b)}
+
+    def meses(self) -> List[Tuple[date, int, int]]:
+        """Limites dos meses do período: (primeiro dia do mês, índice inicial, índice final exclusivo)."""
+        fins = self._inicios_mes[1:] + [len(self._tipos)]
+        return [
+            (self.data(inicio).replace(day=1), inicio, fim)
+            for inicio, fim in zip(self._inicios_mes, fins)
+        ]
+
+    def classificar(self, datas: Iterable[date]) -> List[Dict]:
+        """Lista [{'data', 'tipo_dia'}] das datas indicadas (todas dentro do período), pela ordem dada."""
+        tipos = self._tipos
+        origem = self._origem
+        nomes = self.TIPOS_DIA
+        return [{'data': d, 'tipo_dia': nomes[tipos[d.toordinal() - origem]]} for d in datas]
+
+def calendario_dias(data_inicio: date, data_fim: date) -> CalendarioDias:
+    """Calendário do período, construído uma vez e reutilizado até os feriados mudarem (ou a cache expirar)."""
+    _expirar_cache_feriados()
+    chave = (data_inicio, data_fim)
+    calendario = _calendarios.get(chave)
+    if calendario is None:
+        calendario = CalendarioDias(data_inicio, data_fim, conjunto_feriados(data_inicio, data_fim))
+        if len(_calendarios) >= MAXIMO_CALENDARIOS_CACHE:
+            _calendarios.pop(next(iter(_calendarios)), None)
+        _calendarios[chave] = calendario
+    return calendario
@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import authenticate, login
 from django.contrib import messages
@@ -8,13 +9,21 @@ from datetime import datetime, timedelta, date
 from .models import Servico, Dispensa, Nomeacao, ConfiguracaoUnidade
 from .forms import *
 from .services.escala_service import EscalaService
-from .utils import obter_feriados
-from django.db.models import Count
+from .services.mapa_dispensas import MAXIMO_DIAS_JANELA, janela_mapa_dispensas
+from .services.painel_inicial import obter_painel
+from .services.cache_pdf import resposta_pdf, resposta_pdf_em_cache
+from .services.pdf_previsoes import (
+    chave_previsoes_pdf, dados_previsoes, desenhar_previsoes_pdf, exportar_previsoes_lote, nome_cabecalho_unidade
+)
+from .services.versao_escalas import atualizar_versao_escalas, condicional_escalas
+from .utils import calendario_dias, obter_feriados
 from reportlab.lib.pagesizes import A4
 from reportlab.pdfgen import canvas
 from reportlab.lib import colors
 from reportlab.lib.units import cm
+import io
 import json
+import zipfile
 from django.views.generic import TemplateView
 from django.views.decorators.http import require_POST
 from django.views.decorators.csrf import csrf_exempt
@@ -23,6 +32,19 @@ from django.views.decorators.csrf import csrf_exempt
 # Mensagens de erro constantes
 ERRO_PREVISAO_DIA_ATUAL = "Não é permitido gerar previsões para o dia de hoje. Por favor, escolha uma data futura."
 
+# Lista de serviços: serviços por página, semanas mostradas de início e semanas acrescentadas por "Mostrar mais"
+SERVICOS_POR_PAGINA = 2
+SEMANAS_LISTA_SERVICOS = 4
+MAXIMO_SEMANAS_LISTA_SERVICOS = 104
+
+
+def _servico_do_url(request, servico_id, *args, **kwargs):
+    return [servico_id]
+
+
+def _todos_os_servicos(request, *args, **kwargs):
+    return None
+
 # view de log in
 def login_view(request):
     if request.method == 'POST':
@@ -48,79 +70,9 @@ def login_view(request):
 ## Testar se log in foi executado
 @login_required
 def home_view(request):
-    # Serviços
-    servicos = Servico.objects.all()
-    militares_por_servico = {s.nome: s.militares.count() for s in servicos}
-    total_militares = sum(militares_por_servico.values())
-
+    # Dados agregados do painel, servidos da cache de curta duração (ver services/painel_inicial.py)
     hoje = date.today()
-    amanha = hoje + timedelta(days=1)
-    dispensas_ativas = Dispensa.objects.filter(data_inicio__lte=hoje, data_fim__gte=hoje)
-    total_dispensados = dispensas_ativas.values('militar').distinct().count()
-
-    # Top 5 militares com mais serviços realizados
-    top_militares_qs = (
-        Nomeacao.objects
-        .values('escala_militar__militar__nome', 'escala_militar__militar__posto')
-        .annotate(total=Count('id'))
-        .order_by('-total')[:5]
-    )
-    top_militares = [
-        (f"{item['escala_militar__militar__posto']} {item['escala_militar__militar__nome']}", item['total'])
-        for item in top_militares_qs
-    ]
-
-    # Calcular dispensados hoje e nomeados para hoje/amanhã por serviço
-    servicos_info = []
-    for servico in servicos:
-        # Dispensados hoje neste serviço
-        dispensados_hoje = Dispensa.objects.filter(
-            militar__servicos=servico,
-            data_inicio__lte=hoje,
-            data_fim__gte=hoje
-        ).values('militar').distinct().count()
-        # Nomeado para hoje
-        nomeacao_hoje = Nomeacao.objects.filter(
-            escala_militar__escala__servico=servico,
-            data=hoje,
-            e_reserva=False
-        ).select_related('escala_militar__militar').first()
-        militar_hoje = nomeacao_hoje.escala_militar.militar if nomeacao_hoje else None
-        # Nomeado para amanhã
-        nomeacao_amanha = Nomeacao.objects.filter(
-            escala_militar__escala__servico=servico,
-            data=amanha,
-            e_reserva=False
-        ).select_related('escala_militar__militar').first()
-        militar_amanha = nomeacao_amanha.escala_militar.militar if nomeacao_amanha else None
-        # Cor do banner conforme regras fornecidas
-        nome_lower = servico.nome.lower()
-        if "oficial" in nome_lower:
-            cor_banner = "bg-danger text-white"  # vermelho
-        elif "sargento" in nome_lower or "comandante" in nome_lower:
-            cor_banner = "bg-success text-white"  # verde
-        elif "cabo" in nome_lower:
-            cor_banner = "bg-primary text-white"  # azul
-        elif "graduado" in nome_lower:
-            cor_banner = "bg-secondary text-white"  # roxo/cinzento
-        else:
-            cor_banner = "bg-warning text-dark"  # amarelo (praças)
-        servicos_info.append({
-            'obj': servico,
-            'total_militares': militares_por_servico.get(servico.nome, 0),
-            'dispensados_hoje': dispensados_hoje,
-            'militar_hoje': militar_hoje,
-            'militar_amanha': militar_amanha,
-            'cor_banner': cor_banner,
-        })
-
-    context = {
-        'servicos_info': servicos_info,
-        'total_militares': total_militares,
-        'total_dispensados': total_dispensados,
-        'top_militares': top_militares,
-        'hoje': hoje,
-    }
+    context = dict(obter_painel(hoje), hoje=hoje)
     return render(request, 'core/home.html', context)
 
 @login_required
@@ -128,101 +80,54 @@ def mapa_dispensas_view(request):
     # Obter o serviço selecionado do filtro
     servico_id = request.GET.get('servico')
     servico_selecionado = None
-    servicos = Servico.objects.all()
     
     if servico_id:
         servico_selecionado = get_object_or_404(Servico, id=servico_id)
-        servicos = [servico_selecionado]
     
     hoje = date.today()
     # Calcular dias até ao final do ano
     ultimo_dia_ano = date(hoje.year, 12, 31)
     dias_restantes = (ultimo_dia_ano - hoje).days
     
-    # Obter lista de feriados
-    feriados = obter_feriados(hoje, ultimo_dia_ano)
-    
-    # Agrupar dias por mês
-    dias_por_mes = {}
-    dias = []
-    data_atual = hoje
-    
-    while data_atual <= ultimo_dia_ano:
-        mes = data_atual.replace(day=1)
-        if mes not in dias_por_mes:
-            dias_por_mes[mes] = []
-        
-        e_fim_semana = data_atual.weekday() >= 5  # 5 = Sábado, 6 = Domingo
-        e_feriado = data_atual in feriados
-        
-        dia_info = {
-            'data': data_atual, 
-            'mes': mes,
-            'dia_semana': data_atual.strftime('%A'),
-            'e_fim_semana': e_fim_semana,
-            'e_feriado': e_feriado
-        }
-        
-        dias_por_mes[mes].append(dia_info)
-        dias.append(dia_info)
-        data_atual += timedelta(days=1)
-    
-    mapa_dispensas = {}
-    for servico in servicos:
-        militares = servico.militares.all().select_related('user').order_by('posto', 'nim')
-        dispensas_servico = {}
-        resumo = {
-            'dispensados': {},
-            'disponiveis': {},
-            'total': {}
-        }
-        for militar in militares:
-            dispensas = {}
-            dispensas_periodo = Dispensa.objects.filter(
-                militar=militar,
-                data_inicio__lte=ultimo_dia_ano,
-        data_fim__gte=hoje
-            )
-            for dia in dias:
-                dispensa = next(
-                    (d for d in dispensas_periodo if d.data_inicio <= dia['data'] <= d.data_fim),
-                    None
-                )
-                if dispensa:
-                    dispensas[dia['data']] = {
-                        'motivo': dispensa.motivo
-                    }
-                    if dia['data'] not in resumo['dispensados']:
-                        resumo['dispensados'][dia['data']] = 0
-                    resumo['dispensados'][dia['data']] += 1
-                if dia['data'] not in resumo['total']:
-                    resumo['total'][dia['data']] = 0
-                resumo['total'][dia['data']] += 1
-            dispensas_servico[militar] = dispensas
-        for dia in dias:
-            total = resumo['total'].get(dia['data'], 0)
-            dispensados = resumo['dispensados'].get(dia['data'], 0)
-            resumo['disponiveis'][dia['data']] = total - dispensados
-        mapa_dispensas[servico] = {
-            'militares': dispensas_servico,
-            'resumo': resumo
-        }
-    if dias:
-        feriados = obter_feriados(min(d['data'] for d in dias), max(d['data'] for d in dias))
-    else:
-        feriados = []
+    # A grelha é carregada mês a mês pela API `mapa_dispensas_dados`
     context = {
-        'mapa_dispensas': mapa_dispensas,
-        'dias': dias,
-        'dias_por_mes': dias_por_mes,
         'servicos': Servico.objects.all(),
         'servico_selecionado': servico_selecionado,
         'hoje': hoje,
+        'data_fim': ultimo_dia_ano,
         'dias_restantes': dias_restantes,
-        'feriados': feriados,
     }
     return render(request, 'core/mapa_dispensas_publica.html', context)
 
+@login_required
+def mapa_dispensas_dados(request):
+    """
+    Janela do mapa de dispensas em JSON compacto (ver `janela_mapa_dispensas`), pedida pelas grelhas
+    à medida que se avança nos meses. Parâmetros: `inicio`, `fim` (por omissão, o fim do mês de
+    `inicio`) e, opcionalmente, `servico`.
+    """
+    try:
+        inicio = date.fromisoformat(request.GET.get('inicio', ''))
+        if request.GET.get('fim'):
+            fim = date.fromisoformat(request.GET['fim'])
+        else:
+            fim = (inicio.replace(day=1) + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+    except ValueError:
+        return JsonResponse({'success': False, 'message': 'Datas inválidas'}, status=400)
+    if fim < inicio or (fim - inicio).days >= MAXIMO_DIAS_JANELA:
+        return JsonResponse({
+            'success': False,
+            'message': f'A janela deve ter entre 1 e {MAXIMO_DIAS_JANELA} dias'
+        }, status=400)
+
+    servicos = Servico.objects.all()
+    servico_id = request.GET.get('servico')
+    if servico_id:
+        servicos = servicos.filter(pk=servico_id) if servico_id.isdigit() else servicos.none()
+
+    dados = janela_mapa_dispensas(servicos, inicio, fim)
+    return JsonResponse(dict(dados, success=True))
+
 @login_required
 def escala_servico_view(request, servico_id):
     servico = get_object_or_404(Servico, id=servico_id)
@@ -294,55 +199,45 @@ guia_view = staff_member_required(
 )
 
 @login_required
+@condicional_escalas(_todos_os_servicos)
 def lista_servicos_view(request):
-    servicos = list(Servico.objects.all())
+    """
+    Nomeações dos serviços da página nas próximas semanas. A paginação dos serviços e a janela de
+    datas são feitas na base de dados e as nomeações lidas como tuplos, pelo que o custo depende só
+    do que é mostrado e não do tamanho de toda a previsão futura.
+    """
     hoje = date.today()
     
     # Obter o índice inicial dos serviços a mostrar
-    pagina = int(request.GET.get('pagina', 1))
-    servicos_por_pagina = 2
-    total_paginas = (len(servicos) + servicos_por_pagina - 1) // servicos_por_pagina
-    pagina = min(max(1, pagina), total_paginas)
-    inicio = (pagina - 1) * servicos_por_pagina
-    servicos_paginados = servicos[inicio:inicio + servicos_por_pagina]
-    
-    # Obter todas as nomeações a partir de hoje
-    nomeacoes = Nomeacao.objects.filter(data__gte=hoje).select_related('escala_militar__escala', 'escala_militar__militar')
-    datas_raw = sorted(set(n.data for n in nomeacoes))
-    
-    # Obter feriados para o intervalo das datas
-    if datas_raw:
-        feriados = obter_feriados(min(datas_raw), max(datas_raw))
-        feriados_set = set(feriados)
-    else:
-        feriados = []
-        feriados_set = set()
+    try:
+        pagina = int(request.GET.get('pagina', 1))
+        semanas = int(request.GET.get('semanas', SEMANAS_LISTA_SERVICOS))
+    except ValueError:
+        pagina, semanas = 1, SEMANAS_LISTA_SERVICOS
+    semanas = min(max(1, semanas), MAXIMO_SEMANAS_LISTA_SERVICOS)
+    total_paginas = (Servico.objects.count() + SERVICOS_POR_PAGINA - 1) // SERVICOS_POR_PAGINA
+    pagina = min(max(1, pagina), max(1, total_paginas))
+    inicio = (pagina - 1) * SERVICOS_POR_PAGINA
+    servicos_paginados = list(Servico.objects.order_by('pk')[inicio:inicio + SERVICOS_POR_PAGINA])
     
-    # Construir estrutura: lista de dicts com data e tipo_dia
-    datas = []
-    for d in datas_raw:
-        if d in feriados_set:
-            tipo_dia = 'feriado'
-        elif d.weekday() >= 5:
-            tipo_dia = 'fim_semana'
-        else:
-            tipo_dia = 'util'
-        datas.append({'data': d, 'tipo_dia': tipo_dia})
+    # Nomeações da janela de datas, só dos serviços da página
+    fim_janela = hoje + timedelta(weeks=semanas) - timedelta(days=1)
+    nomeacoes = Nomeacao.objects.filter(escala_militar__escala__servico__in=servicos_paginados)
+    linhas = nomeacoes.filter(data__gte=hoje, data__lte=fim_janela).order_by('data', 'pk').values_list(
+        'data', 'escala_militar__escala__servico_id', 'e_reserva',
+        'escala_militar__militar__posto', 'escala_militar__militar__nome'
+    )
     
     # Construir tabela: {data: {servico: {'efetivo': [], 'reserva': []}}}
     tabela = {}
-    for d in datas_raw:
-        tabela[d] = {}
-        for servico in servicos_paginados:
-            tabela[d][servico.id] = {'efetivo': [], 'reserva': []}
+    for data, servico_id, e_reserva, posto, nome in linhas:
+        if data not in tabela:
+            tabela[data] = {servico.id: {'efetivo': [], 'reserva': []} for servico in servicos_paginados}
+        tabela[data][servico_id]['reserva' if e_reserva else 'efetivo'].append({'posto': posto, 'nome': nome})
     
-    for n in nomeacoes:
-        servico_id = n.escala_militar.escala.servico_id
-        if servico_id in [s.id for s in servicos_paginados]:
-            if n.e_reserva:
-                tabela[n.data][servico_id]['reserva'].append(n.escala_militar.militar)
-            else:
-                tabela[n.data][servico_id]['efetivo'].append(n.escala_militar.militar)
+    # Construir estrutura: lista de dicts com data e tipo_dia
+    datas_raw = list(tabela)
+    datas = calendario_dias(hoje, fim_janela).classificar(datas_raw)
     
     return render(request, 'core/lista_servicos.html', {
         'servicos': servicos_paginados,
@@ -350,6 +245,10 @@ def lista_servicos_view(request):
         'tabela': tabela,
         'pagina_atual': pagina,
         'total_paginas': total_paginas,
+        'semanas': semanas,
+        'fim_janela': fim_janela,
+        'mais_semanas': min(semanas + SEMANAS_LISTA_SERVICOS, MAXIMO_SEMANAS_LISTA_SERVICOS),
+        'ha_mais': semanas < MAXIMO_SEMANAS_LISTA_SERVICOS and nomeacoes.filter(data__gt=fim_janela).exists(),
     })
 
 @login_required
@@ -362,6 +261,7 @@ def previsoes_por_servico_view(request):
     return render(request, 'core/previsoes_por_servico.html', {'servicos': servicos})
 
 @login_required
+@condicional_escalas(_servico_do_url)
 def previsoes_servico_view(request, servico_id):
     servico = get_object_or_404(Servico, id=servico_id)
     hoje = date.today()
@@ -394,19 +294,8 @@ def previsoes_servico_view(request, servico_id):
     observacoes_por_data = {k: ' | '.join(v) for k, v in observacoes_por_data.items()}
 
     # Identificar feriados e fins de semana
-    if datas_set:
-        feriados = set(obter_feriados(min(datas_set), max(datas_set)))
-    else:
-        feriados = set()
-    dias = []
-    for d in sorted(datas_set):
-        if d in feriados:
-            tipo_dia = 'feriado'
-        elif d.weekday() >= 5:
-            tipo_dia = 'fim_semana'
-        else:
-            tipo_dia = 'util'
-        dias.append({'data': d, 'tipo_dia': tipo_dia})
+    datas_ordenadas = sorted(datas_set)
+    dias = calendario_dias(datas_ordenadas[0], datas_ordenadas[-1]).classificar(datas_ordenadas) if datas_ordenadas else []
 
     return render(request, 'core/previsoes_servico.html', {
         'servico': servico,
@@ -425,140 +314,49 @@ def previsualizar_previsoes_pdf(request, servico_id):
 def exportar_previsoes_pdf(request, servico_id, download=True):
     servico = get_object_or_404(Servico, id=servico_id)
     hoje = date.today()
-    nomeacoes = Nomeacao.objects.filter(
-        escala_militar__escala__servico=servico,
-        data__gte=hoje
-    ).select_related('escala_militar__militar', 'escala_militar__escala').order_by('data')
+    config = ConfiguracaoUnidade.objects.first()
 
-    if not nomeacoes.exists():
+    dados = dados_previsoes([servico.pk], hoje)
+    if servico.pk not in dados:
         messages.error(request, "Não existem nomeações para exportar.")
         return redirect('previsoes_servico', servico_id=servico_id)
 
-    data_inicio = nomeacoes.first().data
-    data_fim = nomeacoes.last().data
-    feriados = obter_feriados(data_inicio, data_fim)
-    feriados_set = set(feriados)
-    # Gerar lista de dias exatamente como na grelha de previsões
-    datas_set = set(n.data for n in nomeacoes)
-    if datas_set:
-        feriados = set(obter_feriados(min(datas_set), max(datas_set)))
-    else:
-        feriados = set()
-    dias = []
-    for d in sorted(datas_set):
-        if d in feriados:
-            tipo_dia = 'feriado'
-        elif d.weekday() >= 5:
-            tipo_dia = 'fim_semana'
-        else:
-            tipo_dia = 'util'
-        dias.append({'data': d, 'tipo_dia': tipo_dia})
-    nomeacoes_por_data = {}
-    observacoes_por_data = {}
-    for n in nomeacoes:
-        nomeacoes_por_data.setdefault(n.data, {'efetivo': None, 'reserva': None})
-        if n.e_reserva:
-            nomeacoes_por_data[n.data]['reserva'] = n.escala_militar.militar
-        else:
-            nomeacoes_por_data[n.data]['efetivo'] = n.escala_militar.militar
-        observacoes_por_data[n.data] = n.escala_militar.escala.observacoes if n.escala_militar.escala else ''
-
-    # Obter nome da unidade e subunidade
-    config = ConfiguracaoUnidade.objects.first()
-    if config:
-        if config.nome_subunidade:
-            nome_cabecalho = f"{config.nome_unidade} - {config.nome_subunidade}"
-        else:
-            nome_cabecalho = config.nome_unidade
-    else:
-        nome_cabecalho = "Unidade Militar"
+    # A chave é o conteúdo do documento e o dia: se já foi gerado hoje (por qualquer processo), é servido do disco
+    dias, linhas = dados[servico.pk]
+    nome_cabecalho = nome_cabecalho_unidade(config)
+    nome_ficheiro = f"previsoes_{servico.nome}.pdf"
+    agora = datetime.now()
+    chave = chave_previsoes_pdf(nome_cabecalho, servico.nome, dias, linhas, agora.date())
+    em_cache = resposta_pdf_em_cache(chave, nome_ficheiro, download)
+    if em_cache:
+        return em_cache
 
-    response = HttpResponse(content_type='application/pdf')
-    if download:
-        response['Content-Disposition'] = f'attachment; filename="previsoes_{servico.nome}.pdf"'
-    else:
-        response['Content-Disposition'] = f'inline; filename="previsoes_{servico.nome}.pdf"'
-    p = canvas.Canvas(response, pagesize=A4)
-    width, height = A4
-    timestamp = datetime.now().strftime('Exportado em: %d/%m/%Y %H:%M')
-
-    def draw_header():
-        # Centralizar o nome da unidade
-        p.setFont("Helvetica-Bold", 16)
-        text_width = p.stringWidth(nome_cabecalho, "Helvetica-Bold", 16)
-        x_centro = (width - text_width) / 2
-        p.drawString(x_centro, height-2*cm, nome_cabecalho)
-        
-        p.setFont("Helvetica-Bold", 14)
-        p.drawString(2*cm, height-3*cm, f"Previsões de Nomeação – {servico.nome}")
-        # Adicionar timestamp no canto superior direito
-        p.setFont("Helvetica", 8)
-        p.drawRightString(width-2*cm, height-1.5*cm, timestamp)
-        p.setFont("Helvetica", 10)
-
-    def draw_footer():
-        p.setFont("Helvetica", 8)
-        # Desenhar o aviso mais abaixo
-        aviso = "Atenção: Estas previsões podem ser alteradas. Deve sempre consultar a Ordem de Serviço antes de sair da Unidade."
-        p.drawString(2*cm, 1*cm, aviso)
-
-    draw_header()
-    draw_footer()
-    y = height-4*cm
-
-    # Cabeçalho da tabela
-    p.setFillColor(colors.HexColor('#4A5D23'))
-    p.rect(2*cm, y, width-4*cm, 0.7*cm, fill=1)
-    p.setFillColor(colors.white)
-    p.drawString(2.1*cm, y+0.2*cm, "Data")
-    p.drawString(5*cm, y+0.2*cm, "Efetivo")
-    p.drawString(10*cm, y+0.2*cm, "Reserva")
-    p.drawString(15*cm, y+0.2*cm, "Observações")
-    y -= 0.7*cm
+    timestamp = agora.strftime('Exportado em: %d/%m/%Y %H:%M')
+    conteudo = desenhar_previsoes_pdf(nome_cabecalho, servico.nome, dias, linhas, timestamp)
+    return resposta_pdf(chave, conteudo, nome_ficheiro, download)
 
-    for dia in dias:
-        if y < 2*cm:
-            p.showPage()
-            draw_header()
-            draw_footer()
-            y = height-3*cm
-            p.setFont("Helvetica", 10)
-            y -= 1*cm
-            p.setFillColor(colors.HexColor('#4A5D23'))
-            p.rect(2*cm, y, width-4*cm, 0.7*cm, fill=1)
-            p.setFillColor(colors.white)
-            p.drawString(2.1*cm, y+0.2*cm, "Data")
-            p.drawString(5*cm, y+0.2*cm, "Efetivo")
-            p.drawString(10*cm, y+0.2*cm, "Reserva")
-            p.drawString(15*cm, y+0.2*cm, "Observações")
-            y -= 0.7*cm
-
-        data_str = dia['data'].strftime('%d/%m/%Y')
-        nomeacoes = nomeacoes_por_data.get(dia['data'], {})
-        efetivo = nomeacoes.get('efetivo')
-        reserva = nomeacoes.get('reserva')
-        obs = observacoes_por_data.get(dia['data'], '')
-
-        # Destacar Escala B (fim de semana ou feriado)
-        if dia['tipo_dia'] in ['feriado', 'fim_semana']:
-            p.saveState()
-            p.setFillColor(colors.HexColor('#e6f2d8'))
-            p.rect(2*cm, y, width-4*cm, 0.6*cm, fill=1, stroke=0)
-            p.restoreState()
-            p.setFont("Helvetica-Bold", 9)
-            p.setFillColor(colors.HexColor('#4A5D23'))
-        else:
-            p.setFont("Helvetica", 9)
-            p.setFillColor(colors.black)
-
-        p.drawString(2.1*cm, y+0.1*cm, data_str)
-        p.drawString(5*cm, y+0.1*cm, f"{efetivo.posto} {efetivo.nome}" if efetivo else "—")
-        p.drawString(10*cm, y+0.1*cm, f"{reserva.posto} {reserva.nome}" if reserva else "—")
-        p.drawString(15*cm, y+0.1*cm, obs[:40])
-        y -= 0.6*cm
-
-    p.showPage()
-    p.save()
+@login_required
+def exportar_previsoes_lote_view(request):
+    """
+    Previsões de todos os serviços (ou dos escolhidos em `servico`) num ZIP com um PDF por serviço,
+    desenhados em paralelo em `EXPORTACAO_PROCESSOS` processos.
+    """
+    servicos = Servico.objects.order_by('nome')
+    ids = [servico_id for servico_id in request.GET.getlist('servico') if servico_id.isdigit()]
+    if ids:
+        servicos = servicos.filter(pk__in=ids)
+
+    ficheiros = exportar_previsoes_lote(servicos, date.today(), settings.EXPORTACAO_PROCESSOS)
+    if not ficheiros:
+        messages.error(request, "Não existem nomeações para exportar.")
+        return redirect('previsoes_por_servico')
+
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as arquivo:
+        for nome_ficheiro, conteudo in ficheiros:
+            arquivo.writestr(nome_ficheiro, conteudo)
+    response = HttpResponse(buffer.getvalue(), content_type='application/zip')
+    response['Content-Disposition'] = f'attachment; filename="previsoes_{date.today():%Y%m%d}.zip"'
     return response
 
 @login_required
@@ -687,15 +485,27 @@ def obter_militares_disponiveis(request, servico_id, data):
         ).values_list('escala_militar__militar__nim', flat=True)
         
         # Obter militares disponíveis (que não estão nomeados como efetivos)
-        militares_disponiveis = Militar.objects.filter(
+        militares_disponiveis = list(Militar.objects.filter(
             servicos=servico
         ).exclude(
             nim__in=militares_efetivos
-        ).values('nim', 'nome', 'posto')
-        
+        ).only('nim', 'nome', 'posto'))
+
+        # Disponibilidade de todos os candidatos avaliada em lote (número constante de consultas)
+        disponibilidade = EscalaService.disponibilidade_em_lote(militares_disponiveis, [data])
+
         return JsonResponse({
             'success': True,
-            'militares': list(militares_disponiveis)
+            'militares': [
+                {
+                    'nim': militar.nim,
+                    'nome': militar.nome,
+                    'posto': militar.posto,
+                    'disponivel': disponibilidade[militar.nim][data][0],
+                    'motivo': disponibilidade[militar.nim][data][1],
+                }
+                for militar in militares_disponiveis
+            ]
         })
     except (Servico.DoesNotExist, ValueError):
         return JsonResponse({
@@ -744,6 +554,7 @@ def substituir_militar(request):
         
         # Remover nomeação antiga
         nomeacao_atual.delete()
+        atualizar_versao_escalas([servico.id])
         
         return JsonResponse({
             'success': True,
@@ -756,6 +567,7 @@ def substituir_militar(request):
         }, status=400)
 
 @login_required
+@condicional_escalas(_servico_do_url)
 def obter_nomeacao_atual(request, servico_id, data, tipo):
     try:
         servico = Servico.objects.get(id=servico_id)
@@ -805,6 +617,7 @@ def editar_observacao_nomeacao(request):
         if not nomeacoes.exists():
             return JsonResponse({'success': False, 'message': 'Nomeação não encontrada.'}, status=404)
         nomeacoes.update(observacoes=observacoes)
+        atualizar_versao_escalas([servico.id])
         return JsonResponse({'success': True, 'message': 'Observação atualizada com sucesso.'})
     except (Servico.DoesNotExist, ValueError, KeyError) as e:
         return JsonResponse({'success': False, 'message': str(e)}, status=400)
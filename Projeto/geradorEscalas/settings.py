@@ -147,3 +147,29 @@ LOGIN_REDIRECT_URL = 'home'
 LOGOUT_REDIRECT_URL = 'login'
 
 NOME_UNIDADE = "Unidade Militar Exemplo"
+
+# Número de processos usados para planear em paralelo grupos de serviços sem militares em comum
+GERACAO_PROCESSOS = config('GERACAO_PROCESSOS', default=os.cpu_count() or 1, cast=int)
+
+# Tempo máximo (segundos) do motor de otimização por serviço, tipo de escala e bloco; excedido, usa-se o motor guloso.
+# Medido (tests/performance/test_motores.py): 1000 militares num serviço com 2 efetivos e 1 reserva geram
+# 365 dias em ~15 s no total, menos de 1 s por bloco de 30 dias, longe dos 10 s de omissão
+OTIMIZACAO_TEMPO_LIMITE = config('OTIMIZACAO_TEMPO_LIMITE', default=10, cast=float)
+
+# Geração de longo prazo: períodos acima de 60 dias são gerados e gravados em blocos deste tamanho
+GERACAO_DIAS_POR_BLOCO = config('GERACAO_DIAS_POR_BLOCO', default=30, cast=int)
+GERACAO_LONGO_PRAZO_MAXIMO_DIAS = config('GERACAO_LONGO_PRAZO_MAXIMO_DIAS', default=731, cast=int)
+
+# Segundos durante os quais os feriados ficam em cache em cada processo (alterações noutro processo são vistas ao fim deste tempo)
+FERIADOS_CACHE_SEGUNDOS = config('FERIADOS_CACHE_SEGUNDOS', default=60, cast=int)
+
+# Segundos durante os quais os dados da página inicial ficam em cache; a chave inclui a versão das escalas, guardada
+# na base de dados, pelo que qualquer alteração (em qualquer processo) é vista logo, mesmo com a cache LocMem
+PAINEL_INICIAL_CACHE_SEGUNDOS = config('PAINEL_INICIAL_CACHE_SEGUNDOS', default=60, cast=int)
+
+# Cache em disco dos PDFs exportados (chave: hash do conteúdo de cada documento e do tipo de exportação)
+PDF_CACHE_DIR = config('PDF_CACHE_DIR', default=str(BASE_DIR / 'cache_pdf'))
+PDF_CACHE_MAXIMO_MB = config('PDF_CACHE_MAXIMO_MB', default=100, cast=int)
+
+# Número de processos usados para desenhar em paralelo os PDFs da exportação de previsões de vários serviços
+EXPORTACAO_PROCESSOS = config('EXPORTACAO_PROCESSOS', default=os.cpu_count() or 1, cast=int)
@@ -1,9 +1,26 @@
-from django.test import TestCase
-from datetime import date, timedelta
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.core.management import call_command
+import os
+import tempfile
+import time
+import zipfile
+from io import BytesIO, StringIO
+from unittest import mock
+from datetime import date, datetime, timedelta
 from core.models import (
     Militar, Servico, Escala, EscalaMilitar, 
-    Nomeacao
+    Nomeacao, Dispensa, TarefaGeracao, Log
 )
+from core.services.escala_service import EscalaService
+from core.services.tarefas_geracao import enfileirar_geracao, reservar_proxima_tarefa, estado_tarefa
+from core.services.painel_inicial import chave_painel, obter_painel
+from core.utils import limpar_cache_feriados
+from tests.utils import criar_militares
+from core.services.cache_pdf import IDADE_MAXIMA_TEMPORARIO, guardar_pdf, limitar_cache_pdf
 
 class EscalaIntegrationTest(TestCase):
     def setUp(self):
@@ -120,4 +137,595 @@ class EscalaIntegrationTest(TestCase):
         
         # Verificar disponibilidade
         self.assertFalse(self.militar1.esta_disponivel(data_hoje))
-        self.assertFalse(self.militar1.esta_disponivel(data_hoje + timedelta(days=1))) 
\ No newline at end of file
+        self.assertFalse(self.militar1.esta_disponivel(data_hoje + timedelta(days=1))) 
+
+class GeracaoEscalasTest(TestCase):
+    def setUp(self):
+        self.militares = criar_militares(6, 20000000)
+        self.servico = Servico.objects.create(
+            nome='Serviço de Dia',
+            tipo_escalas='AB',
+            n_elementos=1,
+            n_reservas=1
+        )
+        Escala.objects.create(servico=self.servico, e_escala_b=False)
+        Escala.objects.create(servico=self.servico, e_escala_b=True)
+        self.servico.militares.set(self.militares)
+        self.data_inicio = date.today() + timedelta(days=1)
+        self.data_fim = self.data_inicio + timedelta(days=20)
+
+    def nomeacoes_geradas(self):
+        return list(
+            Nomeacao.objects
+            .filter(escala_militar__escala__servico=self.servico)
+            .order_by('data', 'e_reserva')
+            .values_list('escala_militar__militar_id', 'data', 'e_reserva')
+        )
+
+    def test_gera_efetivo_por_dia_sem_dias_consecutivos(self):
+        ok = EscalaService.gerar_escalas_automaticamente(self.servico, self.data_inicio, self.data_fim)
+        self.assertTrue(ok)
+
+        efetivos = {}
+        for nim, dia, e_reserva in self.nomeacoes_geradas():
+            if not e_reserva:
+                self.assertNotIn(dia, efetivos)
+                efetivos[dia] = nim
+        self.assertEqual(len(efetivos), (self.data_fim - self.data_inicio).days + 1)
+        for dia, nim in efetivos.items():
+            self.assertNotEqual(efetivos.get(dia + timedelta(days=1)), nim)
+
+    def test_falha_na_gravacao_mantem_escala_anterior(self):
+        EscalaService.gerar_escalas_automaticamente(self.servico, self.data_inicio, self.data_fim)
+        anteriores = self.nomeacoes_geradas()
+
+        with mock.patch.object(Nomeacao.objects, 'bulk_create', side_effect=RuntimeError('falha')):
+            ok = EscalaService.gerar_escalas_automaticamente(self.servico, self.data_inicio, self.data_fim)
+
+        self.assertFalse(ok)
+        self.assertEqual(self.nomeacoes_geradas(), anteriores)
+
+    def test_geracao_da_unidade_nao_sobrepoe_servicos(self):
+        outro_servico = Servico.objects.create(
+            nome='Serviço de Ronda',
+            tipo_escalas='AB',
+            n_elementos=1,
+            n_reservas=0
+        )
+        Escala.objects.create(servico=outro_servico, e_escala_b=False)
+        Escala.objects.create(servico=outro_servico, e_escala_b=True)
+        outro_servico.militares.set(self.militares)
+
+        ok = EscalaService.gerar_escalas_unidade(self.data_inicio, self.data_fim)
+        self.assertTrue(ok)
+
+        dias_por_militar = {}
+        efetivos = Nomeacao.objects.filter(e_reserva=False).values_list('escala_militar__militar_id', 'data')
+        for nim, dia in efetivos:
+            dias_por_militar.setdefault(nim, []).append(dia)
+        for dias in dias_por_militar.values():
+            dias.sort()
+            for anterior, seguinte in zip(dias, dias[1:]):
+                self.assertGreater((seguinte - anterior).days, 1)
+
+    def test_simulacao_nao_grava_e_coincide_com_a_geracao(self):
+        simulacao = EscalaService.simular_escalas([self.servico], self.data_inicio, self.data_fim)
+        self.assertFalse(Nomeacao.objects.exists())
+
+        EscalaService.gerar_escalas_automaticamente(self.servico, self.data_inicio, self.data_fim)
+        self.assertEqual(
+            [(n['nim'], n['data'], n['e_reserva']) for n in simulacao['nomeacoes']],
+            self.nomeacoes_geradas()
+        )
+        self.assertEqual(
+            sum(c['efetivo'] for c in simulacao['contagens'].values()),
+            (self.data_fim - self.data_inicio).days + 1
+        )
+        self.assertEqual(simulacao['dias_incompletos'], [])
+
+    def test_simulacao_de_periodo_demasiado_longo_falha(self):
+        with self.assertRaisesMessage(ValueError, "O intervalo máximo para nomeações é de 60 dias"):
+            EscalaService.simular_escalas([self.servico], self.data_inicio, self.data_inicio + timedelta(days=90))
+        self.assertFalse(Nomeacao.objects.exists())
+
+    def test_dispensa_nova_so_substitui_nomeacoes_afetadas(self):
+        EscalaService.gerar_escalas_automaticamente(self.servico, self.data_inicio, self.data_fim)
+        anteriores = self.nomeacoes_geradas()
+        nim, dia, _ = next(n for n in anteriores if not n[2] and n[1] >= self.data_inicio + timedelta(days=5))
+
+        dispensa = Dispensa.objects.create(
+            militar_id=nim,
+            data_inicio=dia,
+            data_fim=dia + timedelta(days=1),
+            motivo='Baixa médica'
+        )
+        # A reparação é pedida explicitamente (pela administração), não por um sinal
+        self.assertEqual(self.nomeacoes_geradas(), anteriores)
+        EscalaService.reparar_escalas_dispensa(dispensa)
+
+        depois = self.nomeacoes_geradas()
+        afetados = {dia - timedelta(days=1), dia, dia + timedelta(days=1), dia + timedelta(days=2)}
+        self.assertEqual(
+            [n for n in depois if n[1] not in afetados],
+            [n for n in anteriores if n[1] not in afetados]
+        )
+        for militar_id, data, e_reserva in depois:
+            if militar_id == nim:
+                self.assertNotIn(data, {dia, dia + timedelta(days=1), dia + timedelta(days=2)})
+        self.assertTrue(any(d == dia and not e_reserva for _, d, e_reserva in depois))
+
+    def test_admin_repara_apos_commit_e_preenche_dias_libertados(self):
+        self.client.force_login(User.objects.create_superuser(username='admin', password='admin12345'))
+        EscalaService.gerar_escalas_automaticamente(self.servico, self.data_inicio, self.data_fim)
+        nim, dia, _ = next(n for n in self.nomeacoes_geradas() if not n[2] and n[1] >= self.data_inicio + timedelta(days=5))
+        dados = {'militar': nim, 'data_inicio': dia, 'data_fim': dia + timedelta(days=1), 'motivo': 'Baixa médica'}
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.client.post(reverse('admin:core_dispensa_add'), dados)
+        self.assertEqual(len(callbacks), 1)
+        self.assertIn((nim, dia, False), self.nomeacoes_geradas())
+        callbacks[0]()
+        self.assertNotIn(nim, [n[0] for n in self.nomeacoes_geradas() if dia <= n[1] <= dia + timedelta(days=2)])
+
+        # Uma vaga por preencher no último dia afetado, libertado ao encurtar a dispensa
+        libertado = dia + timedelta(days=2)
+        Nomeacao.objects.filter(data=libertado, e_reserva=False).delete()
+        dispensa = Dispensa.objects.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('admin:core_dispensa_change', args=[dispensa.pk]), dict(dados, data_fim=dia))
+        self.assertTrue(Nomeacao.objects.filter(data=libertado, e_reserva=False).exists())
+        self.assertTrue(Log.objects.filter(acao__startswith='Preenchidas 1 vagas nos dias libertados').exists())
+
+    def test_motor_otimizacao_preenche_vagas_sem_dias_consecutivos(self):
+        self.servico.motor_geracao = 'otimizacao'
+        self.servico.save()
+
+        ok = EscalaService.gerar_escalas_automaticamente(self.servico, self.data_inicio, self.data_fim)
+        self.assertTrue(ok)
+
+        efetivos, reservas = {}, {}
+        for nim, dia, e_reserva in self.nomeacoes_geradas():
+            (reservas if e_reserva else efetivos)[dia] = nim
+        total_dias = (self.data_fim - self.data_inicio).days + 1
+        self.assertEqual(len(efetivos), total_dias)
+        self.assertEqual(len(reservas), total_dias)
+        for dia, nim in efetivos.items():
+            self.assertNotEqual(efetivos.get(dia + timedelta(days=1)), nim)
+            self.assertNotEqual(reservas[dia], nim)
+
+    @override_settings(OTIMIZACAO_TEMPO_LIMITE=-1)
+    def test_motor_otimizacao_sem_tempo_usa_rotacao_gulosa(self):
+        EscalaService.gerar_escalas_automaticamente(self.servico, self.data_inicio, self.data_fim)
+        gulosas = self.nomeacoes_geradas()
+
+        self.servico.motor_geracao = 'otimizacao'
+        self.servico.save()
+        with self.assertLogs('core.services.motor_otimizacao', level='WARNING') as avisos:
+            EscalaService.gerar_escalas_automaticamente(self.servico, self.data_inicio, self.data_fim)
+
+        self.assertEqual(self.nomeacoes_geradas(), gulosas)
+        self.assertEqual(len(avisos.records), 4)  # efetivos e reservas das Escalas A e B
+        for aviso in avisos.records:
+            self.assertRegex(aviso.getMessage(), r'Serviço de Dia \((efetivos|reservas)\); a usar o motor guloso$')
+
+    def test_longo_prazo_gera_por_blocos_e_reporta_progresso(self):
+        data_fim = self.data_inicio + timedelta(days=119)
+        progresso = []
+
+        ok = EscalaService.gerar_escalas_longo_prazo(
+            [self.servico], self.data_inicio, data_fim, dias_por_bloco=25,
+            progresso=lambda concluidos, total: progresso.append((concluidos, total)), processos=1)
+        self.assertTrue(ok)
+        self.assertEqual(progresso, [(25, 120), (50, 120), (75, 120), (100, 120), (120, 120)])
+
+        efetivos, reservas = {}, {}
+        for nim, dia, e_reserva in self.nomeacoes_geradas():
+            (reservas if e_reserva else efetivos)[dia] = nim
+        self.assertEqual(len(efetivos), 120)
+        # Os reservas do fim de cada bloco saem dos efetivos antecipados do bloco seguinte:
+        # só podem faltar reservas na última semana, sem dias de escala seguintes
+        dias_sem_reserva = [dia for dia in efetivos if dia not in reservas]
+        self.assertTrue(all(dia > data_fim - timedelta(days=7) for dia in dias_sem_reserva))
+        for dia, nim in efetivos.items():
+            self.assertNotEqual(efetivos.get(dia + timedelta(days=1)), nim)
+        ultimo = Militar.objects.get(pk=efetivos[data_fim])
+        self.assertEqual(max(filter(None, (ultimo.ultima_nomeacao_a, ultimo.ultima_nomeacao_b))), data_fim)
+
+    def test_longo_prazo_reservas_na_fronteira_dos_blocos(self):
+        """
+        Os reservas do fim de cada bloco são os efetivos do dia de escala seguinte, como no resto do período,
+        mesmo quando esse dia já pertence ao bloco seguinte (que planeia os efetivos de novo).
+        """
+        self.servico.tipo_escalas = 'A'
+        self.servico.save()
+        data_fim = self.data_inicio + timedelta(days=59)
+
+        # Blocos de 10 dias: as fronteiras caem em 5 dias da semana diferentes
+        ok = EscalaService.gerar_escalas_longo_prazo(
+            [self.servico], self.data_inicio, data_fim, dias_por_bloco=10, processos=1)
+        self.assertTrue(ok)
+
+        efetivos, reservas = {}, {}
+        for nim, dia, e_reserva in self.nomeacoes_geradas():
+            (reservas if e_reserva else efetivos)[dia] = nim
+        seguinte = EscalaService.obter_dias_seguintes(efetivos)
+        for dia, nim in reservas.items():
+            if seguinte[dia] is not None:
+                self.assertEqual(nim, efetivos[seguinte[dia]], dia)
+
+
+class GeracaoParalelaTest(TransactionTestCase):
+    """
+    Planeamento em processos de trabalho: só corre numa base de dados que os processos partilhem
+    (não numa SQLite em memória, que existe apenas no processo dos testes).
+    """
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest("Os processos de trabalho não veem uma base de dados SQLite em memória")
+        limpar_cache_feriados()
+        self.data_inicio = date.today() + timedelta(days=1)
+        self.data_fim = self.data_inicio + timedelta(days=20)
+        # Dois grupos independentes: Dia e Ronda partilham militares; Piquete tem os seus
+        militares = criar_militares(11, 26000000)
+        for nome, tipo, inscritos in (('Dia', 'AB', militares[:6]), ('Ronda', 'A', militares[2:6]),
+                                      ('Piquete', 'AB', militares[6:])):
+            servico = Servico.objects.create(nome=nome, tipo_escalas=tipo, n_elementos=1, n_reservas=1)
+            for e_escala_b in ((False, True) if tipo == 'AB' else (False,)):
+                Escala.objects.create(servico=servico, e_escala_b=e_escala_b)
+            servico.militares.set(inscritos)
+        Dispensa.objects.create(
+            militar=militares[7], data_inicio=self.data_inicio + timedelta(days=3),
+            data_fim=self.data_inicio + timedelta(days=8), motivo='Férias')
+
+    def gerar(self, processos):
+        Nomeacao.objects.all().delete()
+        Militar.objects.update(ultima_nomeacao_a=None, ultima_nomeacao_b=None)
+        EscalaService.gerar_escalas_unidade(self.data_inicio, self.data_fim, processos=processos, lancar_erros=True)
+        nomeacoes = list(
+            Nomeacao.objects
+            .order_by('escala_militar__escala__servico__nome', 'data', 'e_reserva', 'escala_militar__militar_id')
+            .values_list('escala_militar__escala__servico__nome', 'escala_militar__escala__e_escala_b',
+                         'escala_militar__militar_id', 'data', 'e_reserva')
+        )
+        ultimas = list(Militar.objects.order_by('nim').values_list('nim', 'ultima_nomeacao_a', 'ultima_nomeacao_b'))
+        return nomeacoes, ultimas
+
+    def test_dois_processos_dao_o_mesmo_resultado_que_um(self):
+        em_serie = self.gerar(processos=1)
+        with self.assertLogs('core.services.geracao_paralela', level='INFO') as registos:
+            em_paralelo = self.gerar(processos=2)
+
+        self.assertIn("Planeados 3 serviços em 2 grupos independentes", registos.output[-1])
+        self.assertTrue(em_serie[0])
+        self.assertEqual(em_paralelo, em_serie)
+
+
+class TarefasGeracaoTest(TestCase):
+    def setUp(self):
+        militares = criar_militares(6, 21000000)
+        self.servico = Servico.objects.create(nome='Serviço de Dia', tipo_escalas='AB', n_elementos=1, n_reservas=1)
+        Escala.objects.create(servico=self.servico, e_escala_b=False)
+        Escala.objects.create(servico=self.servico, e_escala_b=True)
+        self.servico.militares.set(militares)
+        self.data_inicio = date.today() + timedelta(days=1)
+
+    def test_processo_de_trabalho_executa_tarefa_com_progresso(self):
+        data_fim = self.data_inicio + timedelta(days=89)
+        tarefa = enfileirar_geracao(self.data_inicio, data_fim, self.servico)
+        self.assertEqual(estado_tarefa(tarefa)['estado'], TarefaGeracao.PENDENTE)
+        self.assertFalse(Nomeacao.objects.exists())
+
+        call_command('processar_tarefas_geracao', '--uma-vez', stdout=StringIO())
+
+        tarefa.refresh_from_db()
+        estado = estado_tarefa(tarefa)
+        self.assertEqual(estado['estado'], TarefaGeracao.CONCLUIDA)
+        self.assertEqual((estado['dias_concluidos'], estado['total_dias'], estado['percentagem']), (90, 90, 100))
+        self.assertTrue(estado['terminada'])
+        self.assertEqual(Nomeacao.objects.filter(e_reserva=False).count(), 90)
+        self.assertIsNone(reservar_proxima_tarefa())
+
+    def test_geracao_curta_reporta_progresso_por_passo(self):
+        passos = []
+        ok = EscalaService.gerar_escalas_automaticamente(
+            self.servico, self.data_inicio, self.data_inicio + timedelta(days=29),
+            progresso_passos=lambda concluidos, total, fase: passos.append((concluidos, total, fase)))
+        self.assertTrue(ok)
+        self.assertEqual(passos, [
+            (0, 5, 'Efetivos da Escala B – Serviço de Dia'),
+            (1, 5, 'Efetivos da Escala A – Serviço de Dia'),
+            (2, 5, 'Reservas da Escala B – Serviço de Dia'),
+            (3, 5, 'Reservas da Escala A – Serviço de Dia'),
+            (4, 5, 'A gravar as nomeações'),
+        ])
+
+    def test_tarefa_falhada_grava_o_erro_original(self):
+        tarefa = enfileirar_geracao(self.data_inicio, self.data_inicio + timedelta(days=29), self.servico)
+        with mock.patch.object(EscalaService, '_gravar_plano', side_effect=RuntimeError('base de dados indisponível')):
+            call_command('processar_tarefas_geracao', '--uma-vez', stdout=StringIO())
+
+        tarefa.refresh_from_db()
+        self.assertEqual(tarefa.estado, TarefaGeracao.FALHADA)
+        self.assertEqual(tarefa.mensagem, 'Erro: base de dados indisponível')
+        self.assertEqual(tarefa.fase, 'A gravar as nomeações')
+        self.assertEqual((tarefa.dias_concluidos, tarefa.total_dias), (24, 30))
+
+    def test_periodo_invalido_nao_e_enfileirado(self):
+        with self.assertRaises(ValueError):
+            enfileirar_geracao(date.today(), self.data_inicio, self.servico)
+        self.assertFalse(TarefaGeracao.objects.exists())
+
+
+class PainelInicialTest(TestCase):
+    def setUp(self):
+        self.militares = criar_militares(6, 22000000)
+        self.hoje = date.today()
+        self.servicos = []
+        for nome in ('Serviço de Dia', 'Cabo de Dia'):
+            servico = Servico.objects.create(nome=nome, tipo_escalas='AB', n_elementos=1, n_reservas=1)
+            Escala.objects.create(servico=servico, e_escala_b=False)
+            Escala.objects.create(servico=servico, e_escala_b=True)
+            servico.militares.set(self.militares)
+            self.servicos.append(servico)
+        for i, servico in enumerate(self.servicos):
+            escala = servico.escalas.get(e_escala_b=self.hoje.weekday() >= 5)
+            em = EscalaMilitar.objects.get(escala=escala, militar=self.militares[i + 1])
+            Nomeacao.objects.create(escala_militar=em, data=self.hoje)
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_consultas_agrupadas_em_cache_e_invalidacao(self):
+        cache.clear()
+        # A versão das escalas e as cinco consultas do painel; depois, só a versão
+        with self.assertNumQueries(6):
+            painel = obter_painel(self.hoje)
+        with self.assertNumQueries(1):
+            self.assertEqual(obter_painel(self.hoje), painel)
+
+        self.assertEqual(painel['total_militares'], 12)
+        for info in painel['servicos_info']:
+            self.assertEqual(info['dispensados_hoje'], 0)
+        self.assertEqual([info['militar_hoje'] for info in painel['servicos_info']], self.militares[1:3])
+
+        Dispensa.objects.create(
+            militar=self.militares[0], data_inicio=self.hoje, data_fim=self.hoje, motivo='Consulta')
+        painel = obter_painel(self.hoje)
+        self.assertEqual(painel['total_dispensados'], 1)
+        self.assertEqual([info['dispensados_hoje'] for info in painel['servicos_info']], [1, 1])
+
+        # Remover a nomeação de hoje também invalida o painel
+        Nomeacao.objects.filter(escala_militar__militar=self.militares[1], data=self.hoje).delete()
+        painel = obter_painel(self.hoje)
+        self.assertIsNone(painel['servicos_info'][0]['militar_hoje'])
+
+    def test_chave_muda_com_militares_e_escalas(self):
+        """
+        A cache não é apagada por ninguém: a chave muda com a versão na base de dados, pelo que o mesmo
+        vale para alterações feitas noutros processos
+        """
+        obter_painel(self.hoje)
+        militar = self.militares[1]
+        militar.nome = 'Nome Novo'
+        militar.save()
+        self.assertEqual(obter_painel(self.hoje)['servicos_info'][0]['militar_hoje'].nome, 'Nome Novo')
+
+        chave = chave_painel(self.hoje)
+        EscalaMilitar.objects.filter(militar=self.militares[0]).update(ativo=False)  # sem sinais: a chave fica
+        self.assertEqual(chave_painel(self.hoje), chave)
+        em = EscalaMilitar.objects.filter(militar=self.militares[0]).first()
+        em.ativo = True
+        em.save()
+        self.assertNotEqual(chave_painel(self.hoje), chave)
+
+        # Remover o militar da escala apaga a nomeação de hoje
+        EscalaMilitar.objects.filter(militar=militar).delete()
+        self.assertIsNone(obter_painel(self.hoje)['servicos_info'][0]['militar_hoje'])
+
+        # Militares retirados de um serviço e militares removidos
+        self.servicos[1].militares.remove(self.militares[5])
+        self.assertEqual(obter_painel(self.hoje)['servicos_info'][1]['total_militares'], 5)
+        self.militares[3].delete()
+        self.assertEqual(obter_painel(self.hoje)['total_militares'], 9)
+
+        # Um militar sem serviços só conta no total de dispensados
+        sem_servicos, = criar_militares(1, 22000099)
+        obter_painel(self.hoje)
+        Dispensa.objects.create(militar=sem_servicos, data_inicio=self.hoje, data_fim=self.hoje, motivo='Consulta')
+        self.assertEqual(obter_painel(self.hoje)['total_dispensados'], 1)
+
+
+class MapaDispensasApiTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='mapa', password='mapa12345')
+        self.client.force_login(self.user)
+        self.militares = criar_militares(3, 23000000)
+        self.servico = Servico.objects.create(nome='Guarda', tipo_escalas='A')
+        self.servico.militares.set(self.militares)
+        Dispensa.objects.create(militar=self.militares[1], data_inicio=date(2030, 2, 25), data_fim=date(2030, 3, 3), motivo='Férias')
+        Dispensa.objects.create(militar=self.militares[1], data_inicio=date(2030, 3, 4), data_fim=date(2030, 3, 5), motivo='Curso')
+        limpar_cache_feriados()
+
+    def test_janela_mensal_compacta(self):
+        with self.assertNumQueries(6):  # sessão e utilizador, serviços, feriados, dispensas e militares
+            resposta = self.client.get(reverse('mapa_dispensas_dados'), {'inicio': '2030-03-01'})
+        self.assertEqual(resposta.status_code, 200)
+        dados = resposta.json()
+
+        self.assertEqual((dados['inicio'], dados['fim']), ('2030-03-01', '2030-03-31'))
+        self.assertEqual(len(dados['tipos']), 31)
+        self.assertEqual(dados['tipos'][1], '1')  # sábado
+        self.assertEqual([mes['dias'] for mes in dados['meses']], [31])
+        self.assertEqual(dados['motivos'], ['Férias', 'Curso'])
+        self.assertEqual(dados['militares'][self.militares[1].nim]['dispensas'], [[0, 3, 0], [3, 2, 1]])
+        self.assertEqual(dados['militares'][self.militares[0].nim]['dispensas'], [])
+        servico = dados['servicos'][0]
+        self.assertEqual(servico['militares'], [m.nim for m in self.militares])
+        self.assertEqual(servico['dispensados'][:6], [1, 1, 1, 1, 1, 0])
+
+    def test_janela_invalida(self):
+        url = reverse('mapa_dispensas_dados')
+        self.assertEqual(self.client.get(url, {'inicio': 'ontem'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'inicio': '2030-03-10', 'fim': '2030-03-01'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'inicio': '2030-01-01', 'fim': '2031-06-01'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'inicio': '2030-03-01', 'servico': 'x'}).json()['servicos'], [])
+
+
+class ListaServicosTest(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_user(username='lista', password='lista12345'))
+        self.hoje = date.today()
+        self.servicos = []
+        for i, militar in enumerate(criar_militares(3, 24000000)):
+            servico = Servico.objects.create(nome=f'Serviço {i}', tipo_escalas='A')
+            escala = Escala.objects.create(servico=servico, e_escala_b=False)
+            servico.militares.add(militar)
+            em = EscalaMilitar.objects.get(escala=escala, militar=militar)
+            Nomeacao.objects.bulk_create(
+                Nomeacao(escala_militar=em, data=self.hoje + timedelta(days=d)) for d in range(0, 70, 7)
+            )
+            self.servicos.append(servico)
+        limpar_cache_feriados()
+
+    def test_paginacao_e_janela_na_base_de_dados(self):
+        with self.assertNumQueries(8):  # sessão e utilizador, versão, contagem, serviços, nomeações, feriados e "há mais"
+            resposta = self.client.get(reverse('lista_servicos'))
+        self.assertEqual(resposta.context['servicos'], self.servicos[:2])
+        self.assertEqual([item['data'] for item in resposta.context['datas']],
+                         [self.hoje + timedelta(days=d) for d in range(0, 28, 7)])
+        self.assertTrue(resposta.context['ha_mais'])
+        celula = resposta.context['tabela'][self.hoje][self.servicos[0].id]
+        self.assertEqual(celula, {'efetivo': [{'posto': 'Sold', 'nome': 'Militar 0'}], 'reserva': []})
+
+        resposta = self.client.get(reverse('lista_servicos'), {'pagina': 2, 'semanas': 10})
+        self.assertEqual(resposta.context['servicos'], self.servicos[2:])
+        self.assertEqual(len(resposta.context['datas']), 10)
+        self.assertFalse(resposta.context['ha_mais'])
+
+    def test_get_condicional(self):
+        url = reverse('previsoes_servico', args=[self.servicos[0].id])
+        resposta = self.client.get(url)
+        self.assertEqual(resposta.status_code, 200)
+        etag = resposta['ETag']
+
+        with self.assertNumQueries(3):  # sessão, utilizador e versão do serviço; as nomeações não são consultadas
+            resposta = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resposta.status_code, 304)
+
+        # A versão está na base de dados, partilhada por todos os processos, e não na cache local
+        cache.clear()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        # Uma dispensa de um militar de outro serviço não muda a versão deste
+        militar = self.servicos[1].militares.get()
+        Dispensa.objects.create(militar=militar, data_inicio=self.hoje, data_fim=self.hoje, motivo='Consulta')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        militar = self.servicos[0].militares.get()
+        Dispensa.objects.create(militar=militar, data_inicio=self.hoje, data_fim=self.hoje, motivo='Consulta')
+        resposta = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resposta.status_code, 200)
+        self.assertNotEqual(resposta['ETag'], etag)
+        self.assertEqual(resposta['Cache-Control'], 'private, no-cache')
+        self.assertIn('Cookie', resposta['Vary'])
+
+        # Remover uma nomeação (sem ser em massa) também muda a versão
+        etag = resposta['ETag']
+        Nomeacao.objects.filter(escala_militar__escala__servico=self.servicos[0]).first().delete()
+        resposta = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resposta.status_code, 200)
+
+        # Um novo login (nova sessão e novo token CSRF) não pode reutilizar a página em cache
+        etag = resposta['ETag']
+        utilizador = resposta.wsgi_request.user
+        self.client.logout()
+        self.client.force_login(utilizador)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class CachePdfTest(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_user(username='pdf', password='pdf12345'))
+        militar, = criar_militares(1, 25000000)
+        self.servico = Servico.objects.create(nome='Guarda', tipo_escalas='A')
+        escala = Escala.objects.create(servico=self.servico, e_escala_b=False)
+        self.servico.militares.add(militar)
+        em = EscalaMilitar.objects.get(escala=escala, militar=militar)
+        Nomeacao.objects.create(escala_militar=em, data=date.today() + timedelta(days=1))
+        self.pasta = tempfile.TemporaryDirectory()
+        self.addCleanup(self.pasta.cleanup)
+
+    def test_pre_visualizacao_e_download_geram_o_pdf_uma_vez(self):
+        with override_settings(PDF_CACHE_DIR=self.pasta.name):
+            resposta = self.client.get(reverse('previsualizar_previsoes_pdf', args=[self.servico.id]))
+            self.assertTrue(resposta['Content-Disposition'].startswith('inline'))
+            pdf = resposta.content
+
+            with mock.patch('core.services.pdf_previsoes.canvas.Canvas') as canvas:
+                resposta = self.client.get(reverse('exportar_previsoes_pdf', args=[self.servico.id]))
+                self.assertEqual(b''.join(resposta.streaming_content), pdf)
+                self.assertTrue(resposta['Content-Disposition'].startswith('attachment'))
+                canvas.assert_not_called()
+
+                # A chave vem do conteúdo: mesmo uma alteração sem sinais (ou noutro processo) gera outro PDF
+                Militar.objects.update(nome='Outro Nome')
+                self.client.get(reverse('exportar_previsoes_pdf', args=[self.servico.id]))
+                canvas.assert_called_once()
+
+    def test_pdf_de_outro_dia_e_gerado_de_novo(self):
+        """O PDF mostra "Exportado em"; no dia seguinte o mesmo conteúdo não é servido com a data antiga."""
+        url = reverse('exportar_previsoes_pdf', args=[self.servico.id])
+        with override_settings(PDF_CACHE_DIR=self.pasta.name), \
+                mock.patch('core.views.datetime') as relogio, \
+                mock.patch('core.views.desenhar_previsoes_pdf', return_value=b'%PDF') as desenhar:
+            relogio.now.return_value = datetime(2026, 1, 10, 9, 0)
+            self.client.get(url)
+            relogio.now.return_value = datetime(2026, 1, 10, 18, 0)
+            self.client.get(url)
+            self.assertEqual(desenhar.call_count, 1)
+
+            relogio.now.return_value = datetime(2026, 1, 11, 9, 0)
+            self.client.get(url)
+            self.assertEqual(desenhar.call_count, 2)
+            self.assertEqual(desenhar.call_args.args[-1], 'Exportado em: 11/01/2026 09:00')
+
+    def test_exportacao_em_lote_num_zip(self):
+        outro = Servico.objects.create(nome='Piquete', tipo_escalas='A')
+        escala = Escala.objects.create(servico=outro, e_escala_b=False)
+        outro.militares.add(Militar.objects.get())
+        em = EscalaMilitar.objects.get(escala=escala)
+        Nomeacao.objects.create(escala_militar=em, data=date.today() + timedelta(days=3))
+        Servico.objects.create(nome='Sem nomeações', tipo_escalas='A')
+
+        with override_settings(PDF_CACHE_DIR=self.pasta.name, EXPORTACAO_PROCESSOS=2):
+            individual = self.client.get(reverse('exportar_previsoes_pdf', args=[self.servico.id]))
+            resposta = self.client.get(reverse('exportar_previsoes_lote'))
+        self.assertEqual(resposta['Content-Type'], 'application/zip')
+        with zipfile.ZipFile(BytesIO(resposta.content)) as arquivo:
+            self.assertEqual(arquivo.namelist(), ['previsoes_Guarda.pdf', 'previsoes_Piquete.pdf'])
+            # O PDF já gerado individualmente vem da cache; o outro é desenhado com o mesmo layout
+            self.assertEqual(arquivo.read('previsoes_Guarda.pdf'), individual.content)
+            self.assertTrue(arquivo.read('previsoes_Piquete.pdf').startswith(b'%PDF'))
+
+    def test_remove_os_menos_usados(self):
+        with override_settings(PDF_CACHE_DIR=self.pasta.name):
+            for i, nome in enumerate(['a', 'b', 'c']):
+                caminho = os.path.join(self.pasta.name, f'{nome}.pdf')
+                with open(caminho, 'wb') as ficheiro:
+                    ficheiro.write(b'x' * 100)
+                os.utime(caminho, (1000 + i, 1000 + i))
+            # Um temporário abandonado é removido; um recente pode estar a ser escrito e fica
+            for nome, idade in (('abandonado.tmp', 2 * IDADE_MAXIMA_TEMPORARIO), ('recente.tmp', 0)):
+                caminho = os.path.join(self.pasta.name, nome)
+                open(caminho, 'wb').close()
+                os.utime(caminho, (time.time() - idade, time.time() - idade))
+            limitar_cache_pdf(250)
+        self.assertEqual(sorted(os.listdir(self.pasta.name)), ['b.pdf', 'c.pdf', 'recente.tmp'])
+
+    def test_falha_ao_gravar_nao_deixa_temporarios(self):
+        with override_settings(PDF_CACHE_DIR=self.pasta.name), \
+                mock.patch('core.services.cache_pdf.os.replace', side_effect=OSError('disco cheio')), \
+                self.assertLogs('core.services.cache_pdf', level='WARNING'):
+            guardar_pdf('chave', b'%PDF')
+        self.assertEqual(os.listdir(self.pasta.name), [])
@@ -304,12 +304,12 @@ class InterfaceTest(LiveServerTestCase):
             EC.presence_of_element_located((By.CLASS_NAME, 'dispensa-grid'))
         )
         WebDriverWait(self.driver, 10).until(
-            EC.presence_of_element_located((By.CLASS_NAME, 'grid-container'))
+            EC.presence_of_element_located((By.CLASS_NAME, 'mapa-bloco-mes'))
         )
         
         # Verificar elementos da página
         self.assertTrue(self.driver.find_element(By.CLASS_NAME, 'dispensa-grid'))
-        self.assertTrue(self.driver.find_element(By.CLASS_NAME, 'grid-container'))
+        self.assertTrue(self.driver.find_element(By.CLASS_NAME, 'mapa-bloco-mes'))
 
     def capture_screenshot(self, test_name):
         """Captura um screenshot para ajudar no debug"""
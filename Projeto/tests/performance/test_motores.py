@@ -0,0 +1,110 @@
+import random
+import statistics
+import time
+from collections import Counter
+from datetime import timedelta
+from django.conf import settings
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from core.models import Servico, Escala, Dispensa, Nomeacao
+from core.services.escala_service import EscalaService
+from tests.utils import criar_militares
+
+
+# O hash rápido só encurta a criação dos utilizadores dos militares; o tempo limite do motor fica o de omissão
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class MotoresGeracaoTest(TestCase):
+    """Compara a qualidade e o tempo das escalas do motor guloso e do motor de otimização."""
+
+    # Um serviço com o efetivo de uma unidade grande, 2 efetivos e 1 reserva por dia
+    N_MILITARES = 120
+
+    @classmethod
+    def setUpTestData(cls):
+        random.seed(2025)
+        cls.militares = criar_militares(cls.N_MILITARES, 50000000, posto='SOL')
+        cls.servico = Servico.objects.create(
+            nome='Serviço Benchmark',
+            tipo_escalas='AB',
+            n_elementos=2,
+            n_reservas=1
+        )
+        Escala.objects.create(servico=cls.servico, e_escala_b=False)
+        Escala.objects.create(servico=cls.servico, e_escala_b=True)
+        cls.servico.militares.set(cls.militares)
+
+        hoje = timezone.now().date()
+        for militar in random.sample(cls.militares, k=cls.N_MILITARES * 2 // 5):
+            inicio = hoje + timedelta(days=random.randint(1, 330))
+            Dispensa.objects.create(
+                militar=militar,
+                data_inicio=inicio,
+                data_fim=inicio + timedelta(days=random.randint(2, 15)),
+                motivo='Dispensa para benchmark'
+            )
+
+    def avaliar(self, motor, dias):
+        """Gera `dias` dias com o motor indicado e mede a qualidade do resultado."""
+        Nomeacao.objects.filter(escala_militar__escala__servico=self.servico).delete()
+        self.servico.motor_geracao = motor
+        self.servico.save()
+        data_inicio = timezone.now().date() + timedelta(days=1)
+        data_fim = data_inicio + timedelta(days=dias - 1)
+
+        # Acima de 60 dias a geração é feita em blocos (geração de longo prazo)
+        inicio = time.time()
+        EscalaService.gerar_escalas_automaticamente(self.servico, data_inicio, data_fim)
+        duracao = time.time() - inicio
+        janela = EscalaService.obter_dias_escala(data_inicio, data_fim, maximo_dias=dias)
+        dias_escala = janela['escala_a'] + janela['escala_b']
+
+        efetivos_a = Counter()
+        efetivos_b = Counter()
+        efetivos_por_dia = Counter()
+        reservas_por_dia = Counter()
+        for nim, dia, e_reserva, e_escala_b in Nomeacao.objects.filter(
+                escala_militar__escala__servico=self.servico).values_list(
+                'escala_militar__militar_id', 'data', 'e_reserva', 'escala_militar__escala__e_escala_b'):
+            if e_reserva:
+                reservas_por_dia[dia] += 1
+            else:
+                efetivos_por_dia[dia] += 1
+                (efetivos_b if e_escala_b else efetivos_a)[nim] += 1
+
+        nims = [militar.nim for militar in self.militares]
+        carga = [efetivos_a[nim] + efetivos_b[nim] for nim in nims]
+        return {
+            'efetivos_em_falta': sum(max(0, self.servico.n_elementos - efetivos_por_dia[dia]) for dia in dias_escala),
+            'reservas_em_falta': sum(max(0, self.servico.n_reservas - reservas_por_dia[dia]) for dia in dias_escala),
+            'desvio_carga': statistics.pstdev(carga),
+            'duracao': duracao,
+            'amplitude_b': max(efetivos_b[nim] for nim in nims) - min(efetivos_b[nim] for nim in nims),
+        }
+
+    def test_otimizacao_preenche_reservas_com_carga_equilibrada(self):
+        """
+        Em 30, 90 e 365 dias, com o tempo limite de omissão (`OTIMIZACAO_TEMPO_LIMITE`), o motor de otimização
+        corre até ao fim e não deixa vagas por preencher
+        """
+        print("\nResultados da Comparação dos Motores:")
+        print("=" * 50)
+        for dias in (30, 90, 365):
+            with self.subTest(dias=dias):
+                guloso = self.avaliar('guloso', dias)
+                # Sem aviso de tempo esgotado: o resultado é mesmo do motor de otimização
+                with self.assertNoLogs('core.services.motor_otimizacao', level='WARNING'):
+                    otimizacao = self.avaliar('otimizacao', dias)
+
+                print(f"Período: {dias} dias ({self.N_MILITARES} militares)")
+                print(f"Motor guloso: {guloso['duracao']:.2f} segundos")
+                print(f"Motor de otimização: {otimizacao['duracao']:.2f} segundos")
+                print("-" * 30)
+
+                self.assertEqual(guloso['efetivos_em_falta'], 0)
+                self.assertEqual(otimizacao['efetivos_em_falta'], 0)
+                self.assertEqual(otimizacao['reservas_em_falta'], 0)
+                self.assertLessEqual(otimizacao['reservas_em_falta'], guloso['reservas_em_falta'])
+                self.assertLess(otimizacao['desvio_carga'], 1.5)
+                self.assertLessEqual(otimizacao['amplitude_b'], 3)
+                # O limite é por serviço, tipo de escala e bloco; o período inteiro cabe folgadamente num só
+                self.assertLess(otimizacao['duracao'], settings.OTIMIZACAO_TEMPO_LIMITE)
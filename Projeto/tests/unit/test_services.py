@@ -0,0 +1,407 @@
+from django.test import TestCase
+import time
+from unittest import mock
+from collections import defaultdict
+from django.db import transaction
+from datetime import date, timedelta
+from core.models import Militar, Dispensa, Servico, Escala, EscalaMilitar, Nomeacao, Feriado
+from core.services.escala_service import EscalaService
+from core.services.indice_disponibilidade import IndiceDisponibilidade
+from core.services.rotacao import RotacaoEscala
+from core.services.geracao_paralela import agrupar_servicos_independentes, _planear_grupo
+from core.services.motor_otimizacao import FluxoCustoMinimo, TempoEsgotado, _atribuir_dias
+from core.services.matriz_disponibilidade import MatrizDisponibilidade, mapa_calor_servicos
+from core.services.indice_dispensas import IndiceDispensas
+from core.services.mapa_dispensas import construir_mapa_dispensas
+from core.utils import calendario_dias, conjunto_feriados, limpar_cache_feriados, obter_feriados
+from tests.utils import criar_militares
+
+
+class IndiceDisponibilidadeTest(TestCase):
+    def setUp(self):
+        self.militares = criar_militares(4, 10000000)
+        self.servico = Servico.objects.create(nome='Serviço de Guarda', tipo_escalas='AB')
+        self.escala_a = Escala.objects.create(servico=self.servico, e_escala_b=False)
+        self.escala_b = Escala.objects.create(servico=self.servico, e_escala_b=True)
+        self.inicio = date.today() + timedelta(days=10)
+        self.fim = self.inicio + timedelta(days=10)
+
+        Dispensa.objects.create(
+            militar=self.militares[0],
+            data_inicio=self.inicio + timedelta(days=2),
+            data_fim=self.inicio + timedelta(days=4),
+            motivo='Férias'
+        )
+        em_a = EscalaMilitar.objects.create(escala=self.escala_a, militar=self.militares[1], ordem=1)
+        em_b = EscalaMilitar.objects.create(escala=self.escala_b, militar=self.militares[2], ordem=1)
+        Nomeacao.objects.create(escala_militar=em_a, data=self.inicio + timedelta(days=3))
+        Nomeacao.objects.create(escala_militar=em_b, data=self.inicio + timedelta(days=6))
+
+    def test_indice_equivale_as_consultas(self):
+        indice = IndiceDisponibilidade.construir(self.inicio, self.fim, self.militares)
+        dia = self.inicio
+        while dia <= self.fim:
+            for militar in self.militares:
+                self.assertEqual(
+                    EscalaService.verificar_disponibilidade_militar(militar, dia, indice),
+                    EscalaService.verificar_disponibilidade_militar(militar, dia),
+                )
+                for e_escala_b in (False, True):
+                    self.assertEqual(
+                        EscalaService.verificar_disponibilidade_reserva(militar, dia, e_escala_b, indice),
+                        EscalaService.verificar_disponibilidade_reserva(militar, dia, e_escala_b),
+                    )
+            dia += timedelta(days=1)
+
+    def test_registar_nomeacao_atualiza_indice(self):
+        indice = IndiceDisponibilidade.construir(self.inicio, self.fim, self.militares)
+        militar = self.militares[3]
+        dia = self.inicio + timedelta(days=1)
+        self.assertTrue(EscalaService.verificar_disponibilidade_militar(militar, dia, indice)[0])
+
+        indice.registar_nomeacao(militar.nim, dia, False, False)
+
+        self.assertFalse(EscalaService.verificar_disponibilidade_militar(militar, dia, indice)[0])
+        self.assertFalse(EscalaService.verificar_disponibilidade_militar(militar, dia + timedelta(days=1), indice)[0])
+
+    def test_disponibilidade_em_lote(self):
+        datas = [self.inicio + timedelta(days=i) for i in range(11)]
+        with self.assertNumQueries(2):
+            matriz = EscalaService.disponibilidade_em_lote(self.militares, datas)
+        for militar in self.militares:
+            for dia in datas:
+                self.assertEqual(
+                    matriz[militar.nim][dia],
+                    EscalaService.verificar_disponibilidade_militar(militar, dia),
+                )
+
+    def test_proximo_efetivo_com_mapa_de_dias_seguintes(self):
+        indice = IndiceDisponibilidade.construir(self.inicio, self.fim, self.militares)
+        dias = [self.inicio + timedelta(days=i) for i in (5, 1, 3, 7)]
+        dias_seguintes = EscalaService.obter_dias_seguintes(dias)
+        self.assertEqual(dias_seguintes[dias[1]], dias[2])
+        self.assertIsNone(dias_seguintes[dias[3]])
+
+        # O militar 0 está dispensado no dia 3 e não pode ser reserva; a procura avança para o dia de escala 7
+        efetivos = {dias[0]: [self.militares[0]], dias[3]: [self.militares[3]]}
+        with self.assertNumQueries(0):
+            resultado = EscalaService.encontrar_proximo_efetivo_valido(
+                dias[2], efetivos, dias, False, indice, dias_seguintes)
+        self.assertEqual(resultado, (self.militares[3], dias[3]))
+        self.assertEqual(
+            EscalaService.encontrar_proximo_efetivo_valido(dias[3], efetivos, dias, False, indice),
+            (None, None)
+        )
+
+
+class UltimasNomeacoesTest(TestCase):
+    def setUp(self):
+        self.militar = Militar.objects.create(
+            nim='30000000',
+            nome='João Silva',
+            posto='Sold',
+            funcao='Condutor',
+            telefone=930000000,
+            email='joao@exemplo.com'
+        )
+        servico = Servico.objects.create(nome='Serviço de Guarda', tipo_escalas='AB')
+        em_a = EscalaMilitar.objects.create(
+            escala=Escala.objects.create(servico=servico, e_escala_b=False), militar=self.militar, ordem=1)
+        em_b = EscalaMilitar.objects.create(
+            escala=Escala.objects.create(servico=servico, e_escala_b=True), militar=self.militar, ordem=1)
+        self.data_inicio = date.today() + timedelta(days=1)
+        Nomeacao.objects.create(escala_militar=em_a, data=self.data_inicio - timedelta(days=10))
+        Nomeacao.objects.create(escala_militar=em_a, data=self.data_inicio - timedelta(days=4))
+        Nomeacao.objects.create(escala_militar=em_b, data=self.data_inicio - timedelta(days=7))
+        Nomeacao.objects.create(escala_militar=em_b, data=self.data_inicio - timedelta(days=2), e_reserva=True)
+
+    def test_separa_escala_a_e_b_numa_consulta(self):
+        militares = [self.militar]
+        with self.assertNumQueries(1):
+            ultima_a, ultima_b = EscalaService._atualizar_ultimas_nomeacoes(militares, self.data_inicio)
+
+        self.assertEqual(ultima_a[self.militar.nim], self.data_inicio - timedelta(days=4))
+        self.assertEqual(ultima_b[self.militar.nim], self.data_inicio - timedelta(days=7))
+        self.assertEqual(self.militar.ultima_nomeacao_b, self.data_inicio - timedelta(days=7))
+
+
+class MilitaresDisponiveisTest(TestCase):
+    def test_ordena_por_folga_e_ignora_inativos(self):
+        militares = criar_militares(6, 40000000)
+        servico = Servico.objects.create(nome='Serviço de Guarda', tipo_escalas='A')
+        servico.militares.set(militares)
+        escala = Escala.objects.create(servico=servico, e_escala_b=False)
+        dia = date.today() + timedelta(days=20)
+        ems = [
+            EscalaMilitar.objects.create(escala=escala, militar=m, ordem=i, ativo=i != 4)
+            for i, m in enumerate(militares)
+        ]
+        Nomeacao.objects.create(escala_militar=ems[0], data=dia - timedelta(days=9))
+        Nomeacao.objects.create(escala_militar=ems[0], data=dia - timedelta(days=12))
+        Nomeacao.objects.create(escala_militar=ems[1], data=dia - timedelta(days=3))
+        Nomeacao.objects.create(escala_militar=ems[2], data=dia - timedelta(days=6))
+        Nomeacao.objects.create(escala_militar=ems[4], data=dia - timedelta(days=5))
+        Dispensa.objects.create(militar=militares[5], data_inicio=dia, data_fim=dia, motivo='Férias')
+
+        with self.assertNumQueries(3):
+            disponiveis = EscalaService.obter_militares_disponiveis(servico, dia)
+
+        # Militar 4 está inativo, militar 5 dispensado e militar 3 nunca fez o serviço
+        self.assertEqual(disponiveis, [militares[1], militares[2], militares[0], militares[3]])
+        self.assertEqual(
+            [m.calcular_folga(dia, servico) for m in disponiveis],
+            sorted(m.calcular_folga(dia, servico) for m in disponiveis),
+        )
+
+
+class RotacaoEscalaTest(TestCase):
+    def test_salta_indisponiveis_e_mantem_posicao(self):
+        ultimas = {'A': None, 'B': None, 'C': date(2025, 1, 1)}
+        rotacao = RotacaoEscala([('A', 1), ('B', 2), ('C', 3)], ultimas)
+        dia = date(2025, 2, 1)
+
+        self.assertEqual(rotacao.selecionar(dia, 1, lambda nim: nim != 'A'), ['B'])
+        self.assertEqual(ultimas['B'], dia)
+        # 'A' foi saltado mas continua à frente na rotação
+        self.assertEqual(rotacao.selecionar(dia + timedelta(days=1), 2, lambda nim: True), ['A', 'C'])
+        self.assertEqual(rotacao.selecionar(dia + timedelta(days=2), 1, lambda nim: True), ['B'])
+
+    def test_ordem_desempata_e_sem_ordem_fica_no_fim(self):
+        rotacao = RotacaoEscala([('A', None), ('B', 5), ('C', 2)], {})
+        self.assertEqual(rotacao.selecionar(date(2025, 2, 1), 3, lambda nim: True), ['C', 'B', 'A'])
+
+
+class GruposServicosTest(TestCase):
+    def test_servicos_com_militares_em_comum_ficam_juntos(self):
+        militares = criar_militares(4, 40000000)
+        oficiais = Servico.objects.create(nome='Oficial de Dia')
+        adjunto = Servico.objects.create(nome='Adjunto')
+        pracas = Servico.objects.create(nome='Guarda')
+        oficiais.militares.set(militares[:2])
+        adjunto.militares.set(militares[1:3])
+        pracas.militares.set(militares[3:])
+
+        grupos = agrupar_servicos_independentes([oficiais, adjunto, pracas])
+
+        self.assertEqual(
+            sorted(sorted(s.nome for s in grupo) for grupo in grupos),
+            [['Adjunto', 'Oficial de Dia'], ['Guarda']]
+        )
+
+    def test_processo_de_trabalho_planeia_sem_escrever(self):
+        militares = criar_militares(4, 40000100)
+        servico = Servico.objects.create(nome='Guarda', tipo_escalas='AB', n_elementos=1, n_reservas=0)
+        escala_a = Escala.objects.create(servico=servico, e_escala_b=False)
+        servico.militares.set(militares)
+        inicio = date.today() + timedelta(days=1)
+
+        # O processo de trabalho fecha as suas ligações no fim; aqui corre no processo do teste
+        with mock.patch('core.services.geracao_paralela.connections'):
+            plano, _ = _planear_grupo([servico.pk], [servico.pk], inicio, inicio + timedelta(days=13))
+
+        self.assertEqual(list(Escala.objects.values_list('pk', flat=True)), [escala_a.pk])
+        self.assertFalse(Nomeacao.objects.exists())
+        self.assertTrue(plano)
+        self.assertEqual({escala_id for escala_id, _, _, _ in plano}, {escala_a.pk})
+
+
+class FluxoCustoMinimoTest(TestCase):
+    def test_escolhe_atribuicao_de_custo_minimo(self):
+        # fonte 0, sumidouro 1, tarefas 2-3, militares 4-5
+        rede = FluxoCustoMinimo(6)
+        rede.adicionar_aresta(0, 2, 1, 0)
+        rede.adicionar_aresta(0, 3, 1, 0)
+        a = rede.adicionar_aresta(2, 4, 1, 1)
+        b = rede.adicionar_aresta(2, 5, 1, 2)
+        c = rede.adicionar_aresta(3, 4, 1, 1)
+        d = rede.adicionar_aresta(3, 5, 1, 5)
+        rede.adicionar_aresta(4, 1, 1, 0)
+        rede.adicionar_aresta(5, 1, 1, 0)
+
+        self.assertEqual(rede.resolver(0, 1), (2, 3))
+        self.assertEqual([rede.fluxo(aresta) for aresta in (a, b, c, d)], [0, 1, 1, 0])
+
+    def test_prazo_verificado_na_construcao_da_rede(self):
+        candidatos = []
+        dias = [date(2030, 1, 1) + timedelta(days=i) for i in range(3)]
+        with self.assertRaises(TempoEsgotado):
+            _atribuir_dias(dias, ['1', '2'], 1, lambda nim, dia: candidatos.append((nim, dia)) or True,
+                           lambda nim, dia: 0, defaultdict(int), 1, time.monotonic() - 1)
+        self.assertEqual(candidatos, [])
+
+
+class MatrizDisponibilidadeTest(TestCase):
+    def setUp(self):
+        self.militares = criar_militares(5, 60000000)
+        self.servico = Servico.objects.create(nome='Serviço de Guarda')
+        self.servico.militares.set(self.militares)
+        self.inicio = date(2025, 3, 1)
+        self.fim = date(2025, 3, 31)
+        for militar, (desde, ate) in zip(self.militares, [(-5, 3), (2, 6), (5, 5), (29, 40)]):
+            Dispensa.objects.create(
+                militar=militar,
+                data_inicio=self.inicio + timedelta(days=desde),
+                data_fim=self.inicio + timedelta(days=ate),
+                motivo='Férias'
+            )
+
+    def test_contagens_e_periodos_de_escassez(self):
+        matriz = MatrizDisponibilidade.construir(self.inicio, self.fim, self.militares)
+
+        disponiveis = matriz.disponiveis_por_dia()
+        self.assertEqual(disponiveis[:8].tolist(), [4, 4, 3, 3, 4, 3, 4, 5])
+        self.assertEqual(disponiveis[29:].tolist(), [4, 4])
+        self.assertEqual(matriz.periodos_escassez(4), [
+            {'inicio': date(2025, 3, 3), 'fim': date(2025, 3, 4)},
+            {'inicio': date(2025, 3, 6), 'fim': date(2025, 3, 6)},
+        ])
+        self.assertEqual(
+            EscalaService.gerar_alerta_escassez_militares(self.servico, self.inicio, self.fim),
+            matriz.periodos_escassez(4)
+        )
+
+    def test_mapa_calor_de_varios_servicos(self):
+        outro = Servico.objects.create(nome='Ronda')
+        outro.militares.set(self.militares[3:])
+
+        with self.assertNumQueries(2):
+            mapa = mapa_calor_servicos([self.servico, outro], self.inicio, self.fim, minimo=2)
+
+        self.assertEqual(mapa[outro.pk]['total'], 2)
+        self.assertEqual(mapa[outro.pk]['disponiveis'][29:].tolist(), [1, 1])
+        self.assertEqual(mapa[outro.pk]['niveis'][29:].tolist(), [3, 3])
+        self.assertEqual(mapa[self.servico.pk]['periodos'], [])
+
+
+class IndiceDispensasTest(TestCase):
+    def test_equivale_a_percorrer_as_dispensas(self):
+        inicio = date(2025, 6, 1)
+        dispensas = [
+            ('A', date(2025, 5, 20), date(2025, 6, 3), 'Férias'),
+            ('A', date(2025, 6, 2), date(2025, 6, 10), 'Curso'),
+            ('A', date(2025, 6, 20), date(2025, 6, 21), 'Baixa'),
+            ('B', date(2025, 6, 5), date(2025, 6, 5), 'Consulta'),
+            ('C', date(2025, 6, 8), date(2025, 7, 15), 'Férias'),
+        ]
+        indice = IndiceDispensas(inicio, date(2025, 6, 30), dispensas)
+
+        dias = [inicio + timedelta(days=d) for d in range(30)]
+        for dia in dias:
+            esperados = {nim for nim, a, b, _ in dispensas if a <= dia <= b}
+            self.assertEqual(indice.dispensados_em(dia), esperados)
+            motivo = indice.dispensa_em('A', dia)
+            self.assertEqual(motivo is not None, 'A' in esperados)
+        self.assertEqual(indice.dispensa_em('A', date(2025, 6, 3))[2], 'Férias')
+        self.assertEqual(indice.dispensa_em('A', date(2025, 6, 5))[2], 'Curso')
+        self.assertEqual(
+            indice.contagem_por_dia(),
+            [len({nim for nim, a, b, _ in dispensas if a <= dia <= b}) for dia in dias]
+        )
+        self.assertEqual(indice.contagem_por_dia(nims=['B']), [1 if dia == date(2025, 6, 5) else 0 for dia in dias])
+        self.assertEqual(indice.contagem_intervalo(date(2025, 6, 11), date(2025, 6, 19)), 1)
+        self.assertEqual(indice.contagem_intervalo(date(2025, 6, 4), date(2025, 6, 8)), 3)
+        for nim in ('A', 'B', 'C'):
+            self.assertEqual(
+                indice.expandir(nim),
+                {dia: indice.dispensa_em(nim, dia)[2] for dia in dias if indice.em_dispensa(nim, dia)}
+            )
+
+    def test_mapa_de_dispensas_partilhado_pelos_servicos(self):
+        militares = criar_militares(4, 60000000)
+        servicos = [Servico.objects.create(nome=nome, tipo_escalas='A') for nome in ('Guarda', 'Piquete')]
+        servicos[0].militares.set(militares)
+        servicos[1].militares.set(militares[2:])
+        inicio = date(2030, 3, 1)
+        Dispensa.objects.create(militar=militares[2], data_inicio=date(2030, 2, 20), data_fim=date(2030, 3, 3), motivo='Férias')
+        Dispensa.objects.create(militar=militares[2], data_inicio=date(2030, 3, 2), data_fim=date(2030, 3, 5), motivo='Curso')
+
+        with self.assertNumQueries(2):
+            mapa = construir_mapa_dispensas(servicos, inicio, date(2030, 3, 31))
+
+        linha = mapa[servicos[0]]['militares'][militares[2]]
+        self.assertIs(mapa[servicos[1]]['militares'][militares[2]], linha)
+        self.assertEqual(
+            linha,
+            {inicio + timedelta(days=d): {'motivo': 'Férias' if d < 3 else 'Curso'} for d in range(5)}
+        )
+        resumo = mapa[servicos[1]]['resumo']
+        self.assertEqual((resumo['total'][inicio], resumo['dispensados'][inicio], resumo['disponiveis'][inicio]), (2, 1, 1))
+        self.assertNotIn(date(2030, 3, 6), resumo['dispensados'])
+
+
+class CacheFeriadosTest(TestCase):
+    def setUp(self):
+        limpar_cache_feriados()
+
+    def tearDown(self):
+        limpar_cache_feriados()
+
+    def test_cache_por_ano_e_invalidacao(self):
+        inicio, fim = date(2030, 1, 1), date(2031, 12, 31)
+        with self.assertNumQueries(2):
+            feriados = conjunto_feriados(inicio, fim)
+        self.assertIsInstance(feriados, frozenset)
+        self.assertIn(date(2030, 4, 19), feriados)  # Sexta-feira Santa de 2030
+        self.assertIn(date(2031, 12, 25), feriados)
+        with self.assertNumQueries(0):
+            self.assertEqual(obter_feriados(inicio, fim), sorted(feriados))
+            self.assertEqual(conjunto_feriados(date(2030, 6, 1), date(2030, 6, 30)), {date(2030, 6, 10), date(2030, 6, 20)})  # Dia de Portugal e Corpo de Deus
+
+        with self.captureOnCommitCallbacks(execute=True):
+            feriado = Feriado.objects.create(nome='Feriado Municipal', data=date(2030, 6, 13))
+        self.assertIn(feriado.data, conjunto_feriados(inicio, fim))
+        with self.captureOnCommitCallbacks(execute=True):
+            feriado.delete()
+        self.assertNotIn(date(2030, 6, 13), conjunto_feriados(inicio, fim))
+
+    def test_gravacao_revertida_nao_fica_em_cache(self):
+        inicio, fim = date(2030, 1, 1), date(2030, 12, 31)
+        conjunto_feriados(inicio, fim)
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                Feriado.objects.create(nome='Feriado Municipal', data=date(2030, 6, 13))
+                conjunto_feriados(inicio, fim)
+                raise RuntimeError('gravação cancelada')
+        self.assertNotIn(date(2030, 6, 13), conjunto_feriados(inicio, fim))
+
+    def test_cache_expira_para_alteracoes_noutros_processos(self):
+        inicio, fim = date(2030, 1, 1), date(2030, 12, 31)
+        conjunto_feriados(inicio, fim)
+        # bulk_create não dispara sinais, como uma alteração feita noutro processo
+        Feriado.objects.bulk_create([Feriado(nome='Feriado Municipal', data=date(2030, 6, 13))])
+        self.assertNotIn(date(2030, 6, 13), conjunto_feriados(inicio, fim))
+        with self.settings(FERIADOS_CACHE_SEGUNDOS=0):
+            self.assertIn(date(2030, 6, 13), conjunto_feriados(inicio, fim))
+
+
+class CalendarioDiasTest(TestCase):
+    def setUp(self):
+        limpar_cache_feriados()
+
+    def tearDown(self):
+        limpar_cache_feriados()
+
+    def test_classificacao_meses_e_escalas(self):
+        inicio, fim = date(2030, 1, 28), date(2030, 3, 5)
+        calendario = calendario_dias(inicio, fim)
+        self.assertIs(calendario_dias(inicio, fim), calendario)
+
+        feriados = conjunto_feriados(inicio, fim)
+        dia = inicio
+        while dia <= fim:
+            esperado = 'feriado' if dia in feriados else ('fim_semana' if dia.weekday() >= 5 else 'util')
+            self.assertEqual(calendario.tipo_dia(dia), esperado)
+            dia += timedelta(days=1)
+
+        self.assertEqual(calendario.tipo_dia(date(2030, 3, 5)), 'feriado')  # Carnaval de 2030
+        self.assertEqual(
+            [(mes, i, f) for mes, i, f in calendario.meses()],
+            [(date(2030, 1, 1), 0, 4), (date(2030, 2, 1), 4, 32), (date(2030, 3, 1), 32, 37)],
+        )
+        dias_escala = calendario.dias_escala()
+        self.assertEqual(len(dias_escala['escala_a']) + len(dias_escala['escala_b']), len(calendario))
+        self.assertIn(date(2030, 3, 5), dias_escala['escala_b'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Feriado.objects.create(nome='Feriado Municipal', data=date(2030, 2, 13))
+        self.assertEqual(calendario_dias(inicio, fim).tipo_dia(date(2030, 2, 13)), 'feriado')
@@ -0,0 +1,20 @@
+from core.models import Militar
+
+
+def criar_militares(n, prefixo, **campos):
+    """
+    Cria `n` militares de teste com NIMs consecutivos a partir de `prefixo` (um número de 8 dígitos),
+    chamados "Militar 0", "Militar 1", ...; o telefone e o email são derivados do NIM.
+    `campos` substitui os valores comuns (por exemplo, `posto`).
+    """
+    valores = {'posto': 'Sold', 'funcao': 'Condutor', **campos}
+    return [
+        Militar.objects.create(
+            nim=f'{prefixo + i}',
+            nome=f'Militar {i}',
+            telefone=900000000 + prefixo + i,
+            email=f'militar{prefixo + i}@exemplo.com',
+            **valores
+        )
+        for i in range(n)
+    ]